@@ -0,0 +1 @@
+default_app_config = 'distribute_patients.apps.DistributePatientsConfig'
@@ -0,0 +1,18 @@
+"""which patient acuity flags are balanced across rounders, and how heavily.  ACUITY_DIMENSIONS lists
+(flag, weight) pairs from simulation.ACUITY_FLAGS; unlisted flags are still counted in every census but get weight 0,
+so they don't pull on where patients go"""
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .simulation import ACUITY_FLAGS, DEFAULT_WEIGHTS
+
+DEFAULT_DIMENSIONS = [(flag, weight) for flag, weight in zip(ACUITY_FLAGS, DEFAULT_WEIGHTS) if weight]
+
+
+def get_acuity_weights():
+    """the configured weights as a tuple along ACUITY_FLAGS"""
+    weights = dict(getattr(settings, 'ACUITY_DIMENSIONS', DEFAULT_DIMENSIONS))
+    if unknown_flags := set(weights) - set(ACUITY_FLAGS):
+        raise ImproperlyConfigured(f'ACUITY_DIMENSIONS names {", ".join(sorted(unknown_flags))}, which are not '
+                                   f'among the acuity flags {", ".join(ACUITY_FLAGS)}')
+    return tuple(float(weights.get(flag, 0)) for flag in ACUITY_FLAGS)
@@ -1,3 +1,131 @@
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connection
+from django.urls import reverse
+from django.utils.functional import cached_property
+from django.utils.html import format_html
 
-# Register your models here.
+from .models import Distribution, Patient, PatientAssignmentLineItem, Provider
+from .simulation import ACUITY_FLAGS
+
+
+class EstimatedCountPaginator(Paginator):
+    """never runs an unbounded COUNT(*): unfiltered postgres tables use the planner's row estimate, everything
+    else is counted up to count_cap rows, past which the last pages are simply not linked"""
+    count_cap = 10000
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is None:
+            return super().count
+        if connection.vendor == 'postgresql' and not query.where:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [self.object_list.model._meta.db_table])
+                row = cursor.fetchone()
+            if row and row[0] > self.count_cap:
+                return int(row[0])
+        return self.object_list.order_by()[:self.count_cap].count()
+
+
+def format_census(census):
+    if census is None:
+        return '-'
+    total, CCU, COVID = (f'{value:g}' if value is not None else '-' for value in
+                         (census.total, census.CCU, census.COVID))
+    return f'{total} ({CCU}) [{COVID}]'
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+
+
+class LineItemCensusColumns:
+    """census columns read from select_related censuses, shown as total (CCU) [COVID]"""
+
+    def starting(self, line_item):
+        return format_census(line_item.starting_census)
+
+    def optimal(self, line_item):
+        return format_census(line_item.optimal_census)
+
+    def assigned(self, line_item):
+        return format_census(line_item.assigned_census)
+
+
+class PatientAssignmentLineItemInline(LineItemCensusColumns, admin.TabularInline):
+    """read-only foreign keys: a select or autocomplete widget costs a query per row"""
+    model = PatientAssignmentLineItem
+    fields = ['position_in_batting_order', 'provider', 'starting', 'optimal', 'assigned']
+    readonly_fields = ['provider', 'starting', 'optimal', 'assigned']
+    ordering = ['position_in_batting_order']
+    extra = 0
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('provider', 'starting_census', 'optimal_census',
+                                                            'assigned_census')
+
+
+class PatientInline(admin.TabularInline):
+    """read-only foreign keys, as on the line item inline; the acuity flags stay editable"""
+    model = Patient
+    fields = ['number_designation', *ACUITY_FLAGS, 'bounce_to', 'assigned_to']
+    readonly_fields = ['bounce_to', 'assigned_to']
+    ordering = ['number_designation']
+    extra = 0
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('bounce_to', 'patient_assignment_line_item__provider')
+
+    def assigned_to(self, patient):
+        line_item = patient.patient_assignment_line_item
+        return line_item.provider if line_item else '-'
+
+
+@admin.register(Distribution)
+class DistributionAdmin(LargeTableAdmin):
+    list_display = ['id', 'date', 'count_to_distribute', 'snapshot_version']
+    list_filter = ['date']
+    exclude = ['snapshot']
+    readonly_fields = ['snapshot_version', 'patients']
+    inlines = [PatientAssignmentLineItemInline, PatientInline]
+    ordering = ['-id']
+
+    def patients(self, distribution):
+        """a link to the patient changelist, which pages and filters the patients listed inline"""
+        url = reverse('admin:distribute_patients_patient_changelist') + f'?distribution__id__exact={distribution.id}'
+        return format_html('<a href="{}">{} patients</a>', url, distribution.patient_set.count())
+
+
+@admin.register(PatientAssignmentLineItem)
+class PatientAssignmentLineItemAdmin(LineItemCensusColumns, LargeTableAdmin):
+    list_display = ['id', 'distribution', 'provider', 'position_in_batting_order', 'starting', 'optimal',
+                    'assigned']
+    list_select_related = ['provider', 'starting_census', 'optimal_census', 'assigned_census']
+    list_filter = ['distribution__date', 'provider']
+    autocomplete_fields = ['provider']
+    raw_id_fields = ['distribution', 'starting_census', 'optimal_census', 'assigned_census', 'allocated_counts']
+    ordering = ['-distribution_id', 'position_in_batting_order']
+
+
+@admin.register(Patient)
+class PatientAdmin(LargeTableAdmin):
+    list_display = ['id', 'distribution', 'number_designation', 'CCU', 'COVID', 'bounce_to', 'assigned_to']
+    list_select_related = ['bounce_to', 'patient_assignment_line_item__provider']
+    list_filter = ['distribution__date', 'bounce_to']
+    autocomplete_fields = ['bounce_to']
+    raw_id_fields = ['distribution', 'patient_assignment_line_item']
+    ordering = ['-distribution_id', 'number_designation']
+
+    def assigned_to(self, patient):
+        line_item = patient.patient_assignment_line_item
+        return line_item.provider if line_item else '-'
+
+
+@admin.register(Provider)
+class ProviderAdmin(LargeTableAdmin):
+    list_display = ['abbreviation']
+    search_fields = ['abbreviation']  # backs the autocomplete_fields above
+    ordering = ['abbreviation']
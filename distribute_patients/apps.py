@@ -1,5 +1,14 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class DistributePatientsConfig(AppConfig):
     name = 'distribute_patients'
+
+    def ready(self):
+        from . import limits  # registers its system check
+        if settings.DEBUG:  # dev servers announce their setup; settings modules themselves stay side-effect free
+            print(f'debug is {settings.DEBUG}')
+            for host in settings.ALLOWED_HOSTS:
+                print(host)
+            print(settings.DATABASES['default']['ENGINE'])
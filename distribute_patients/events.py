@@ -0,0 +1,131 @@
+"""server-sent events for the assignment board.  django 3.0 has no async views, so AssignmentEventsApp is a plain
+ASGI app that asgi.py mounts beside django's.  one AssignmentBroadcaster per process polls the current
+distribution's snapshot and, when it changes, encodes a single event that every connected viewer is sent, so
+viewers cost a queue put each rather than a render each.
+
+events are 'snapshot' (the whole snapshot, see Distribution.freeze_snapshot; sent on connect and when a new
+distribution becomes current) and 'diff' ({'id', 'changed': changed line items, 'removed': providers})"""
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+EVENTS_PATH = '/distribute/patient_assignments/events/'
+
+
+def load_current_snapshot():
+    """(distribution id, snapshot json) of the current distribution, or (None, None)"""
+    from .models import Distribution
+    close_old_connections()
+    return Distribution.objects.order_by('-id').values_list('id', 'snapshot').first() or (None, None)
+
+
+def diff_snapshots(old_snapshot, new_snapshot):
+    """the line items of new_snapshot that differ from old_snapshot's, and the providers it no longer has"""
+    old_line_items = {line_item['provider']: line_item for line_item in old_snapshot['line_items']}
+    new_providers = {line_item['provider'] for line_item in new_snapshot['line_items']}
+    return {'id': new_snapshot['id'],
+            'changed': [line_item for line_item in new_snapshot['line_items']
+                        if old_line_items.get(line_item['provider']) != line_item],
+            'removed': [provider for provider in old_line_items if provider not in new_providers]}
+
+
+def encode_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'.encode()
+
+
+class AssignmentBroadcaster:
+    """polls while anyone is listening and fans each change out to the listeners' queues"""
+    queue_size = 16
+
+    def __init__(self, poll_seconds=None):
+        self.poll_seconds = poll_seconds or getattr(settings, 'ASSIGNMENT_EVENTS_POLL_SECONDS', 2)
+        self.listeners = set()
+        self.snapshot_event = None  # encoded 'snapshot' event for the current state, sent to new listeners
+        self.distribution_id, self.snapshot_json = None, None
+        self.poll_task = None
+
+    async def subscribe(self):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        if self.snapshot_event is None:
+            await self.poll_once()
+        if self.snapshot_event is not None:
+            queue.put_nowait(self.snapshot_event)
+        self.listeners.add(queue)
+        if self.poll_task is None or self.poll_task.done():
+            self.poll_task = asyncio.ensure_future(self.poll())
+        return queue
+
+    def unsubscribe(self, queue):
+        self.listeners.discard(queue)
+
+    async def poll(self):
+        while self.listeners:
+            await asyncio.sleep(self.poll_seconds)
+            await self.poll_once()
+        self.snapshot_event = None  # nobody is watching, so the next listener starts from a fresh read
+        self.distribution_id, self.snapshot_json = None, None
+
+    async def poll_once(self):
+        distribution_id, snapshot_json = await sync_to_async(load_current_snapshot)()
+        if (distribution_id, snapshot_json) == (self.distribution_id, self.snapshot_json):
+            return
+        new_snapshot = json.loads(snapshot_json) if snapshot_json else None
+        old_snapshot = json.loads(self.snapshot_json) if self.snapshot_json else None
+        if new_snapshot and old_snapshot and distribution_id == self.distribution_id:
+            event = encode_event('diff', diff_snapshots(old_snapshot, new_snapshot))
+        else:
+            event = encode_event('snapshot', new_snapshot or {'id': distribution_id, 'line_items': []})
+        self.distribution_id, self.snapshot_json = distribution_id, snapshot_json
+        self.snapshot_event = encode_event('snapshot', new_snapshot or {'id': distribution_id, 'line_items': []})
+        self.publish(event)
+
+    def publish(self, event):
+        for queue in self.listeners:
+            if queue.full():  # a viewer this far behind gets the whole snapshot instead of the diffs it missed
+                while not queue.empty():
+                    queue.get_nowait()
+                event_for_queue = self.snapshot_event
+            else:
+                event_for_queue = event
+            queue.put_nowait(event_for_queue)
+
+
+class AssignmentEventsApp:
+    """ASGI app serving EVENTS_PATH as an event stream and handing every other request to django_app"""
+    keepalive_seconds = 15
+
+    def __init__(self, django_app, broadcaster=None):
+        self.django_app = django_app
+        self.broadcaster = broadcaster
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] != EVENTS_PATH:
+            return await self.django_app(scope, receive, send)
+        if self.broadcaster is None:  # created here, inside the server's event loop
+            self.broadcaster = AssignmentBroadcaster()
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'),
+                                (b'x-accel-buffering', b'no')]})
+        queue = await self.broadcaster.subscribe()
+        disconnect = asyncio.ensure_future(self.wait_for_disconnect(receive))
+        try:
+            while not disconnect.done():
+                next_event = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait([next_event, disconnect], timeout=self.keepalive_seconds,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if next_event in done:
+                    await send({'type': 'http.response.body', 'body': next_event.result(), 'more_body': True})
+                else:
+                    next_event.cancel()
+                    if not disconnect.done():
+                        await send({'type': 'http.response.body', 'body': b': keepalive\n\n', 'more_body': True})
+        finally:
+            self.broadcaster.unsubscribe(queue)
+            disconnect.cancel()
+
+    async def wait_for_disconnect(self, receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
@@ -1,25 +1,42 @@
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Submit, Layout, Div, Field
 from django import forms
+from django.core.exceptions import ValidationError
+from django.core.validators import MaxValueValidator
+from django.db import transaction
 from django.urls import reverse
 from django.utils import timezone
 
-from .models import Distribution, Patient, Provider, PatientAssignmentLineItem, OptimalCensus, StartingCensus, \
-    AssignedCensus
+from . import limits
+from .models import Distribution, Patient, Provider, PatientAssignmentLineItem, StartingCensus
+from .simulation import ACUITY_FLAGS
 
 
 class RounderForm(forms.Form):
     id = forms.IntegerField(required=False)
     abbreviation = forms.CharField(max_length=6, required=False)
-    starting_total = forms.IntegerField(max_value=40, min_value=0, required=False)
-    starting_CCU = forms.IntegerField(max_value=40, min_value=0, required=False)
-    starting_COVID = forms.IntegerField(max_value=40, min_value=0, required=False)
+    starting_total = forms.IntegerField(min_value=0, required=False)
+    starting_CCU = forms.IntegerField(min_value=0, required=False)
+    starting_COVID = forms.IntegerField(min_value=0, required=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        max_starting_census = limits.get_max_starting_census()
+        if max_starting_census is not None:
+            for field_name in ['starting_total', 'starting_CCU', 'starting_COVID']:
+                field = self.fields[field_name]
+                field.max_value = max_starting_census
+                field.validators.append(MaxValueValidator(max_starting_census))
+                field.widget.attrs['max'] = max_starting_census
+
+    def has_line_item_data(self):
+        return bool(self.cleaned_data['abbreviation']) and \
+               type(self.cleaned_data['starting_total']) == int and \
+               type(self.cleaned_data['starting_CCU']) == int and \
+               type(self.cleaned_data['starting_COVID']) == int
 
     def save(self, *args, **kwargs):
-        if self.cleaned_data['abbreviation'] and \
-                type(self.cleaned_data['starting_total']) == int and \
-                type(self.cleaned_data['starting_CCU']) == int and \
-                type(self.cleaned_data['starting_COVID']) == int:
+        if self.has_line_item_data():
             provider = Provider.objects.get_or_create(abbreviation=self.cleaned_data['abbreviation'])[0]
             starting_census = StartingCensus.objects.create(total=self.cleaned_data['starting_total'],
                                                             CCU=self.cleaned_data[
@@ -30,47 +47,57 @@ class RounderForm(forms.Form):
             return None
 
 
+def build_rounder_form_helper():
+    helper = FormHelper()
+    helper.form_id = 'id_rounder_form'  # apparently don't show up when no form tag
+    helper.form_class = 'dummy-form-class'
+    helper.form_tag = False
+    helper.disable_csrf = True
+    helper.form_show_labels = False
+    helper.layout = Layout(
+        Div(
+            Field('id'),  # hidden id field to add form id to POST data, widget set per form
+            Field('abbreviation', id='id_rounder_abbreviation_field', wrapper_class='abbreviation-input col-3'),
+            Field('starting_total', id='id_starting_total_field', placeholder='total', wrapper_class='col-2'),
+            Field('starting_CCU', id='id_starting_CCU_field', placeholder='CCU', wrapper_class='col-2'),
+            Field('starting_COVID', id='id_starting_COVID_field', placeholder='COVID', wrapper_class='col-2'),
+            id='id_rounder_form', css_class='row dummy-class'),
+    )
+    return helper
+
+
 class BaseRounderFormSet(forms.BaseFormSet):
+    helper = build_rounder_form_helper()  # shared by every form; only the per-form widget attrs differ
+
     def __init__(self, *args, **kwargs):
-        self.extra = 12
+        self.extra = limits.get_rounder_form_count()
         super().__init__(*args, **kwargs)
         for index, form in enumerate(self.forms):
             form.id = index + 1
-            form.helper = FormHelper()
-            form.helper.form_id = 'id_rounder_form'  # apparently don't show up when no form tag
-            form.helper.form_class = 'dummy-form-class'
-            form.helper.form_tag = False
-            form.helper.disable_csrf = True
-            form.helper.form_show_labels = False
-            form.helper.layout = Layout(
-                Div(
-                    Field('id', type='hidden', value=form.id),  # hidden id field to add form id to POST data
-                    Field('abbreviation', id='id_rounder_abbreviation_field', placeholder=f'rounder {form.id}',
-                          wrapper_class='abbreviation-input col-3'),
-                    Field('starting_total', id='id_starting_total_field', placeholder='total', wrapper_class='col-2'),
-                    Field('starting_CCU', id='id_starting_CCU_field', placeholder='CCU', wrapper_class='col-2'),
-                    Field('starting_COVID', id='id_starting_COVID_field', placeholder='COVID', wrapper_class='col-2'),
-                    id='id_rounder_form', css_class='row dummy-class'),
-            )
+            form.helper = self.helper
+            form.fields['id'].widget = forms.HiddenInput(attrs={'value': form.id})
+            form.fields['abbreviation'].widget.attrs['placeholder'] = f'rounder {form.id}'
 
     def save(self, *args, **kwargs):
-        distribution = Distribution.objects.create()
-        for index, form in enumerate(self.forms):
-            if form.is_valid():
-                line_item = form.save()
-                if line_item and not distribution.line_items.filter(
-                        provider__abbreviation=line_item.provider.abbreviation):
-                    line_item.distribution = distribution
-                    line_item.position_in_batting_order = index + 1
-                    optimal_census = OptimalCensus.objects.create(total=line_item.starting_census.total,
-                                                                  CCU=line_item.starting_census.CCU,
-                                                                  COVID=line_item.starting_census.COVID)
-                    line_item.optimal_census = optimal_census
-                    assigned_census = AssignedCensus.objects.create(total=line_item.starting_census.total,
-                                                                    CCU=line_item.starting_census.CCU,
-                                                                    COVID=line_item.starting_census.COVID)
-                    line_item.assigned_census = assigned_census
-                    line_item.save()
+        """builds the new distribution's line items in a constant number of queries: the first form for each
+        abbreviation wins, providers are upserted together and censuses and line items are bulk created"""
+        with transaction.atomic():
+            distribution = Distribution.objects.create()
+            taken_abbreviations = set(distribution.line_items.values_list('provider__abbreviation', flat=True))
+            rounders = []
+            for index, form in enumerate(self.forms):
+                if form.is_valid() and form.has_line_item_data() and \
+                        form.cleaned_data['abbreviation'] not in taken_abbreviations:
+                    taken_abbreviations.add(form.cleaned_data['abbreviation'])
+                    rounders.append((index + 1, form.cleaned_data))
+            providers = Provider.objects.get_or_create_many(
+                cleaned_data['abbreviation'] for position, cleaned_data in rounders)
+            PatientAssignmentLineItem.objects.create_line_items(distribution=distribution, line_item_specs=[
+                dict(provider=providers[cleaned_data['abbreviation']], starting_total=cleaned_data['starting_total'],
+                     starting_CCU=cleaned_data['starting_CCU'], starting_COVID=cleaned_data['starting_COVID'],
+                     position_in_batting_order=position)
+                for position, cleaned_data in rounders])
+        return distribution
 
 
 class PatientCountForm(forms.ModelForm):
@@ -98,30 +125,161 @@ class PatientDesignateForm(forms.ModelForm):
         patient.save()
 
 
+DESIGNATION_FLAG_TOKENS = {'c': 'CCU', 'ccu': 'CCU', 'v': 'COVID', 'covid': 'COVID', 'i': 'isolation',
+                           't': 'telemetry', 'h': 'high_acuity'}
+
+
+def parse_designation_list(designation_list, providers_by_abbreviation, check_number_designation):
+    """parses the compact designation format, one patient per line: its number followed by any of c (CCU), v (COVID),
+    i (isolation), t (telemetry), h (high acuity) and b:<abbreviation> (bounceback), eg '12 c v b:provA'.
+    check_number_designation(number) returns an error message for numbers the caller can't accept, or None.
+    returns ({number: ({acuity flag: bool}, bounce_to)}, errors)"""
+    designations, errors = {}, []
+    for line_number, line in enumerate(designation_list.splitlines(), start=1):
+        tokens = line.split()
+        if not tokens:
+            continue
+        try:
+            number_designation = int(tokens[0])
+        except ValueError:
+            errors.append(f'line {line_number}: "{tokens[0]}" is not a patient number')
+            continue
+        if number_error := check_number_designation(number_designation):
+            errors.append(f'line {line_number}: {number_error}')
+            continue
+        if number_designation in designations:
+            errors.append(f'line {line_number}: patient {number_designation} is listed twice')
+            continue
+        flags, bounce_to = dict.fromkeys(ACUITY_FLAGS, False), None
+        for token in tokens[1:]:
+            if token.lower() in DESIGNATION_FLAG_TOKENS:
+                flags[DESIGNATION_FLAG_TOKENS[token.lower()]] = True
+            elif token.lower().startswith('b:') and token[2:] in providers_by_abbreviation:
+                bounce_to = providers_by_abbreviation[token[2:]]
+            elif token.lower().startswith('b:'):
+                errors.append(f'line {line_number}: {token[2:]} is not rounding on this distribution')
+            else:
+                errors.append(f'line {line_number}: "{token}" should be c, v, i, t, h or b:<abbreviation>')
+        designations[number_designation] = (flags, bounce_to)
+    return designations, errors
+
+
+class PatientDesignationListForm(forms.Form):
+    """compact alternative to the designate formset, in the parse_designation_list format.  patients left off the
+    list are saved as neg/neg non-bouncebacks"""
+    designation_list = forms.CharField(required=False, widget=forms.Textarea(
+        attrs={'rows': 6, 'placeholder': '12 c v b:provA'}))
+    form_id = 'id_designation_list_form'
+    submit_name = 'submit_designation_list'
+    url_name = 'distribute:designate_patients'
+
+    def __init__(self, *args, distribution, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.distribution = distribution
+        self.helper = FormHelper()
+        self.helper.form_id = self.form_id
+        self.helper.form_method = 'post'
+        self.helper.form_action = reverse(self.url_name)
+        self.helper.add_input(Submit(self.submit_name, 'Submit list'))
+
+    def check_number_designation(self, number_designation):
+        if number_designation not in self.patients_by_number:
+            return f'there is no patient {number_designation}'
+
+    def clean_designation_list(self):
+        self.patients_by_number = {patient.number_designation: patient
+                                   for patient in self.distribution.patient_set.all()}
+        providers_by_abbreviation = {provider.abbreviation: provider for provider in Provider.objects.filter(
+            patientassignmentlineitem__distribution=self.distribution)}
+        designations, errors = parse_designation_list(self.cleaned_data['designation_list'],
+                                                      providers_by_abbreviation, self.check_number_designation)
+        if errors:
+            raise ValidationError(errors)
+        return designations
+
+    def save(self):
+        """clears every patient's flags and bounceback, then sets each acuity flag on its patients with one update
+        and the bouncebacks with a bulk update; a bulk update of every patient and flag costs more to build than
+        to run"""
+        ids_by_flag, bouncebacks = {flag: [] for flag in ACUITY_FLAGS}, []
+        for number_designation, (flags, bounce_to) in self.cleaned_data['designation_list'].items():
+            patient = self.patients_by_number[number_designation]
+            for flag in ACUITY_FLAGS:
+                if flags[flag]:
+                    ids_by_flag[flag].append(patient.id)
+            if bounce_to:
+                patient.bounce_to = bounce_to
+                bouncebacks.append(patient)
+        with transaction.atomic():
+            self.distribution.patient_set.update(bounce_to=None, **dict.fromkeys(ACUITY_FLAGS, False))
+            for flag, patient_ids in ids_by_flag.items():
+                if patient_ids:
+                    Patient.objects.filter(id__in=patient_ids).update(**{flag: True})
+            Patient.objects.bulk_update(bouncebacks, ['bounce_to'])
+
+
+class LatePatientsForm(PatientDesignationListForm):
+    """patients arriving after the distribution was assigned, in the parse_designation_list format with new
+    numbers; neg/neg patients are listed by number alone"""
+    form_id = 'id_late_patients_form'
+    submit_name = 'submit_late_patients'
+    url_name = 'distribute:add_late_patients'
+
+    def check_number_designation(self, number_designation):
+        if number_designation in self.patients_by_number:
+            return f'patient {number_designation} has already been distributed'
+
+    def clean_designation_list(self):
+        if self.distribution.snapshot is None:
+            raise ValidationError('Distribute the designated patients before adding late ones')
+        designations = super().clean_designation_list()
+        if not designations:
+            raise ValidationError('List at least one new patient')
+        return designations
+
+    def save(self):
+        return self.distribution.add_late_patients([
+            dict(flags, number_designation=number_designation, bounce_to=bounce_to)
+            for number_designation, (flags, bounce_to) in self.cleaned_data['designation_list'].items()])
+
+
+def build_patient_designate_form_helper():
+    helper = FormHelper()
+    helper.form_id = 'id_designate_patient_form'
+    helper.form_class = 'dummy-form-class'
+    helper.form_tag = False
+    helper.disable_csrf = True
+    helper.layout = Layout(
+        Div(
+            Field('id'),  # hidden id field to add id to POST data, widget set per form
+            Field('CCU', wrapper_class='CCU-checkbox'),
+            css_class='form-row'),
+        Div(
+            Field('COVID', wrapper_class='COVID-checkbox'),
+            css_class='form-row'),
+        Div(
+            Field('bounce_to', wrapper_class='bounceback-dropdown'),
+            css_class='form-row'),
+
+    )
+    return helper
+
+
 class BasePatientDesignateFormSet(forms.BaseModelFormSet):
+    helper = build_patient_designate_form_helper()  # shared by every form; only the per-form widget attrs differ
+
     def __init__(self, *args, **kwargs):
         distribution = Distribution.objects.get(id=kwargs.pop('distribution_id'))
         self.extra = 0
         super().__init__(*args, **kwargs)
         self.queryset = distribution.patient_set.all()
+        bounce_to_queryset = Provider.objects.filter(
+            patientassignmentlineitem__in=distribution.get_ordered_line_items())
+        bounce_to_choices = None
         for index, form in enumerate(self.forms):
-            form.fields['bounce_to'].queryset = Provider.objects.filter(
-                patientassignmentlineitem__in=distribution.get_ordered_line_items())
-            form.helper = FormHelper()
-            form.helper.form_id = 'id_designate_patient_form'
-            form.helper.form_class = 'dummy-form-class'
-            form.helper.form_tag = False
-            form.helper.disable_csrf = True
-            form.helper.layout = Layout(
-                Div(
-                    Field('id', type='hidden', value=form.instance.id),  # hidden id field to add id to POST data
-                    Field('CCU', wrapper_class='CCU-checkbox'),
-                    css_class='form-row'),
-                Div(
-                    Field('COVID', wrapper_class='COVID-checkbox'),
-                    css_class='form-row'),
-                Div(
-                    Field('bounce_to', wrapper_class='bounceback-dropdown'),
-                    css_class='form-row'),
-
-            )
+            form.fields['bounce_to'].queryset = bounce_to_queryset
+            if bounce_to_choices is None:  # evaluated once, rather than once per rendered dropdown
+                bounce_to_choices = list(form.fields['bounce_to'].choices)
+            form.fields['bounce_to'].choices = bounce_to_choices
+            form.helper = self.helper
+            form.fields['id'].widget = forms.HiddenInput(attrs={'value': form.instance.id})
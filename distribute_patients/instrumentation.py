@@ -0,0 +1,77 @@
+"""timing hooks for the phases of Distribution.assign_all_patients.  each phase runs inside timed_phase, which, when
+any hook is registered, records its wall time and query count and hands them to every hook as
+hook(phase, distribution, seconds, query_count).  hooks come from register_phase_hook or the dotted paths in the
+ASSIGNMENT_PHASE_HOOKS setting; with none registered a phase costs one list check"""
+import contextlib
+import logging
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connection
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+_registered_hooks = []
+_phase_hooks = None  # settings hooks then registered hooks, rebuilt after either changes
+_disabled = contextlib.nullcontext()
+
+
+def register_phase_hook(hook):
+    global _phase_hooks
+    if hook not in _registered_hooks:
+        _registered_hooks.append(hook)
+        _phase_hooks = None
+
+
+def unregister_phase_hook(hook):
+    global _phase_hooks
+    if hook in _registered_hooks:
+        _registered_hooks.remove(hook)
+        _phase_hooks = None
+
+
+def get_phase_hooks():
+    global _phase_hooks
+    if _phase_hooks is None:
+        _phase_hooks = [import_string(hook_path) for hook_path in getattr(settings, 'ASSIGNMENT_PHASE_HOOKS', [])] + \
+                       _registered_hooks
+    return _phase_hooks
+
+
+@receiver(setting_changed)
+def reset_phase_hooks(setting, **kwargs):
+    global _phase_hooks
+    if setting == 'ASSIGNMENT_PHASE_HOOKS':
+        _phase_hooks = None
+
+
+def log_phase(phase, distribution, seconds, query_count):
+    """hook that logs each phase at info level to distribute_patients.instrumentation"""
+    logger.info('distribution %s %s: %.1f ms, %d queries', distribution.id, phase, seconds * 1000, query_count)
+
+
+def timed_phase(phase, distribution):
+    hooks = get_phase_hooks()
+    if not hooks:
+        return _disabled
+    return _timed_phase(phase, distribution, hooks)
+
+
+@contextlib.contextmanager
+def _timed_phase(phase, distribution, hooks):
+    query_count = 0
+
+    def count_query(execute, sql, params, many, context):
+        nonlocal query_count
+        query_count += 1
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    with connection.execute_wrapper(count_query):
+        yield
+    seconds = time.perf_counter() - start
+    for hook in hooks:
+        hook(phase, distribution, seconds, query_count)
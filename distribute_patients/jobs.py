@@ -0,0 +1,66 @@
+"""in-process runner for AssignmentJobs: a small thread pool shared by the worker process, so a large
+distribution's assignment doesn't hold its designate_patients request open.  jobs are rows, so their status
+survives the request and can be polled from any worker"""
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_min_patients():
+    """distributions with at least this many patients are assigned in the background"""
+    return getattr(settings, 'BACKGROUND_ASSIGNMENT_MIN_PATIENTS', 200)
+
+
+def get_stale_seconds():
+    return getattr(settings, 'ASSIGNMENT_JOB_STALE_SECONDS', 600)
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'ASSIGNMENT_JOB_WORKERS', 2),
+                                           thread_name_prefix='assignment-job')
+        return _executor
+
+
+def submit(job_id):
+    return get_executor().submit(run_assignment_job, job_id)
+
+
+class JobSuperseded(Exception):
+    """the job was taken over as stale while it ran (see AssignmentJobManager.enqueue)"""
+
+
+def run_assignment_job(job_id):
+    """runs one queued job to completion, recording success or the failure's traceback on the job.  success is
+    recorded in the assignment's own transaction, and only while the job is still running, so a job that was taken
+    over as stale rolls its assignment back rather than committing alongside its replacement's"""
+    from .models import AssignmentJob
+    close_old_connections()
+    try:
+        if not AssignmentJob.objects.filter(id=job_id, status=AssignmentJob.QUEUED).update(
+                status=AssignmentJob.RUNNING, started=timezone.now()):
+            return  # already picked up, or abandoned
+        job = AssignmentJob.objects.select_related('distribution').get(id=job_id)
+        try:
+            with transaction.atomic():
+                job.distribution.assign_all_patients()
+                if not AssignmentJob.objects.filter(id=job_id, status=AssignmentJob.RUNNING).update(
+                        status=AssignmentJob.SUCCEEDED, finished=timezone.now()):
+                    raise JobSuperseded()
+        except JobSuperseded:
+            pass  # already marked failed by the takeover
+        except Exception:
+            AssignmentJob.objects.filter(id=job_id, status=AssignmentJob.RUNNING).update(
+                status=AssignmentJob.FAILED, finished=timezone.now(), error=traceback.format_exc())
+    finally:
+        if threading.current_thread() is not threading.main_thread():
+            connection.close()  # pool threads each hold their own connection
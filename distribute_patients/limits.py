@@ -0,0 +1,38 @@
+"""size limits of the rounder and patient forms.  the defaults suit a single unit; LARGE_FACILITY_MODE raises them
+to hundreds of rounders and thousands of patients, and each limit can also be set on its own"""
+from django.conf import settings
+from django.core import checks
+
+ROUNDER_FORM_FIELD_COUNT = 5  # id, abbreviation and the three starting census fields
+
+
+def is_large_facility():
+    return getattr(settings, 'LARGE_FACILITY_MODE', False)
+
+
+def get_rounder_form_count():
+    """blank rounder forms offered on the set rounders page"""
+    return getattr(settings, 'ROUNDER_FORM_COUNT', 300 if is_large_facility() else 12)
+
+
+def get_max_starting_census():
+    """upper bound on a rounder's starting census fields, or None for no bound"""
+    return getattr(settings, 'MAX_STARTING_CENSUS', None if is_large_facility() else 40)
+
+
+def get_max_designate_formset_patients():
+    """distributions with more patients than this are designated with the compact list only, rather than also
+    rendering a form per patient"""
+    return getattr(settings, 'MAX_DESIGNATE_FORMSET_PATIENTS', 200)
+
+
+@checks.register()
+def check_rounder_formset_fits_upload_limit(app_configs, **kwargs):
+    field_count = get_rounder_form_count() * ROUNDER_FORM_FIELD_COUNT + 4  # plus the management form
+    if settings.DATA_UPLOAD_MAX_NUMBER_FIELDS is not None and field_count > settings.DATA_UPLOAD_MAX_NUMBER_FIELDS:
+        return [checks.Error(
+            f'{get_rounder_form_count()} rounder forms post {field_count} fields, more than '
+            f'DATA_UPLOAD_MAX_NUMBER_FIELDS ({settings.DATA_UPLOAD_MAX_NUMBER_FIELDS})',
+            hint='raise DATA_UPLOAD_MAX_NUMBER_FIELDS or lower ROUNDER_FORM_COUNT',
+            id='distribute_patients.E001')]
+    return []
@@ -0,0 +1,64 @@
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import simulation
+from ...acuity import get_acuity_weights
+from ...models import Distribution
+
+
+class Command(BaseCommand):
+    help = 'Assigns patients from pairs of rounder and patient csvs without the web flow. Files are read and ' \
+           'assigned across a worker pool; each result is saved as a new distribution with bulk inserts and ' \
+           'written to <patients csv name>_assignments.csv.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_files', nargs='+', metavar='ROUNDERS_CSV PATIENTS_CSV',
+                            help='one or more pairs of rounder and patient csvs')
+        parser.add_argument('--output-dir', default=None, help='defaults to each patients csv\'s own directory')
+        parser.add_argument('--workers', type=int, default=None)
+
+    def handle(self, *args, **options):
+        if len(options['csv_files']) % 2:
+            raise CommandError('csv files must come in rounders, patients pairs')
+        pairs = list(zip(options['csv_files'][::2], options['csv_files'][1::2]))
+        failures = 0
+        weights = get_acuity_weights()
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            futures = [executor.submit(simulation.simulate_csv, *pair, weights) for pair in pairs]
+            for (rounders_path, patients_path), future in zip(pairs, futures):
+                try:
+                    description, result, assign_seconds = future.result()
+                except (OSError, KeyError, ValueError) as error:
+                    failures += 1
+                    self.stderr.write(f'{patients_path}: failed, {error!r}')
+                    continue
+                start = time.perf_counter()
+                distribution = Distribution.objects.create()
+                distribution.save_simulation_result(description, result)
+                save_seconds = time.perf_counter() - start
+                start = time.perf_counter()
+                output_path = self.write_assignments(patients_path, options['output_dir'], description, result)
+                write_seconds = time.perf_counter() - start
+                self.stdout.write(f'{patients_path}: distribution {distribution.id}, '
+                                  f"{len(description['patients'])} patients to {len(result['line_items'])} rounders "
+                                  f'-> {output_path} (read+assign {assign_seconds * 1000:.1f} ms, '
+                                  f'save {save_seconds * 1000:.1f} ms, write {write_seconds * 1000:.1f} ms)')
+        if failures:
+            raise CommandError(f'{failures} of {len(pairs)} file pairs failed')
+
+    def write_assignments(self, patients_path, output_dir, description, result):
+        assigned_to = {number_designation: line_item['abbreviation'] for line_item in result['line_items']
+                       for number_designation in line_item['assigned_patients']}
+        stem = os.path.splitext(os.path.basename(patients_path))[0]
+        output_path = os.path.join(output_dir or os.path.dirname(patients_path), f'{stem}_assignments.csv')
+        with open(output_path, 'w', newline='') as output:
+            writer = csv.writer(output)
+            writer.writerow(['number_designation', 'CCU', 'COVID', 'bounce_to', 'assigned_to'])
+            for patient in sorted(description['patients'], key=lambda patient: patient['number_designation']):
+                writer.writerow([patient['number_designation'], int(patient['CCU']), int(patient['COVID']),
+                                 patient['bounce_to'] or '', assigned_to[patient['number_designation']]])
+        return output_path
@@ -0,0 +1,65 @@
+import statistics
+import time
+
+from django import forms
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from ...forms import RounderForm, BaseRounderFormSet, BasePatientDesignateFormSet, PatientDesignationListForm
+from ...helper_fxns import helper_fxn_create_distribution_with_4_sample_line_items
+from ...models import Distribution, Patient
+
+
+class Command(BaseCommand):
+    help = 'Times building and rendering the set_rounders and designate_patients formsets at several form counts. ' \
+           'Sample rows are created inside a transaction that is rolled back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--form-counts', type=int, nargs='+', default=[12, 50, 200])
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        for form_count in options['form_counts']:
+            self.report('set_rounders', form_count, self.time_renders(self.render_set_rounders, form_count,
+                                                                     options['repeat']))
+        with transaction.atomic():
+            helper_fxn_create_distribution_with_4_sample_line_items()
+            distribution = Distribution.objects.last()
+            for form_count in options['form_counts']:
+                distribution.patient_set.all().delete()
+                Patient.objects.bulk_create([Patient(distribution=distribution, number_designation=i + 1)
+                                             for i in range(form_count)])
+                self.report('designate_patients', form_count,
+                            self.time_renders(self.render_designate_patients, form_count, options['repeat'],
+                                              distribution=distribution))
+            transaction.set_rollback(True)
+
+    def time_renders(self, render, form_count, repeat, **kwargs):
+        timings = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            render(form_count, **kwargs)
+            timings.append(time.perf_counter() - start)
+        return timings
+
+    def render_set_rounders(self, form_count):
+        RounderFormSet = forms.formset_factory(form=RounderForm, formset=BaseRounderFormSet)
+        data = {'form-TOTAL_FORMS': form_count, 'form-INITIAL_FORMS': form_count}  # bound, so not capped at 12
+        data.update({f'form-{i}-id': i + 1 for i in range(form_count)})
+        context = {'date': timezone.localdate(), 'rounder_formset': RounderFormSet(data=data)}
+        return render_to_string('distribute_patients/set_rounders.html', context=context)
+
+    def render_designate_patients(self, form_count, distribution):
+        PatientDesignateFormSet = forms.modelformset_factory(model=Patient,
+                                                             fields=['CCU', 'COVID', 'bounce_to'],
+                                                             formset=BasePatientDesignateFormSet)
+        context = {'date': timezone.localdate(), 'ordered_line_items': distribution.get_ordered_line_items(),
+                   'formset': PatientDesignateFormSet(distribution_id=distribution.id),
+                   'designation_list_form': PatientDesignationListForm(distribution=distribution)}
+        return render_to_string('distribute_patients/designate_patients.html', context=context)
+
+    def report(self, page, form_count, timings):
+        self.stdout.write(f'{page:<20} {form_count:>5} forms: median {statistics.median(timings) * 1000:8.1f} ms, '
+                          f'min {min(timings) * 1000:8.1f} ms')
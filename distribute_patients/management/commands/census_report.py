@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import reports
+from ...models import Distribution
+
+
+class Command(BaseCommand):
+    help = "Prints a distribution's starting, optimal and assigned censuses per line item (one query) as text, " \
+           "json or csv. Defaults to the latest distribution."
+
+    def add_arguments(self, parser):
+        parser.add_argument('distribution_id', nargs='?', type=int)
+        parser.add_argument('--format', choices=sorted(reports.RENDERERS), default='text')
+        parser.add_argument('--census', nargs='+', choices=reports.CENSUSES, default=reports.CENSUSES,
+                            dest='censuses')
+
+    def handle(self, *args, **options):
+        if options['distribution_id'] is None:
+            distribution = Distribution.objects.last()
+        else:
+            distribution = Distribution.objects.filter(id=options['distribution_id']).first()
+        if distribution is None:
+            raise CommandError('No such distribution')
+        self.stdout.write(distribution.render_census_report(options['format'], censuses=options['censuses']))
@@ -0,0 +1,226 @@
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import HTTPCookieProcessor, HTTPRedirectHandler, build_opener
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.signals import got_request_exception
+from django.db import connection
+from django.db.models.signals import post_save
+from django.urls import reverse
+
+from ...models import Distribution
+
+STEPS = ['set_rounders', 'post_rounders', 'edit_count', 'post_count', 'designate_patients', 'post_designations',
+         'patient_assignments']
+
+
+class InstrumentedApplication:
+    """wsgi wrapper adding X-Query-Count and, for requests that raised, X-Exception response headers.  also
+    collects the ids of the distributions its requests create, so only those are cleaned up"""
+
+    def __init__(self, application):
+        self.application = application
+        self.local = threading.local()
+        self.created_distribution_ids = set()
+        got_request_exception.connect(self.record_exception, weak=False)
+        post_save.connect(self.record_distribution, sender=Distribution, weak=False)
+
+    def close(self):
+        got_request_exception.disconnect(self.record_exception)
+        post_save.disconnect(self.record_distribution, sender=Distribution)
+
+    def record_distribution(self, sender, instance, created, **kwargs):
+        if created and getattr(self.local, 'in_request', False):
+            self.created_distribution_ids.add(instance.id)
+
+    def record_exception(self, sender, **kwargs):
+        exception = sys.exc_info()[1]
+        if exception is not None:
+            self.local.exception = f'{type(exception).__name__}: {exception}'
+
+    def __call__(self, environ, start_response):
+        self.local.exception = None
+        self.local.in_request = True
+        query_count = 0
+
+        def count_query(execute, sql, params, many, context):
+            nonlocal query_count
+            query_count += 1
+            return execute(sql, params, many, context)
+
+        def instrumented_start_response(status, headers, exc_info=None):
+            headers = headers + [('X-Query-Count', str(query_count))]
+            if self.local.exception:
+                headers.append(('X-Exception', self.local.exception.encode('ascii', 'replace').decode()[:200]))
+            return start_response(status, headers, exc_info)
+
+        try:
+            with connection.execute_wrapper(count_query):
+                return self.application(environ, instrumented_start_response)
+        finally:
+            self.local.in_request = False
+
+
+class NoRedirectHandler(HTTPRedirectHandler):
+    """leaves redirects to the flow, so each request is timed and counted on its own"""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = 'Drives the set rounders -> edit count -> designate patients -> assignments flow with concurrent ' \
+           'virtual users against a server started in this process (or --base-url), then reports latency ' \
+           'percentiles, throughput, error rates (sqlite lock errors counted separately) and queries per request. ' \
+           'The in-process server gets a disposable copy of the database, created and destroyed around the run, ' \
+           'unless --use-configured-db, when the distributions its requests created are deleted afterwards unless ' \
+           '--keep-data. Nothing is cleaned up after a --base-url run, whose server may have other users.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20, help='concurrent virtual users')
+        parser.add_argument('--iterations', type=int, default=1, help='flows per user')
+        parser.add_argument('--rounders', type=int, default=8)
+        parser.add_argument('--patients', type=int, default=30)
+        parser.add_argument('--base-url', default=None, help='test a running server instead (no query counts)')
+        parser.add_argument('--use-configured-db', action='store_true',
+                            help='serve from the configured database rather than a disposable one')
+        parser.add_argument('--keep-data', action='store_true', help='with --use-configured-db, keep what was created')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--timeout', type=float, default=60, help='seconds before a request counts as failed')
+
+    def handle(self, *args, **options):
+        server = application = disposable_database = None
+        base_url = options['base_url']
+        if base_url is None:
+            if not options['use_configured_db']:
+                disposable_database = self.create_disposable_database()
+            server = ThreadedWSGIServer(('127.0.0.1', 0), QuietRequestHandler, allow_reuse_address=False)
+            server.daemon_threads = True
+            application = InstrumentedApplication(WSGIHandler())
+            server.set_app(application)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            base_url = f'http://127.0.0.1:{server.server_port}'
+        try:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['users']) as executor:
+                futures = [executor.submit(self.run_user, base_url, user, options) for user in range(options['users'])]
+                results = [result for future in futures for result in future.result()]
+            elapsed = time.perf_counter() - start
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+                application.close()
+            if disposable_database is not None:
+                self.destroy_disposable_database(*disposable_database)
+            elif application is not None and not options['keep_data']:
+                Distribution.objects.filter(id__in=application.created_distribution_ids).delete()
+        self.report(results, elapsed, options)
+
+    def create_disposable_database(self):
+        """switches the default connection to a freshly migrated test database, returning what
+        destroy_disposable_database needs to switch back.  sqlite gets a temporary file rather than its default
+        in-memory test database, which the server's threads would not reliably share"""
+        old_name, old_test_settings = connection.settings_dict['NAME'], dict(connection.settings_dict['TEST'])
+        if connection.vendor == 'sqlite':
+            connection.settings_dict['TEST']['NAME'] = os.path.join(tempfile.mkdtemp(), 'load_test.sqlite3')
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        return old_name, old_test_settings
+
+    def destroy_disposable_database(self, old_name, old_test_settings):
+        test_name = connection.settings_dict['TEST']['NAME']
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        if connection.vendor == 'sqlite':
+            shutil.rmtree(os.path.dirname(test_name), ignore_errors=True)
+        connection.settings_dict['TEST'] = old_test_settings
+
+    def run_user(self, base_url, user, options):
+        """one virtual user's flows; returns a (step, seconds, status, query count, exception) per request"""
+        randomizer = random.Random(options['seed'] * 10007 + user)
+        cookie_jar = CookieJar()
+        opener = build_opener(HTTPCookieProcessor(cookie_jar), NoRedirectHandler)
+        results = []
+
+        def request(step, path, data=None):
+            if data is not None:
+                data = urlencode(dict(data, csrfmiddlewaretoken=csrf_token())).encode()
+            start = time.perf_counter()
+            try:
+                response = opener.open(base_url + path, data=data, timeout=options['timeout'])
+                response.read()
+                status, headers = response.status, response.headers
+            except HTTPError as error:
+                error.read()
+                status, headers = error.code, error.headers
+            except (URLError, OSError) as error:  # refused, reset or timed out
+                status, headers = None, {'X-Exception': f'{type(error).__name__}: {getattr(error, "reason", error)}'}
+            query_count = headers.get('X-Query-Count')
+            results.append((step, time.perf_counter() - start, status,
+                            int(query_count) if query_count is not None else None, headers.get('X-Exception')))
+
+        def csrf_token():
+            return next((cookie.value for cookie in cookie_jar if cookie.name == 'csrftoken'), '')
+
+        for iteration in range(options['iterations']):
+            request('set_rounders', reverse('set_rounders'))
+            rounder_data = {'form-TOTAL_FORMS': 12, 'form-INITIAL_FORMS': 12}
+            for index in range(12):
+                rounder_data[f'form-{index}-id'] = index + 1
+                if index < options['rounders']:
+                    rounder_data.update({f'form-{index}-abbreviation': f'lt{index}',
+                                         f'form-{index}-starting_total': randomizer.randint(8, 16),
+                                         f'form-{index}-starting_CCU': randomizer.randint(0, 4),
+                                         f'form-{index}-starting_COVID': randomizer.randint(0, 4)})
+            request('post_rounders', reverse('set_rounders'), rounder_data)
+            request('edit_count', reverse('distribute:edit_count'))
+            request('post_count', reverse('distribute:edit_count'), {'count_to_distribute': options['patients']})
+            request('designate_patients', reverse('distribute:designate_patients'))
+            designations = []
+            for number in range(1, options['patients'] + 1):
+                tokens = [token for token, chance in [('c', 0.2), ('v', 0.3)] if randomizer.random() < chance]
+                designations.append(' '.join([str(number)] + tokens))
+            request('post_designations', reverse('distribute:designate_patients'),
+                    {'designation_list': '\n'.join(designations)})
+            request('patient_assignments', reverse('distribute:patient_assignments'))
+        return results
+
+    def report(self, results, elapsed, options):
+        self.stdout.write(f"{options['users']} users x {options['iterations']} flows: {len(results)} requests in "
+                          f'{elapsed:.2f} s ({len(results) / elapsed:.1f} req/s)')
+        self.stdout.write(f"{'step':<20}{'n':>5}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'max ms':>9}"
+                          f"{'errors':>8}{'locked':>8}{'queries':>9}")
+        for step in STEPS + ['all']:
+            step_results = [result for result in results if step in ('all', result[0])]
+            if not step_results:
+                continue
+            latencies = sorted(result[1] * 1000 for result in step_results)
+            errors = [result for result in step_results if result[2] is None or result[2] >= 400]  # 3xx are fine
+            locked = [result for result in step_results if result[4] and 'locked' in result[4]]
+            query_counts = [result[3] for result in step_results if result[3] is not None]
+            self.stdout.write(f'{step:<20}{len(step_results):>5}{self.percentile(latencies, 50):>9.1f}'
+                              f'{self.percentile(latencies, 90):>9.1f}{self.percentile(latencies, 99):>9.1f}'
+                              f'{latencies[-1]:>9.1f}{len(errors):>8}{len(locked):>8}'
+                              + (f'{statistics.mean(query_counts):>9.1f}' if query_counts else f"{'-':>9}"))
+        exceptions = sorted({result[4] for result in results if result[4]})
+        for exception in exceptions[:10]:
+            self.stdout.write(f'  {exception}')
+
+    def percentile(self, sorted_values, percent):
+        return sorted_values[min(len(sorted_values) - 1, int(round(percent / 100 * (len(sorted_values) - 1))))]
@@ -0,0 +1,40 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Boots the project in fresh processes and reports worker cold start (settings, app loading, template ' \
+           'precompile) and first/second request latency, as medians over the runs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', default=None,
+                            help='settings module to boot, e.g. sqllitetest.settings_production (default: current)')
+        parser.add_argument('--path', default='/')
+        parser.add_argument('--runs', type=int, default=5)
+
+    def handle(self, *args, **options):
+        environment = dict(os.environ, DJANGO_SETTINGS_MODULE=options['profile'] or settings.SETTINGS_MODULE)
+        runs = []
+        for i in range(options['runs']):
+            start = time.perf_counter()
+            completed = subprocess.run([sys.executable, '-m', 'sqllitetest.startup', '--path', options['path']],
+                                       cwd=settings.BASE_DIR, env=environment, capture_output=True, text=True)
+            process_ms = (time.perf_counter() - start) * 1000
+            if completed.returncode:
+                raise CommandError(f'startup failed:\n{completed.stderr}')
+            timings = json.loads(completed.stdout.strip().splitlines()[-1])  # settings may print above it in dev
+            timings['process_ms'] = process_ms
+            runs.append(timings)
+        self.stdout.write(f"{environment['DJANGO_SETTINGS_MODULE']} {options['path']} "
+                          f"(status {runs[-1]['first_request_status']}), median of {len(runs)} runs:")
+        for phase in ['setup', 'application', 'precompile', 'ready', 'first_request', 'second_request', 'process']:
+            timings = [run[f'{phase}_ms'] for run in runs]
+            self.stdout.write(f'  {phase:<15}{statistics.median(timings):9.1f} ms  '
+                              f'(min {min(timings):.1f}, max {max(timings):.1f})')
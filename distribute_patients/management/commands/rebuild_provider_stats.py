@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from ...helper_fxns import date_str_to_date
+from ...models import Distribution, ProviderDailyStats
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the per-provider daily stats from every assigned distribution, for history recorded before ' \
+           'the stats table existed. A rounder\'s later distributions of a day replace earlier ones, as they do ' \
+           'when assigned. Distributions created before Distribution.date existed all carry the date the ' \
+           'migration adding it ran, so they would all be recorded as that one day; pass that date as --skip-date ' \
+           'to leave them out.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--skip-date', action='append', default=[], type=date_str_to_date,
+                            help='YYYY-MM-DD whose distributions are left out, e.g. the migration default')
+
+    def handle(self, *args, **options):
+        ProviderDailyStats.objects.all().delete()
+        distributions = Distribution.objects.filter(snapshot__isnull=False).exclude(
+            date__in=options['skip_date']).order_by('date', 'id').only('id', 'date')
+        for distribution in distributions.iterator():
+            ProviderDailyStats.objects.record_distribution(distribution)
+        self.stdout.write(f'{ProviderDailyStats.objects.count()} provider days from {distributions.count()} '
+                          f'distributions')
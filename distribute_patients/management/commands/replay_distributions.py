@@ -0,0 +1,55 @@
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import simulation
+from ...acuity import get_acuity_weights
+from ...models import Distribution
+
+METRICS = ['load_spread', 'load_stdev', *[f'{flag}_deviation' for flag in simulation.ACUITY_FLAGS], 'runtime_ms']
+
+
+class Command(BaseCommand):
+    help = "Replays every stored distribution's starting censuses and patients through one or more assignment " \
+           "strategies across a process pool, streaming one json line per distribution and strategy to --output."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--strategy', nargs='+', default=['greedy'], choices=sorted(simulation.STRATEGIES),
+                            dest='strategies')
+        parser.add_argument('--output', default='replay_results.jsonl')
+        parser.add_argument('--workers', type=int, default=None)
+        parser.add_argument('--chunk-size', type=int, default=200,
+                            help='distributions described and in flight at once, which bounds memory')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+        totals = {strategy: dict.fromkeys(METRICS + ['replayed', 'errors'], 0) for strategy in options['strategies']}
+        with open(options['output'], 'w') as output, ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            chunk = []
+            for distribution in Distribution.objects.order_by('id').only('id').iterator():
+                chunk.append((distribution.id, distribution.describe()))
+                if len(chunk) == options['chunk_size']:
+                    self.replay_chunk(executor, chunk, options['strategies'], output, totals)
+                    chunk = []
+            self.replay_chunk(executor, chunk, options['strategies'], output, totals)
+        for strategy, strategy_totals in totals.items():
+            replayed = strategy_totals['replayed'] or 1
+            self.stdout.write(f"{strategy}: {strategy_totals['replayed']} replayed, {strategy_totals['errors']} "
+                              f"failed, mean " + ', '.join(f'{metric} {strategy_totals[metric] / replayed:.2f}'
+                                                           for metric in METRICS))
+
+    def replay_chunk(self, executor, chunk, strategies, output, totals):
+        futures = [executor.submit(simulation.replay, distribution_id, description, strategies, get_acuity_weights())
+                   for distribution_id, description in chunk]
+        for future in futures:
+            for record in future.result():
+                output.write(json.dumps(record) + '\n')
+                strategy_totals = totals[record['strategy']]
+                if 'error' in record:
+                    strategy_totals['errors'] += 1
+                    continue
+                strategy_totals['replayed'] += 1
+                for metric in METRICS:
+                    strategy_totals[metric] += record[metric]
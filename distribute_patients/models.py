@@ -1,9 +1,52 @@
-import math
-from django.db import models
-from django.db.models import Avg, Sum, Count
+import collections
+import json
+from datetime import timedelta
+from django.core.exceptions import ValidationError
+from django.core.management.color import no_style
+from django.db import connection, models, transaction
+from django.db.models import Avg, Sum, Count, Max, F
 from django.shortcuts import reverse
 from django.utils import timezone
 
+from . import reports, simulation
+from .acuity import get_acuity_weights
+from .instrumentation import timed_phase
+from .simulation import ACUITY_FLAGS, CAPS
+
+OTHER_FLAGS = ACUITY_FLAGS[2:]  # the flags without a column of their own on the assignments pages
+
+SNAPSHOT_VERSION = 3  # bump when the layout written by Distribution.freeze_snapshot changes
+
+
+def lock_id_allocation():
+    """takes the write lock that serializes handing out ids past MAX(id), held until the transaction ends: an
+    UPDATE of IdAllocationLock's one row, a row lock on postgres and mysql, and on sqlite the database write lock
+    (waited for up to the busy timeout, where two transactions that had both read first would fail as locked).
+    call inside a transaction, before reading MAX(id), and on sqlite best before anything else"""
+    IdAllocationLock.objects.bulk_create([IdAllocationLock(id=1)], ignore_conflicts=True)  # first use only
+    IdAllocationLock.objects.filter(id=1).update(id=1)
+
+
+def bulk_create_with_pks(model, objs):
+    """bulk_create that leaves the pk set on every object, so other rows can point at them.  backends that can't
+    return ids from a bulk insert (sqlite and mysql on this django) get ids handed out past the current max instead,
+    under lock_id_allocation; call inside a transaction"""
+    if objs and not connection.features.can_return_rows_from_bulk_insert:
+        lock_id_allocation()
+        next_id = (model.objects.aggregate(max_id=Max('id'))['max_id'] or 0) + 1
+        for offset, obj in enumerate(objs):
+            obj.id = next_id + offset
+    return model.objects.bulk_create(objs)
+
+
+def run_assignment_step(step, *args):
+    """runs a simulation step, reporting a bounceback to a provider who isn't rounding, or patients who can't fit
+    under the caps, as a ValidationError"""
+    try:
+        return step(*args)
+    except (simulation.BouncebackNotRoundingError, simulation.InfeasibleAssignmentError) as error:
+        raise ValidationError(str(error))
+
 
 class DistributionManager(models.Manager):
     def create(self, *args, **kwargs):  # creates new line_items from prior distribution, if any
@@ -13,143 +56,340 @@ class DistributionManager(models.Manager):
             prior_distribution = None
         new_distribution = super().create(**kwargs)
         if prior_distribution:
-            for line_item in prior_distribution.get_ordered_line_items():
-                new_line_item = PatientAssignmentLineItem.objects.create_line_item(
-                    provider=line_item.provider, starting_total=line_item.starting_census.total,
-                    starting_CCU=line_item.starting_census.total, starting_COVID=line_item.starting_census.COVID,
-                    position_in_batting_order=line_item.position_in_batting_order, distribution=new_distribution)
+            prior_distribution.duplicate_line_items_into(new_distribution)
         return new_distribution
 
 
 class Distribution(models.Model):
-    count_to_distribute = models.SmallIntegerField(null=True, blank=True)
+    date = models.DateField(default=timezone.localdate, db_index=True)
+    count_to_distribute = models.IntegerField(null=True, blank=True)
+    snapshot = models.TextField(null=True, blank=True)  # frozen assignments, see freeze_snapshot
+    snapshot_version = models.SmallIntegerField(null=True, blank=True)
 
     def get_ordered_line_items(self):
         return self.line_items.order_by('position_in_batting_order')
 
     def add_duplicated_line_items_from_prior_distribution(self):
         if prior_distribution := Distribution.objects.exclude(id=self.id).last():
-            for line_item in prior_distribution.get_ordered_line_items():
-                PatientAssignmentLineItem.objects.create_line_item(
-                    provider=line_item.provider, starting_total=line_item.starting_census.total,
-                    starting_CCU=line_item.starting_census.CCU, starting_COVID=line_item.starting_census.COVID,
-                    position_in_batting_order=line_item.position_in_batting_order, distribution=self)
+            prior_distribution.duplicate_line_items_into(self)
+
+    def duplicate_line_items_into(self, distribution, seed_from='starting'):
+        """copies this distribution's rounders into distribution inside the database; seed_from='assigned' starts
+        the new day from today's assigned censuses instead of today's starting censuses"""
+        PatientAssignmentLineItem.objects.clone_line_items(self, distribution, seed_from=seed_from)
 
     def get_bounceback_patients(self):
         return self.patient_set.filter(bounce_to__isnull=False)
 
     def get_ordered_non_bounceback_patients_for_assignment(self):
-        return self.patient_set.filter(bounce_to__isnull=True).order_by('-CCU', '-COVID', 'number_designation')
+        return self.patient_set.filter(bounce_to__isnull=True).order_by(*[f'-{flag}' for flag in ACUITY_FLAGS],
+                                                                         'number_designation')
+
+    def get_census_report(self):
+        """starting, optimal and assigned census columns for every line item in batting order, from one query"""
+        columns = reports.get_columns(reports.CENSUSES)
+        return [dict(zip(columns, values)) for values in self.get_ordered_line_items().values_list(
+            'id', 'provider__abbreviation', 'position_in_batting_order',
+            *[f'{census}_census__{field}' for census in reports.CENSUSES for field in reports.CENSUS_FIELDS])]
+
+    def render_census_report(self, format='text', censuses=reports.CENSUSES):
+        """the census report as text, json or csv (see reports.py), limited to the given censuses"""
+        return reports.RENDERERS[format](self.get_census_report(), censuses=censuses)
 
     def print_starting_censuses(self):
-        for line_item in self.get_ordered_line_items():
-            print(f'LI{line_item.id}: {line_item.starting_census.total} ' + \
-                  f'({line_item.starting_census.CCU}) [{line_item.starting_census.COVID}]')
+        print(self.render_census_report(censuses=['starting']))
 
     def print_optimal_censuses(self):
-        for line_item in self.get_ordered_line_items():
-            print(f'LI{line_item.id}: {line_item.optimal_census.total} ' + \
-                  f'({line_item.optimal_census.CCU}) [{line_item.optimal_census.COVID}]')
+        print(self.render_census_report(censuses=['optimal']))
 
     def print_assigned_censuses(self):
-        for line_item in self.get_ordered_line_items():
-            print(f'LI{line_item.id}: {line_item.assigned_census.total} ' + \
-                  f'({line_item.assigned_census.CCU}) [{line_item.assigned_census.COVID}]')
+        print(self.render_census_report(censuses=['assigned']))
+
+    # the assignment math runs on the plain state objects of simulation.py; these load the distribution into them
+    # (get_line_item_states, get_patient_states), run a step, and write the results back with bulk updates
+
+    def get_line_item_states(self):
+        weights = get_acuity_weights()
+        return [line_item.get_state(weights) for line_item in self.get_ordered_line_items().select_related(
+            'provider', 'starting_census', 'optimal_census', 'assigned_census')]
+
+    def get_patient_states(self):
+        return [simulation.SimulatedPatient(number_designation, bounce_to=bounce_to, id=id,
+                                            **dict(zip(ACUITY_FLAGS, flags)))
+                for id, number_designation, bounce_to, *flags in self.patient_set.order_by('id').values_list(
+                    'id', 'number_designation', 'bounce_to__abbreviation', *ACUITY_FLAGS)]
+
+    def save_optimal_census_states(self, line_item_states):
+        optimal_censuses = []
+        for line_item_state in line_item_states:
+            optimal_census = line_item_state.source.optimal_census
+            optimal_census.set_acuity(line_item_state.optimal_total, line_item_state.optimal)
+            optimal_censuses.append(optimal_census)
+        OptimalCensus.objects.bulk_update(optimal_censuses, ['total', *ACUITY_FLAGS])
+
+    def save_assignment_states(self, assignments):
+        """saves (line item state, patient state) assignments and brings the line items' in-memory assigned
+        censuses up to date"""
+        PatientAssignmentLineItem.objects.assign_patients(
+            (line_item_state.source, Patient(id=patient_state.id, **patient_state.get_flags()))
+            for line_item_state, patient_state in assignments)
+        for line_item_state in {line_item_state for line_item_state, patient_state in assignments}:
+            line_item_state.source.assigned_census.set_acuity(line_item_state.assigned_total,
+                                                              line_item_state.assigned)
 
     def calculate_optimal_census(self):
-        self.allocate_bounceback_patients()
-        self.set_optimal_census_total()
-        self.set_optimal_census_CCU_and_COVID()
+        line_item_states = self.get_line_item_states()
+        self.calculate_optimal_census_states(line_item_states, self.get_patient_states())
+        self.save_optimal_census_states(line_item_states)
+
+    def calculate_optimal_census_states(self, line_item_states, patient_states):
+        with timed_phase('check_capacity', self):
+            run_assignment_step(simulation.check_capacity, line_item_states, patient_states)
+        with timed_phase('allocate_bounceback_patients', self):
+            run_assignment_step(simulation.allocate_bounceback_patients, line_item_states, patient_states)
+        with timed_phase('set_optimal_census_total', self):
+            run_assignment_step(simulation.set_optimal_census_total, line_item_states, patient_states)
+        with timed_phase('set_optimal_census_acuity', self):
+            simulation.set_optimal_census_acuity(line_item_states, patient_states)
 
     def set_optimal_census_total(self):
-        non_bounceback_patient_count = self.patient_set.filter(bounce_to__isnull=True).count()
-        ordered_line_items = self.get_ordered_line_items()
-        for i in range(non_bounceback_patient_count):
-            line_item_with_last_lowest_total = None
-            for index, line_item in enumerate(ordered_line_items):
-                if line_item_with_last_lowest_total == None:
-                    line_item_with_last_lowest_total = line_item
-                elif line_item.optimal_census.total <= line_item_with_last_lowest_total.optimal_census.total:
-                    line_item_with_last_lowest_total = line_item
-            line_item_with_last_lowest_total.optimal_census.total += 1
-            line_item_with_last_lowest_total.optimal_census.save()
-
-    def set_optimal_census_CCU_and_COVID(self):
-        starting_CCU_aggregate_census = self.get_ordered_line_items().aggregate(sum=Sum('starting_census__CCU'))
-        aggregate_CCU_census_of_patients_to_distribute = self.patient_set.filter(CCU=True).count()
-        starting_COVID_aggregate_census = self.get_ordered_line_items().aggregate(sum=Sum('starting_census__COVID'))
-        aggregate_COVID_census_of_patients_to_distribute = self.patient_set.filter(COVID=True).count()
-        line_item_count = self.get_ordered_line_items().count()
-        optimal_total_census_average = self.get_ordered_line_items().aggregate(avg=Avg('optimal_census__total'))
-        optimal_CCU_census = \
-            (starting_CCU_aggregate_census['sum'] + \
-             aggregate_CCU_census_of_patients_to_distribute) / line_item_count
-        optimal_COVID_census = \
-            (starting_COVID_aggregate_census['sum'] + \
-             aggregate_COVID_census_of_patients_to_distribute) / line_item_count
-        for line_item in self.get_ordered_line_items():
-            total_census_weighting_factor = line_item.optimal_census.total / optimal_total_census_average['avg']
-            line_item.optimal_census.CCU = total_census_weighting_factor * optimal_CCU_census
-            line_item.optimal_census.COVID = total_census_weighting_factor * optimal_COVID_census
-            line_item.optimal_census.save()
+        line_item_states = self.get_line_item_states()
+        run_assignment_step(simulation.set_optimal_census_total, line_item_states, self.get_patient_states())
+        self.save_optimal_census_states(line_item_states)
 
-    def allocate_bounceback_patients(self):
-        bounceback_patients = self.get_bounceback_patients()
-        for bounceback_patient in bounceback_patients:
-            line_item = self.line_items.get(provider=bounceback_patient.bounce_to)
-            line_item.optimal_census.total += 1
-            if bounceback_patient.CCU:
-                line_item.optimal_census.CCU += 1
-            if bounceback_patient.COVID:
-                line_item.optimal_census.COVID += 1
-            line_item.optimal_census.save()
-
-    def get_line_item_moved_furthest_toward_optimal_by_adding_patient(self, patient):
-        line_item_moved_furthest_toward_optimal = None
-        for line_item in self.get_ordered_line_items():
-            if line_item.assigned_census.total < line_item.optimal_census.total:
-                if not line_item_moved_furthest_toward_optimal:
-                    line_item_moved_furthest_toward_optimal = line_item
-                elif line_item.get_distance_moved_closer_to_optimal_after_adding_patient(patient=patient) > \
-                        line_item_moved_furthest_toward_optimal.get_distance_moved_closer_to_optimal_after_adding_patient(
-                            patient=patient):
-                    line_item_moved_furthest_toward_optimal = line_item
-        if not line_item_moved_furthest_toward_optimal:
-            raise ValueError('There are no line items with space for another patient')
-        return line_item_moved_furthest_toward_optimal
+    def set_optimal_census_acuity(self):
+        line_item_states = self.get_line_item_states()
+        simulation.set_optimal_census_acuity(line_item_states, self.get_patient_states())
+        self.save_optimal_census_states(line_item_states)
 
+    def allocate_bounceback_patients(self):
+        line_item_states = self.get_line_item_states()
+        run_assignment_step(simulation.allocate_bounceback_patients, line_item_states, self.get_patient_states())
+        self.save_optimal_census_states(line_item_states)
 
     def assign_bounceback_patients(self):
-        bounceback_patients = self.get_bounceback_patients()
-        for bounceback_patient in bounceback_patients:
-            line_item = self.line_items.get(provider=bounceback_patient.bounce_to)
-            line_item.assign_patient(bounceback_patient)
+        self.save_assignment_states(run_assignment_step(simulation.assign_bounceback_patients,
+                                                        self.get_line_item_states(), self.get_patient_states()))
 
     def assign_non_bounceback_patients(self):
-        for patient in self.get_ordered_non_bounceback_patients_for_assignment():
-            line_item=self.get_line_item_moved_furthest_toward_optimal_by_adding_patient(patient)
-            line_item.assign_patient(patient)
-            pass
-            # get line item WITH SPACE for total pt that has next
-            # assign patient to line_item
-
-    def assign_all_patients(self):
-        self.calculate_optimal_census()
-        self.assign_bounceback_patients()
-        self.assign_non_bounceback_patients()
+        self.save_assignment_states(run_assignment_step(simulation.assign_non_bounceback_patients,
+                                                        self.get_line_item_states(), self.get_patient_states()))
+
+    def assign_all_patients(self):  # each phase is reported to any instrumentation hooks, see timed_phase
+        with transaction.atomic():
+            with timed_phase('load_states', self):
+                line_item_states, patient_states = self.get_line_item_states(), self.get_patient_states()
+            self.calculate_optimal_census_states(line_item_states, patient_states)
+            with timed_phase('assign_bounceback_patients', self):
+                assignments = run_assignment_step(simulation.assign_bounceback_patients, line_item_states,
+                                                  patient_states)
+            with timed_phase('assign_non_bounceback_patients', self):
+                assignments += run_assignment_step(simulation.assign_non_bounceback_patients, line_item_states,
+                                                   patient_states)
+            with timed_phase('save_states', self):
+                self.save_optimal_census_states(line_item_states)
+                self.save_assignment_states(assignments)
+            with timed_phase('freeze_snapshot', self):
+                self.freeze_snapshot()
+            with timed_phase('record_provider_daily_stats', self):
+                ProviderDailyStats.objects.record_distribution(self)
+
+    def add_late_patients(self, patient_specs):
+        """places patients who arrive after the distribution was assigned, leaving existing assignments alone.
+        patient_specs are dicts of bounce_to and any ACUITY_FLAGS and optionally number_designation (default: next
+        number).  the new patients grow the optimal totals and the acuity optima are re-spread, as
+        assign_all_patients would have, then they are assigned with the same simulation steps, raising
+        ValidationError when they (bouncebacks included) don't fit under the caps.  they are saved like any other
+        assignment (see PatientAssignmentLineItemManager.assign_patients), so the assigned censuses are incremented
+        in the database rather than overwritten; O(providers) work per patient, and queries per touched line item
+        rather than per patient"""
+        if self.snapshot is None:
+            raise ValueError('Late patients can only be added to a distribution that has already been assigned')
+        with transaction.atomic():
+            line_item_states = self.get_line_item_states()
+            last_number_designation = self.patient_set.aggregate(max=Max('number_designation'))['max'] or 0
+            patients = []
+            for spec in patient_specs:
+                number_designation = spec.get('number_designation') or last_number_designation + 1
+                last_number_designation = max(last_number_designation, number_designation)
+                patients.append(Patient(distribution=self, number_designation=number_designation,
+                                        bounce_to=spec.get('bounce_to'),
+                                        **{flag: spec.get(flag, False) for flag in ACUITY_FLAGS}))
+            bulk_create_with_pks(Patient, patients)
+            late_patient_states = [patient.get_state() for patient in patients]
+            run_assignment_step(simulation.check_capacity, line_item_states, late_patient_states)
+            run_assignment_step(simulation.allocate_bounceback_patients, line_item_states, late_patient_states)
+            run_assignment_step(simulation.set_optimal_census_total, line_item_states, late_patient_states)
+            simulation.set_optimal_census_acuity(line_item_states, self.get_patient_states() + late_patient_states)
+            assignments = run_assignment_step(simulation.assign_bounceback_patients, line_item_states,
+                                              late_patient_states) + \
+                run_assignment_step(simulation.assign_non_bounceback_patients, line_item_states, late_patient_states)
+            patients_by_id = {patient.id: patient for patient in patients}
+            PatientAssignmentLineItem.objects.assign_patients(
+                (line_item_state.source, patients_by_id[patient_state.id])
+                for line_item_state, patient_state in assignments)
+            self.save_optimal_census_states(line_item_states)
+            self.count_to_distribute = (self.count_to_distribute or 0) + len(patients)
+            self.save(update_fields=['count_to_distribute'])
+            self.freeze_snapshot()
+            ProviderDailyStats.objects.record_distribution(self)
+        return patients
+
+    def describe(self):
+        """plain description of the rounders' starting censuses and the patients, as used by simulation"""
+        return {
+            'rounders': [dict(zip(ACUITY_FLAGS + CAPS, acuity_and_caps), abbreviation=abbreviation,
+                              position_in_batting_order=position_in_batting_order, total=total)
+                         for abbreviation, position_in_batting_order, total, *acuity_and_caps in
+                         self.get_ordered_line_items().values_list(
+                             'provider__abbreviation', 'position_in_batting_order', 'starting_census__total',
+                             *[f'starting_census__{flag}' for flag in ACUITY_FLAGS], *CAPS)],
+            'patients': [dict(zip(ACUITY_FLAGS, flags), number_designation=number_designation, bounce_to=bounce_to)
+                         for number_designation, bounce_to, *flags in
+                         self.patient_set.order_by('id').values_list('number_designation', 'bounce_to__abbreviation',
+                                                                     *ACUITY_FLAGS)],
+        }
+
+    def simulate(self, overrides=None):
+        """dry run of assign_all_patients with optional overrides (see simulation.apply_overrides); writes
+        nothing"""
+        return simulation.simulate(self.describe(), overrides, weights=get_acuity_weights())
+
+    def save_simulation_result(self, description, result):
+        """persists a simulation.simulate result for description onto this (empty) distribution with bulk inserts:
+        its line items with their optimal and assigned censuses, its assigned patients, and its snapshot"""
+        patients_by_number = {patient['number_designation']: patient for patient in description['patients']}
+        rounders_by_abbreviation = {rounder['abbreviation']: rounder for rounder in description['rounders']}
+        with transaction.atomic():
+            providers = Provider.objects.get_or_create_many(
+                line_item['abbreviation'] for line_item in result['line_items'])
+            line_items = PatientAssignmentLineItem.objects.create_line_items(distribution=self, line_item_specs=[
+                dict(provider=providers[line_item['abbreviation']],
+                     starting_total=line_item['starting_census']['total'],
+                     starting_CCU=line_item['starting_census']['CCU'],
+                     starting_COVID=line_item['starting_census']['COVID'],
+                     position_in_batting_order=line_item['position_in_batting_order'],
+                     starting_census=line_item['starting_census'], optimal_census=line_item['optimal_census'],
+                     assigned_census=line_item['assigned_census'],
+                     **{cap: rounders_by_abbreviation[line_item['abbreviation']].get(cap) for cap in CAPS})
+                for line_item in result['line_items']])
+            patients = []
+            for line_item, simulated_line_item in zip(line_items, result['line_items']):
+                for number_designation in simulated_line_item['assigned_patients']:
+                    patient = patients_by_number[number_designation]
+                    patients.append(Patient(distribution=self, number_designation=number_designation,
+                                            **{flag: patient.get(flag, False) for flag in ACUITY_FLAGS},
+                                            bounce_to=providers.get(patient['bounce_to']),
+                                            patient_assignment_line_item=line_item))
+            Patient.objects.bulk_create(patients)
+            self.count_to_distribute = len(patients)
+            self.save(update_fields=['count_to_distribute'])
+            self.freeze_snapshot()
+            ProviderDailyStats.objects.record_distribution(self)
+
+    def get_patient_buckets_by_line_item_id(self):
+        """the number designations of each line item's assigned patients, bucketed by CCU and COVID as on the
+        assignments page, and listed under each of the other ACUITY_FLAGS they have in other_flag_pts, from one query
+        however many line items there are"""
+        buckets_by_line_item = collections.defaultdict(lambda: {'bounceback_pts': [], 'dual_pos_pts': [],
+                                                                'ccu_pos_pts': [], 'covid_pos_pts': [],
+                                                                'dual_neg_pts': [],
+                                                                'other_flag_pts': {flag: [] for flag in OTHER_FLAGS}})
+        assigned_patients = self.patient_set.filter(patient_assignment_line_item__isnull=False).order_by('id') \
+            .values_list('patient_assignment_line_item_id', 'number_designation', 'bounce_to_id', *ACUITY_FLAGS)
+        for line_item_id, number_designation, bounce_to_id, CCU, COVID, *other_flags in assigned_patients:
+            for flag, has_flag in zip(OTHER_FLAGS, other_flags):
+                if has_flag:
+                    buckets_by_line_item[line_item_id]['other_flag_pts'][flag].append(number_designation)
+            if bounce_to_id:
+                bucket = 'bounceback_pts'
+            elif CCU and COVID:
+                bucket = 'dual_pos_pts'
+            elif CCU:
+                bucket = 'ccu_pos_pts'
+            elif COVID:
+                bucket = 'covid_pos_pts'
+            else:
+                bucket = 'dual_neg_pts'
+            buckets_by_line_item[line_item_id][bucket].append(number_designation)
+        return buckets_by_line_item
+
+    def freeze_snapshot(self):
+        """serializes the finished distribution into one compact json row, so a past day's assignments can be
+        viewed or exported without joining line items, censuses, providers and patients again.  the date is stored
+        as iso text, censuses as [total, *acuity_flags] and patients as their number designations, bucketed as by
+        get_patient_buckets_by_line_item_id"""
+        line_items = self.get_ordered_line_items().select_related('provider', 'starting_census', 'optimal_census',
+                                                                  'assigned_census')
+        buckets_by_line_item = self.get_patient_buckets_by_line_item_id()
+        snapshot = {
+            'version': SNAPSHOT_VERSION,
+            'id': self.id,
+            'date': self.date.isoformat(),
+            'count_to_distribute': self.count_to_distribute,
+            'acuity_flags': ACUITY_FLAGS,
+            'line_items': [
+                dict(provider=line_item.provider.abbreviation,
+                     position_in_batting_order=line_item.position_in_batting_order,
+                     starting_census=[line_item.starting_census.total, *line_item.starting_census.get_acuity()],
+                     optimal_census=[line_item.optimal_census.total, *line_item.optimal_census.get_acuity()],
+                     assigned_census=[line_item.assigned_census.total, *line_item.assigned_census.get_acuity()],
+                     **buckets_by_line_item[line_item.id])
+                for line_item in line_items],
+        }
+        self.snapshot = json.dumps(snapshot, separators=(',', ':'))
+        self.snapshot_version = SNAPSHOT_VERSION
+        self.save(update_fields=['snapshot', 'snapshot_version'])
+
+    def get_snapshot(self):
+        """the frozen snapshot, or None if there isn't one yet.  one frozen in another format (SNAPSHOT_VERSION) is
+        re-frozen from the line items and patients first, which are kept for that"""
+        if self.snapshot is None:
+            return None
+        if self.snapshot_version != SNAPSHOT_VERSION:
+            self.freeze_snapshot()
+        return json.loads(self.snapshot)
+
+
+class ProviderManager(models.Manager):
+    def get_or_create_many(self, abbreviations):
+        """upserts every abbreviation in one insert and returns {abbreviation: provider}"""
+        abbreviations = set(abbreviations)
+        self.bulk_create([Provider(abbreviation=abbreviation) for abbreviation in abbreviations],
+                         ignore_conflicts=True)
+        return {provider.abbreviation: provider for provider in self.filter(abbreviation__in=abbreviations)}
 
 
 class Provider(models.Model):
     abbreviation = models.CharField(max_length=5, unique=True)
 
+    objects = ProviderManager()
+
     def __str__(self):
         return self.abbreviation
 
 
-class Census(models.Model):
+class AcuityCensusMixin:
+    def get_acuity(self):
+        return [getattr(self, flag) for flag in ACUITY_FLAGS]
+
+    def set_acuity(self, total, acuity):
+        """sets the total and the counts along simulation.ACUITY_FLAGS"""
+        self.total = total
+        for flag, count in zip(ACUITY_FLAGS, acuity):
+            setattr(self, flag, count)
+
+
+class Census(AcuityCensusMixin, models.Model):
     total = models.SmallIntegerField(null=True)
     CCU = models.SmallIntegerField(null=True)
     COVID = models.SmallIntegerField(null=True)
+    isolation = models.SmallIntegerField(default=0)
+    telemetry = models.SmallIntegerField(default=0)
+    high_acuity = models.SmallIntegerField(default=0)
+
+    class Meta:
+        abstract = True  # each census gets its own table, so they can be bulk created
 
 
 class StartingCensus(Census):
@@ -160,10 +400,13 @@ class AssignedCensus(Census):
     pass
 
 
-class OptimalCensus(models.Model):
+class OptimalCensus(AcuityCensusMixin, models.Model):
     total = models.SmallIntegerField(null=True)
     CCU = models.FloatField(null=True)
     COVID = models.FloatField(null=True)
+    isolation = models.FloatField(default=0)
+    telemetry = models.FloatField(default=0)
+    high_acuity = models.FloatField(default=0)
 
 
 class FinalCensus(Census):
@@ -179,19 +422,106 @@ class AllocatedCounts(models.Model):
 
 
 class PatientAssignmentLineItemManager(models.Manager):
+    def assign_patients(self, assignments):
+        """saves (line_item, patient) assignments with two statements per touched line item: its patients'
+        line item set by id (a bulk_update CASE over thousands of patients costs more to build than to run), then
+        its assigned census incremented in the database with F() expressions, so concurrent assignments can't
+        overwrite each other's counts.  in-memory censuses are left as they are (add_to_assigned_census keeps
+        them current)"""
+        patient_ids_by_line_item = {}
+        increments_by_census_id = {}
+        for line_item, patient in assignments:
+            patient.patient_assignment_line_item = line_item
+            patient_ids_by_line_item.setdefault(line_item, []).append(patient.id)
+            increments = increments_by_census_id.setdefault(line_item.assigned_census_id,
+                                                            dict.fromkeys(['total', *ACUITY_FLAGS], 0))
+            increments['total'] += 1
+            for flag in ACUITY_FLAGS:
+                increments[flag] += getattr(patient, flag)
+        with transaction.atomic():
+            for line_item, patient_ids in patient_ids_by_line_item.items():
+                Patient.objects.filter(id__in=patient_ids).update(patient_assignment_line_item=line_item)
+            for census_id, increments in increments_by_census_id.items():
+                AssignedCensus.objects.filter(id=census_id).update(
+                    **{field: F(field) + increment for field, increment in increments.items() if increment})
+
     def create_line_item(self, distribution, provider, starting_total, starting_CCU, starting_COVID,
                          position_in_batting_order):
         starting_census = StartingCensus.objects.create(total=starting_total, CCU=starting_CCU, COVID=starting_COVID)
         optimal_census = OptimalCensus.objects.create(total=starting_total, CCU=starting_CCU, COVID=starting_COVID)
         assigned_census = AssignedCensus.objects.create(total=starting_total, CCU=starting_CCU, COVID=starting_COVID)
         # final_census = FinalCensus.objects.create(total=starting_total, CCU=starting_CCU, COVID=starting_COVID)
-        allocated_counts = AllocatedCounts.objects.create()
+        # allocated_counts is left empty; it is created on first use by get_allocated_counts
         return super().create(distribution=distribution, provider=provider,
                               position_in_batting_order=position_in_batting_order,
                               starting_census=starting_census, assigned_census=assigned_census,
                               optimal_census=optimal_census,
                               # final_census=final_census,
-                              allocated_counts=allocated_counts)
+                              )
+
+    def clone_line_items(self, source_distribution, distribution, seed_from='starting'):
+        """copies source_distribution's line items into distribution with one INSERT ... SELECT per census table
+        and one for the line items, so nothing is loaded into python however many rounders there are.  every
+        census of the copies starts out equal to the source's seed_from census ('starting' or 'assigned'), as
+        create_line_item would have them, and the caps carry over.  ids are handed out past each table's max by
+        ROW_NUMBER() in batting order, under lock_id_allocation, and sequences are reset afterwards on backends that
+        have them"""
+        if seed_from not in ('starting', 'assigned'):
+            raise ValueError(f"seed_from must be 'starting' or 'assigned', not {seed_from!r}")
+        quote = connection.ops.quote_name
+        census_models = [StartingCensus, OptimalCensus, AssignedCensus]
+        census_columns = [quote(column) for column in ['total', *ACUITY_FLAGS]]
+        cap_columns = [quote(column) for column in CAPS]
+        line_item_table = quote(self.model._meta.db_table)
+        seed_census_table = quote(self.model._meta.get_field(f'{seed_from}_census').related_model._meta.db_table)
+        new_id = '%s + ROW_NUMBER() OVER (ORDER BY line_item.position_in_batting_order, line_item.id)'
+        with transaction.atomic(), connection.cursor() as cursor:
+            lock_id_allocation()
+            cursor.execute('SELECT ' + ', '.join(f'(SELECT COALESCE(MAX(id), 0) FROM {quote(model._meta.db_table)})'
+                                                 for model in census_models + [self.model]))
+            *census_base_ids, line_item_base_id = cursor.fetchone()
+            for model, base_id in zip(census_models, census_base_ids):
+                cursor.execute(
+                    f'INSERT INTO {quote(model._meta.db_table)} (id, {", ".join(census_columns)}) '
+                    f'SELECT {new_id}, {", ".join(f"census.{column}" for column in census_columns)} '
+                    f'FROM {line_item_table} line_item INNER JOIN {seed_census_table} census '
+                    f'ON census.id = line_item.{seed_from}_census_id WHERE line_item.distribution_id = %s',
+                    [base_id, source_distribution.id])
+            cursor.execute(
+                f'INSERT INTO {line_item_table} (id, distribution_id, provider_id, position_in_batting_order, '
+                f'starting_census_id, optimal_census_id, assigned_census_id, '
+                f'{quote("affinity_for_COVID_pos_CCU_pos_patients")}, count_of_dual_positives_needed_to_fill, '
+                f'{", ".join(cap_columns)}) '
+                f'SELECT {new_id}, %s, line_item.provider_id, line_item.position_in_batting_order, '
+                f'{new_id}, {new_id}, {new_id}, 0, 0, {", ".join(f"line_item.{column}" for column in cap_columns)} '
+                f'FROM {line_item_table} line_item WHERE line_item.distribution_id = %s',
+                [line_item_base_id, distribution.id, *census_base_ids, source_distribution.id])
+            for sql in connection.ops.sequence_reset_sql(no_style(), census_models + [self.model]):
+                cursor.execute(sql)
+
+    def create_line_items(self, distribution, line_item_specs):
+        """set-based create_line_item: line_item_specs are dicts of create_line_item's keyword arguments (less
+        distribution), optionally with optimal_census/assigned_census dicts of total, CCU and COVID where those
+        shouldn't start out equal to the starting census, and with any of the CAPS.  inserts each census table and
+        the line items in one statement apiece, returning the line items with their ids"""
+        line_item_specs = list(line_item_specs)
+        with transaction.atomic():
+            lock_id_allocation()  # before anything below reads
+            census_rows = {}
+            for census_model, census_name in [(StartingCensus, 'starting_census'), (OptimalCensus, 'optimal_census'),
+                                              (AssignedCensus, 'assigned_census')]:
+                census_rows[census_model] = bulk_create_with_pks(census_model, [
+                    census_model(**spec.get(census_name, dict(total=spec['starting_total'], CCU=spec['starting_CCU'],
+                                                              COVID=spec['starting_COVID'])))
+                    for spec in line_item_specs])
+            return bulk_create_with_pks(PatientAssignmentLineItem, [
+                PatientAssignmentLineItem(distribution=distribution, provider=spec['provider'],
+                                          position_in_batting_order=spec['position_in_batting_order'],
+                                          starting_census=census_rows[StartingCensus][index],
+                                          optimal_census=census_rows[OptimalCensus][index],
+                                          assigned_census=census_rows[AssignedCensus][index],
+                                          **{cap: spec.get(cap) for cap in CAPS})
+                for index, spec in enumerate(line_item_specs)])
 
 
 class PatientAssignmentLineItem(models.Model):
@@ -205,32 +535,53 @@ class PatientAssignmentLineItem(models.Model):
     # final_census = models.ForeignKey(FinalCensus, on_delete=models.CASCADE, null=True)
     affinity_for_COVID_pos_CCU_pos_patients = models.FloatField(default=0)
     count_of_dual_positives_needed_to_fill = models.SmallIntegerField(default=0)
+    # hard caps on the assigned census, null for no cap (see simulation.check_capacity)
+    max_total = models.PositiveSmallIntegerField(null=True, blank=True)
+    max_CCU = models.PositiveSmallIntegerField(null=True, blank=True)
+    max_COVID = models.PositiveSmallIntegerField(null=True, blank=True)
+    max_isolation = models.PositiveSmallIntegerField(null=True, blank=True)
+    max_telemetry = models.PositiveSmallIntegerField(null=True, blank=True)
+    max_high_acuity = models.PositiveSmallIntegerField(null=True, blank=True)
+
+    def get_or_create_detail(self, field_name):
+        """returns the per-line-item detail row (eg allocated_counts) behind the nullable foreign key field_name,
+        creating it the first time it is asked for, so line items built by any path only pay for the detail rows
+        that actually get written"""
+        detail = getattr(self, field_name)
+        if detail is None:
+            detail = self._meta.get_field(field_name).related_model.objects.create()
+            setattr(self, field_name, detail)
+            self.save(update_fields=[field_name])
+        return detail
+
+    def get_state(self, weights=simulation.DEFAULT_WEIGHTS):
+        """this line item as a simulation.SimulatedLineItem; needs provider and the censuses loaded"""
+        state = simulation.SimulatedLineItem(self.provider.abbreviation, self.position_in_batting_order,
+                                             self.starting_census.total, self.starting_census.get_acuity(),
+                                             source=self, weights=weights, max_total=self.max_total,
+                                             max_acuity=self.get_max_acuity())
+        state.optimal_total, state.optimal = self.optimal_census.total, self.optimal_census.get_acuity()
+        state.assigned_total, state.assigned = self.assigned_census.total, self.assigned_census.get_acuity()
+        return state
+
+    def get_allocated_counts(self):
+        return self.get_or_create_detail('allocated_counts')
+
+    def get_max_acuity(self):
+        """the acuity caps along simulation.ACUITY_FLAGS, None where uncapped"""
+        return [getattr(self, f'max_{flag}') for flag in ACUITY_FLAGS]
 
     def assign_patient(self, patient):
+        self.add_to_assigned_census(patient)
+        PatientAssignmentLineItem.objects.assign_patients([(self, patient)])
+
+    def add_to_assigned_census(self, patient):  # in memory only, callers save
         patient.patient_assignment_line_item = self
-        patient.save()
         self.assigned_census.total += 1
-        if patient.COVID:
-            self.assigned_census.COVID += 1
-        if patient.CCU:
-            self.assigned_census.CCU += 1
-        self.assigned_census.save()
-
-    def get_distance_from_assigned_census_to_optimal(self):
-        """can think of distance as the linear distance from the current COVID and CCU census to the optimal,
-        in effect, the length of the hypotenuse where one side of the triangle is the number of COVIDs needed
-        and the other is the number of CCUs.  Could add a third side, total, but will try with how much closer a given
-        patient brings the distance"""
-        return math.sqrt((self.optimal_census.CCU - self.assigned_census.CCU) ** 2 +
-                         (self.optimal_census.COVID - self.assigned_census.COVID) ** 2)
-
-    def get_distance_moved_closer_to_optimal_after_adding_patient(self, patient):
-        distance_from_optimal_before_adding_patient = self.get_distance_from_assigned_census_to_optimal()
-        distance_from_optimal_after_adding_patient = math.sqrt(
-            (self.optimal_census.CCU - self.assigned_census.CCU - int(patient.CCU)) ** 2 +
-            (self.optimal_census.COVID - self.assigned_census.COVID - int(patient.COVID)) ** 2
-        )
-        return distance_from_optimal_before_adding_patient - distance_from_optimal_after_adding_patient
+        for flag in ACUITY_FLAGS:
+            if getattr(patient, flag):
+                setattr(self.assigned_census, flag, getattr(self.assigned_census, flag) + 1)
+
         # def set_line_item_affinity_for_dual_pos_patients(self):
         #     total_room = self.expected_census.total - self.final_census.total
         #     CCU_room = self.expected_census.CCU - self.final_census.CCU
@@ -257,16 +608,131 @@ class PatientAssignmentLineItem(models.Model):
         #         ccu_census=proposed_census['CCU'], covid_census=proposed_census['COVID']) - \
         #                           self.get_std_dev_of_given_census_from_optimal_census(
         #                               ccu_census=self.assigned_census.CCU, covid_census=self.assigned_census.COVID)
-        return std_dev_improvement
+        #     return std_dev_improvement
 
     objects = PatientAssignmentLineItemManager()
 
 
 class Patient(models.Model):
     distribution = models.ForeignKey(Distribution, on_delete=models.CASCADE)
-    number_designation = models.SmallIntegerField()
+    number_designation = models.IntegerField()
     CCU = models.BooleanField(default=False)
     COVID = models.BooleanField(default=False)
+    isolation = models.BooleanField(default=False)
+    telemetry = models.BooleanField(default=False)
+    high_acuity = models.BooleanField(default=False)
     bounce_to = models.ForeignKey(Provider, blank=True, null=True, on_delete=models.CASCADE)
     patient_assignment_line_item = models.ForeignKey(PatientAssignmentLineItem, blank=True, null=True,
                                                      on_delete=models.CASCADE, related_name='assigned_patients')
+
+    def get_state(self):
+        """this patient as a simulation.SimulatedPatient"""
+        return simulation.SimulatedPatient(self.number_designation, id=self.id,
+                                           bounce_to=self.bounce_to.abbreviation if self.bounce_to_id else None,
+                                           **{flag: getattr(self, flag) for flag in ACUITY_FLAGS})
+
+
+class ProviderDailyStatsManager(models.Manager):
+    def record_distribution(self, distribution):
+        """replaces distribution's rows, and any other rows of its rounders on its date, with its assignments, so a
+        rounder's latest distribution of a day wins while other units' rounders that day are left alone.  called
+        whenever a distribution's assignment completes"""
+        patient_counts = {row.pop('patient_assignment_line_item_id'): row for row in distribution.patient_set.filter(
+            patient_assignment_line_item__isnull=False).values('patient_assignment_line_item_id').annotate(
+            assigned_patients=Count('id'),
+            **{f'assigned_{flag}_patients': Count('id', filter=models.Q(**{flag: True})) for flag in ACUITY_FLAGS})}
+        census_fields = ['total', *ACUITY_FLAGS]
+        with transaction.atomic():
+            self.filter(models.Q(distribution=distribution) | models.Q(
+                date=distribution.date, provider_id__in=distribution.line_items.values('provider_id'))).delete()
+            self.bulk_create([
+                ProviderDailyStats(provider_id=provider_id, date=distribution.date, distribution=distribution,
+                                   **patient_counts.get(line_item_id, {}),
+                                   **{f'census_{field}': count for field, count in zip(census_fields, census)})
+                for line_item_id, provider_id, *census in distribution.line_items.values_list(
+                    'id', 'provider_id', *[f'assigned_census__{field}' for field in census_fields])])
+
+    def get_rolling_loads(self, days=7, end_date=None, providers=None):
+        """{abbreviation: load} over the days days ending on end_date (default today), in one grouped query.  each
+        load holds the days rounded, the patients assigned (in all and with each of ACUITY_FLAGS) and the average
+        census carried"""
+        end_date = end_date or timezone.localdate()
+        stats = self.filter(date__gt=end_date - timedelta(days=days), date__lte=end_date)
+        if providers is not None:
+            stats = stats.filter(provider__in=providers)
+        return {row.pop('provider__abbreviation'): row for row in stats.values('provider__abbreviation').annotate(
+            days_rounded=Count('id'), assigned_patients=Sum('assigned_patients'),
+            **{f'assigned_{flag}_patients': Sum(f'assigned_{flag}_patients') for flag in ACUITY_FLAGS},
+            **{f'average_census_{field}': Avg(f'census_{field}') for field in ['total', *ACUITY_FLAGS]}).order_by()}
+
+
+class ProviderDailyStats(models.Model):
+    """one row per provider per day rounded, materialized from that day's distribution so rolling loads don't
+    need the line item and census history"""
+    provider = models.ForeignKey(Provider, on_delete=models.CASCADE)
+    date = models.DateField()
+    distribution = models.ForeignKey(Distribution, on_delete=models.CASCADE)
+    assigned_patients = models.SmallIntegerField(default=0)
+    assigned_CCU_patients = models.SmallIntegerField(default=0)
+    assigned_COVID_patients = models.SmallIntegerField(default=0)
+    assigned_isolation_patients = models.SmallIntegerField(default=0)
+    assigned_telemetry_patients = models.SmallIntegerField(default=0)
+    assigned_high_acuity_patients = models.SmallIntegerField(default=0)
+    census_total = models.SmallIntegerField(null=True)
+    census_CCU = models.SmallIntegerField(null=True)
+    census_COVID = models.SmallIntegerField(null=True)
+    census_isolation = models.SmallIntegerField(null=True)
+    census_telemetry = models.SmallIntegerField(null=True)
+    census_high_acuity = models.SmallIntegerField(null=True)
+
+    objects = ProviderDailyStatsManager()
+
+    class Meta:
+        unique_together = [('provider', 'date')]
+
+
+class AssignmentJobManager(models.Manager):
+    def enqueue(self, distribution):
+        """returns the distribution's queued or running job, else creates one and submits it to the job runner once
+        this transaction commits.  an active job older than ASSIGNMENT_JOB_STALE_SECONDS (its worker presumably
+        died) is marked failed and replaced; should its worker still be running, it won't commit (see
+        jobs.run_assignment_job)"""
+        from . import jobs
+        stale_before = timezone.now() - timedelta(seconds=jobs.get_stale_seconds())
+        with transaction.atomic():
+            self.filter(distribution=distribution, status__in=AssignmentJob.ACTIVE_STATUSES,
+                        created__lt=stale_before).update(status=AssignmentJob.FAILED, finished=timezone.now(),
+                                                         error='Abandoned: the job did not finish in time')
+            job, created = self.get_or_create(distribution=distribution, status__in=AssignmentJob.ACTIVE_STATUSES,
+                                              defaults={'status': AssignmentJob.QUEUED})
+        if created:
+            transaction.on_commit(lambda: jobs.submit(job.id))
+        return job
+
+
+class AssignmentJob(models.Model):
+    """a background run of a distribution's assign_all_patients, see jobs.py"""
+    QUEUED, RUNNING, SUCCEEDED, FAILED = 'queued', 'running', 'succeeded', 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (SUCCEEDED, 'Succeeded'), (FAILED, 'Failed')]
+    ACTIVE_STATUSES = [QUEUED, RUNNING]
+
+    distribution = models.ForeignKey(Distribution, on_delete=models.CASCADE, related_name='assignment_jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    objects = AssignmentJobManager()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['distribution'],
+                                               condition=models.Q(status__in=['queued', 'running']),
+                                               name='one_active_assignment_job_per_distribution')]
+
+    def is_done(self):
+        return self.status in [self.SUCCEEDED, self.FAILED]
+
+
+class IdAllocationLock(models.Model):
+    """the single row lock_id_allocation updates to serialize id allocation"""
@@ -0,0 +1,44 @@
+"""renderers for Distribution.get_census_report rows: text for people, json and csv for tooling"""
+import csv
+import io
+import json
+
+from .simulation import ACUITY_FLAGS
+
+CENSUSES = ['starting', 'optimal', 'assigned']
+CENSUS_FIELDS = ['total', *ACUITY_FLAGS]
+
+
+def get_columns(censuses):
+    return ['line_item', 'provider', 'position_in_batting_order'] + \
+           [f'{census}_{field}' for census in censuses for field in CENSUS_FIELDS]
+
+
+def format_count(value):
+    return f'{value:.2f}' if isinstance(value, float) else str(value)
+
+
+def render_text(rows, censuses=CENSUSES):
+    """one line per line item: LI<id> <provider>: <census> total (CCU) [COVID] <flag> <count>... for the other
+    ACUITY_FLAGS, ..."""
+    return '\n'.join(f"LI{row['line_item']} {row['provider']}: " + '  '.join(
+        f"{census} {format_count(row[f'{census}_total'])} ({format_count(row[f'{census}_CCU'])}) "
+        f"[{format_count(row[f'{census}_COVID'])}]" +
+        ''.join(f" {flag} {format_count(row[f'{census}_{flag}'])}" for flag in ACUITY_FLAGS[2:])
+        for census in censuses) for row in rows)
+
+
+def render_json(rows, censuses=CENSUSES):
+    columns = get_columns(censuses)
+    return json.dumps([{column: row[column] for column in columns} for row in rows])
+
+
+def render_csv(rows, censuses=CENSUSES):
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=get_columns(censuses), extrasaction='ignore', lineterminator='\n')
+    writer.writeheader()
+    writer.writerows(rows)
+    return output.getvalue()
+
+
+RENDERERS = {'text': render_text, 'json': render_json, 'csv': render_csv}
@@ -0,0 +1,603 @@
+"""the assignment math, on plain __slots__ state objects (SimulatedLineItem, SimulatedPatient) rather than models.
+Distribution.assign_all_patients loads its line items and patients into these states, runs the steps here and
+writes the results back.  simulate works on a plain description of a distribution,
+
+    {'rounders': [{'abbreviation': 'provA', 'position_in_batting_order': 1, 'total': 10, 'CCU': 2, 'COVID': 0}, ...],
+     'patients': [{'number_designation': 1, 'CCU': True, 'COVID': False, 'bounce_to': 'provA'}, ...]}
+
+where rounders and patients may also carry the other ACUITY_FLAGS (counts and flags, default 0/False) and rounders
+their CAPS (default None, no cap) (see Distribution.describe) so what-if scenarios can be compared without writing
+anything.  nothing here touches django, so scenarios can be fanned out to a process pool"""
+import collections
+import copy
+import csv
+import itertools
+import math
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+
+ACUITY_FLAGS = ('CCU', 'COVID', 'isolation', 'telemetry', 'high_acuity')  # the axis of every acuity vector
+DEFAULT_WEIGHTS = (1.0,) * len(ACUITY_FLAGS)  # every flag balanced equally, unless ACUITY_DIMENSIONS says otherwise
+CAPS = ('max_total', *[f'max_{flag}' for flag in ACUITY_FLAGS])  # a line item's caps on its assigned census
+
+
+class SimulatedLineItem:
+    """a line item's batting order and censuses as plain slots: a total plus an acuity vector (patient counts
+    along ACUITY_FLAGS) for each of its starting, optimal and assigned censuses.  weights scale each acuity
+    dimension's difference from optimal before it is squared, so a weight of 2 counts one patient off as two, and 0
+    leaves the dimension unbalanced.  source is whatever the state was loaded from (e.g. the
+    PatientAssignmentLineItem, see its get_state), for writing results back.  max_total and
+    max_acuity (along ACUITY_FLAGS) are hard caps on the assigned census, None for no cap.
+
+    the weighted deviations from optimal, the distance they add up to, and the improvement each patient class (see
+    SimulatedPatient.acuity_class) would bring are memoized.  an improvement only revisits the dimensions of the
+    class's own flags, so the per-patient work of choosing a line item doesn't grow with the number of dimensions.
+    they only change when this line item gets a patient, or its optimum is reset (call forget_distances)"""
+    __slots__ = ('abbreviation', 'position_in_batting_order', 'weights', 'starting_total', 'optimal_total',
+                 'assigned_total', 'starting', 'optimal', 'assigned', 'assigned_patients', 'source', 'deviations',
+                 'squared_distance', 'distance', 'improvements', 'max_total', 'max_acuity', 'acuity_capped')
+
+    def __init__(self, abbreviation, position_in_batting_order, total, acuity, source=None, weights=DEFAULT_WEIGHTS,
+                 max_total=None, max_acuity=None):
+        self.abbreviation = abbreviation
+        self.position_in_batting_order = position_in_batting_order
+        self.weights = weights
+        self.max_total = math.inf if max_total is None else max_total
+        self.max_acuity = [math.inf if cap is None else cap for cap in max_acuity or [None] * len(ACUITY_FLAGS)]
+        self.acuity_capped = any(cap < math.inf for cap in self.max_acuity)
+        self.starting_total = self.optimal_total = self.assigned_total = total
+        self.starting = list(acuity)
+        self.optimal, self.assigned = list(acuity), list(acuity)
+        self.assigned_patients = []
+        self.source = source
+        self.forget_distances()
+
+    def forget_distances(self):
+        self.distance = None
+        self.improvements = {}  # by patient acuity class
+
+    def assign_patient(self, patient):
+        self.assigned_patients.append(patient.number_designation)
+        self.assigned_total += 1
+        for index in patient.flag_indexes:
+            self.assigned[index] += 1
+        self.forget_distances()
+
+    def has_acuity_room_for(self, patient):
+        """whether patient can be added without any acuity passing its cap (check acuity_capped first, it's
+        cheaper)"""
+        return all(self.assigned[index] < self.max_acuity[index] for index in patient.flag_indexes)
+
+    def get_distance_from_assigned_census_to_optimal(self):
+        if self.distance is None:
+            self.deviations = [weight * (optimal - assigned) for weight, optimal, assigned in
+                               zip(self.weights, self.optimal, self.assigned)]
+            self.squared_distance = sum(deviation * deviation for deviation in self.deviations)
+            self.distance = math.sqrt(self.squared_distance)
+        return self.distance
+
+    def get_distance_moved_closer_to_optimal_after_adding_patient(self, patient):
+        improvement = self.improvements.get(patient.acuity_class)
+        if improvement is None:
+            distance = self.get_distance_from_assigned_census_to_optimal()
+            squared_distance = self.squared_distance
+            for index in patient.flag_indexes:  # each of patient's flags moves its deviation by its weight
+                deviation = self.deviations[index]
+                moved = deviation - self.weights[index]
+                squared_distance += moved * moved - deviation * deviation
+            improvement = self.improvements[patient.acuity_class] = distance - math.sqrt(max(squared_distance, 0))
+        return improvement
+
+    def to_dict(self):
+        return {'abbreviation': self.abbreviation, 'position_in_batting_order': self.position_in_batting_order,
+                'starting_census': dict(zip(ACUITY_FLAGS, self.starting), total=self.starting_total),
+                'optimal_census': dict(zip(ACUITY_FLAGS, self.optimal), total=self.optimal_total),
+                'assigned_census': dict(zip(ACUITY_FLAGS, self.assigned), total=self.assigned_total),
+                'assigned_patients': self.assigned_patients}
+
+
+class SimulatedPatient:
+    """a patient's acuity flags as a vector of ints along ACUITY_FLAGS, and bounce target abbreviation.
+    acuity_class numbers the combination of flags (as bits) and flag_indexes lists the flags set.  id is the
+    Patient's, when loaded from one"""
+    __slots__ = ('number_designation', 'acuity', 'acuity_class', 'flag_indexes', 'bounce_to', 'id')
+
+    def __init__(self, number_designation, CCU=False, COVID=False, bounce_to=None, id=None, **flags):
+        flags.update(CCU=CCU, COVID=COVID)
+        self.number_designation = number_designation
+        self.acuity = tuple(int(bool(flags.get(flag))) for flag in ACUITY_FLAGS)
+        self.flag_indexes = tuple(index for index, flag in enumerate(self.acuity) if flag)
+        self.acuity_class = sum(1 << index for index in self.flag_indexes)
+        self.bounce_to = bounce_to
+        self.id = id
+
+    @classmethod
+    def from_dict(cls, patient):
+        return cls(patient['number_designation'], bounce_to=patient['bounce_to'],
+                   **{flag: patient.get(flag, False) for flag in ACUITY_FLAGS})
+
+    def get_flags(self):
+        return dict(zip(ACUITY_FLAGS, map(bool, self.acuity)))
+
+
+class BouncebackNotRoundingError(ValueError):
+    pass
+
+
+class InfeasibleAssignmentError(ValueError):
+    """the patients can't all be assigned within the rounders' caps"""
+
+
+def apply_overrides(description, overrides):
+    """returns a copy of description with any of these overrides applied, in this order:
+    remove_rounders: abbreviations to drop
+    add_rounders: rounder dicts to add, after the current batting order unless they give a position
+    batting_order: abbreviations in their new order, unlisted rounders keep their order behind them
+    add_patients: patient dicts to add, numbered on from the current patients unless they give a number"""
+    description = copy.deepcopy(description)
+    overrides = overrides or {}
+    rounders = [rounder for rounder in description['rounders']
+                if rounder['abbreviation'] not in overrides.get('remove_rounders', [])]
+    for rounder in overrides.get('add_rounders', []):
+        last_position = max([other['position_in_batting_order'] for other in rounders], default=0)
+        rounders.append(dict({'position_in_batting_order': last_position + 1}, **rounder))
+    if batting_order := overrides.get('batting_order'):
+        rounders.sort(key=lambda rounder: (batting_order.index(rounder['abbreviation'])
+                                           if rounder['abbreviation'] in batting_order else len(batting_order),
+                                           rounder['position_in_batting_order']))
+        for index, rounder in enumerate(rounders):
+            rounder['position_in_batting_order'] = index + 1
+    patients = description['patients']
+    for patient in overrides.get('add_patients', []):
+        last_number = max([other['number_designation'] for other in patients], default=0)
+        patients.append(dict({'number_designation': last_number + 1, 'bounce_to': None,
+                              **dict.fromkeys(ACUITY_FLAGS, False)}, **patient))
+    description['rounders'] = rounders
+    return description
+
+
+def read_csv_flag(value):
+    return (value or '').strip().lower() in ['1', 'x', 'y', 'yes', 't', 'true']
+
+
+def read_csv_cap(value):
+    return int(value) if (value or '').strip() else None
+
+
+def read_description_from_csv(rounders_path, patients_path):
+    """builds a description from a rounders csv (abbreviation, total, CCU, COVID and optionally
+    position_in_batting_order, else row order, counts for the other ACUITY_FLAGS and CAPS, blank for none) and a
+    patients csv (number_designation, CCU, COVID, bounce_to and optionally the other ACUITY_FLAGS, with yes/no style flags and a
+    blank bounce_to for non-bouncebacks)"""
+    with open(rounders_path, newline='') as rounders_file:
+        rounders = [dict({flag: int(row.get(flag) or 0) for flag in ACUITY_FLAGS},
+                         **{cap: read_csv_cap(row.get(cap)) for cap in CAPS},
+                         abbreviation=row['abbreviation'].strip(),
+                         position_in_batting_order=int(row.get('position_in_batting_order') or index + 1),
+                         total=int(row['total']), CCU=int(row['CCU']), COVID=int(row['COVID']))
+                    for index, row in enumerate(csv.DictReader(rounders_file))]
+    with open(patients_path, newline='') as patients_file:
+        patients = [dict({flag: read_csv_flag(row.get(flag)) for flag in ACUITY_FLAGS},
+                         number_designation=int(row['number_designation']),
+                         bounce_to=(row.get('bounce_to') or '').strip() or None)
+                    for row in csv.DictReader(patients_file)]
+    return {'rounders': rounders, 'patients': patients}
+
+
+def simulate_csv(rounders_path, patients_path, weights=DEFAULT_WEIGHTS):
+    """reads and simulates one pair of csvs, returning (description, result, seconds taken)"""
+    start = time.perf_counter()
+    description = read_description_from_csv(rounders_path, patients_path)
+    return description, simulate(description, weights=weights), time.perf_counter() - start
+
+
+def get_ordered_line_items(description, weights=DEFAULT_WEIGHTS):
+    ordered_rounders = sorted(description['rounders'], key=lambda rounder: rounder['position_in_batting_order'])
+    return [SimulatedLineItem(rounder['abbreviation'], rounder['position_in_batting_order'], rounder['total'],
+                              [rounder.get(flag, 0) for flag in ACUITY_FLAGS], weights=weights,
+                              max_total=rounder.get('max_total'),
+                              max_acuity=[rounder.get(f'max_{flag}') for flag in ACUITY_FLAGS])
+            for rounder in ordered_rounders]
+
+
+def get_line_item_for_bounceback(line_items_by_abbreviation, patient):
+    try:
+        return line_items_by_abbreviation[patient.bounce_to]
+    except KeyError:
+        raise BouncebackNotRoundingError(f'Patient {patient.number_designation} bounces back to {patient.bounce_to}, '
+                                         f'who is not rounding on this distribution')
+
+
+def allocate_bounceback_patients(line_items, patients):
+    line_items_by_abbreviation = {line_item.abbreviation: line_item for line_item in line_items}
+    for patient in patients:
+        if patient.bounce_to:
+            line_item = get_line_item_for_bounceback(line_items_by_abbreviation, patient)
+            line_item.optimal_total += 1
+            for index in patient.flag_indexes:
+                line_item.optimal[index] += 1
+            line_item.forget_distances()
+
+
+def get_room(line_items):
+    """each line item's room under its max_total, and under each of its acuity caps (along ACUITY_FLAGS)"""
+    total_room = {line_item: max(0, line_item.max_total - line_item.assigned_total) for line_item in line_items}
+    acuity_room = {line_item: [max(0, cap - assigned) for cap, assigned in
+                               zip(line_item.max_acuity, line_item.assigned)] for line_item in line_items}
+    return total_room, acuity_room
+
+
+class CapacityPlan:
+    """how non-bounceback patients fit in the line items' room under their caps, kept up to date while they're
+    assigned one by one so that the strategies only choose among line items that leave room for the patients still
+    to come.
+
+    exact, and worked out from the count of each acuity class rather than patient by patient: only the capped flags
+    tell classes apart, and while every patient has at most one capped flag the line items' room is a sum of
+    polymatroids, so Hall's condition settles what fits: for every set of capped flags, the patients with any of them
+    have to fit in the line items' room for them, which is never more than their room for anybody.  the room and the
+    patients for each set are counted once and kept up to date, a handful of sums per patient placed.  the few
+    patients with several capped flags are planned onto line items up front (see place_multiply_capped_patients),
+    leaving a quota per capped class and line item, with their room set aside"""
+
+    def __init__(self, line_items, total_room, acuity_room, class_counts):
+        """raises InfeasibleAssignmentError when patients with class_counts (acuity class: count) can't all be placed
+        in the given room (see get_room), which the plan takes over"""
+        self.line_items = line_items
+        self.total_room, self.acuity_room = total_room, acuity_room
+        self.capped_indexes = [index for index in range(len(ACUITY_FLAGS))
+                               if any(acuity_room[line_item][index] < math.inf for line_item in line_items)]
+        self.capped_mask = sum(1 << index for index in self.capped_indexes)
+        self.flag_sets = [indexes for size in range(len(self.capped_indexes) + 1)
+                          for indexes in itertools.combinations(self.capped_indexes, size)]
+        self.masks = [sum(1 << index for index in indexes) for indexes in self.flag_sets]
+        counts = collections.Counter()
+        for acuity_class, count in class_counts.items():
+            counts[acuity_class & self.capped_mask] += count
+        self.needed = [sum(count for capped_class, count in counts.items() if not mask or capped_class & mask)
+                       for mask in self.masks]
+        self.rooms = {line_item: self.get_rooms(line_item) for line_item in line_items}
+        self.room = [sum(rooms[position] for rooms in self.rooms.values()) for position in range(len(self.masks))]
+        shortfall = self.find_shortfall()
+        if shortfall:
+            raise InfeasibleAssignmentError(shortfall)
+        multiply_capped = sorted(capped_class for capped_class, count in counts.items()
+                                 if bin(capped_class).count('1') > 1 for _ in range(count))
+        placements = self.place_multiply_capped_patients(multiply_capped)
+        if placements is None:
+            flags = ' and '.join(ACUITY_FLAGS[index] for index in self.capped_indexes)
+            raise InfeasibleAssignmentError(f'The patients with several of {flags} can\'t all be placed under the '
+                                            f'rounders\' caps')
+        self.quotas = {}  # by capped class then line item, for the patients with several capped flags
+        for capped_class, line_item in zip(multiply_capped, placements):
+            self.quotas.setdefault(capped_class, collections.Counter())[line_item] += 1
+        self.reserved = len(placements)
+
+    def get_rooms(self, line_item):
+        """line_item's room for the patients with each set of capped flags, the empty set standing for anybody"""
+        total_room = self.total_room[line_item]
+        return [min(total_room, sum(self.acuity_room[line_item][index] for index in indexes)) if indexes
+                else total_room for indexes in self.flag_sets]
+
+    def find_shortfall(self):
+        """None when the patients still to be placed fit, otherwise why not"""
+        for indexes, room, needed in zip(self.flag_sets, self.room, self.needed):
+            if room < needed:
+                patients = ' or '.join(ACUITY_FLAGS[index] for index in indexes) + ' patients' if indexes \
+                    else 'patients'
+                return f'Only {room} of the {needed} {patients} fit under the rounders\' caps'
+        return None
+
+    def take(self, line_item, capped_class, step=1):
+        """places a patient with capped_class on line_item, or takes them off again with a step of -1"""
+        for position, mask in enumerate(self.masks):
+            if not mask or capped_class & mask:
+                self.needed[position] -= step
+        self.total_room[line_item] -= step
+        for index in self.capped_indexes:
+            if capped_class & 1 << index:
+                self.acuity_room[line_item][index] -= step
+        rooms = self.get_rooms(line_item)
+        for position, (room, old_room) in enumerate(zip(rooms, self.rooms[line_item])):
+            if room != old_room:  # also keeps an uncapped (infinite) room from turning into nan
+                self.room[position] += room - old_room
+        self.rooms[line_item] = rooms
+
+    def place_multiply_capped_patients(self, multiply_capped):
+        """a line item for each of multiply_capped (the capped classes of the patients with more than one capped
+        flag, sorted) such that everybody else still fits, or None when there's no such placement.  a depth first
+        search that checks Hall's condition at every step: each placement is tried on one line item per distinct room
+        left, the roomiest first so that the placements spread out, and room left that has failed before isn't
+        searched again.  the placements found are left taken"""
+
+        def get_room_left(line_item):
+            return self.total_room[line_item], tuple(self.acuity_room[line_item][index]
+                                                     for index in self.capped_indexes)
+
+        def get_key():
+            return len(multiply_capped) - len(placements), tuple(sorted(map(get_room_left, self.line_items)))
+
+        def get_choices(capped_class):
+            """a generator, as the first choice nearly always works out: the rest are only worked out (from the
+            room left where the step started) when it doesn't"""
+            indexes = [index for index in self.capped_indexes if capped_class & 1 << index]
+
+            def get_roominess(line_item):
+                acuity_room = self.acuity_room[line_item]
+                return (self.total_room[line_item] >= 1 and all(acuity_room[index] >= 1 for index in indexes),
+                        sum(acuity_room[index] for index in indexes), self.total_room[line_item])
+
+            roomiest = max(self.line_items, key=get_roominess)
+            if not get_roominess(roomiest)[0]:
+                return
+            yield roomiest
+            tried = get_room_left(roomiest)
+            choices = {}
+            for line_item in self.line_items:
+                if get_roominess(line_item)[0]:
+                    choices.setdefault(get_room_left(line_item), line_item)
+            for room_left, line_item in sorted(choices.items(), key=lambda choice: get_roominess(choice[1]),
+                                               reverse=True):
+                if room_left != tried:
+                    yield line_item
+
+        failed, placements = set(), []
+        steps = [get_choices(multiply_capped[0])] if multiply_capped else []  # one per placement being made
+        while steps:
+            if len(placements) == len(steps):  # back out this step's last try
+                self.take(placements.pop(), multiply_capped[len(placements)], -1)
+            line_item = next(steps[-1], None)
+            if line_item is None:  # back where this step started, with nowhere left to try
+                failed.add(get_key())
+                steps.pop()
+                continue
+            self.take(line_item, multiply_capped[len(placements)])
+            placements.append(line_item)
+            if self.find_shortfall() or failed and get_key() in failed:
+                continue
+            if len(placements) == len(multiply_capped):
+                return placements
+            steps.append(get_choices(multiply_capped[len(placements)]))
+        return None if multiply_capped else []
+
+    def takes_room_from(self, line_item, capped_class, positions):
+        """whether a patient with capped_class would take any of line_item's room for the sets of flags at
+        positions"""
+        total_room = self.total_room[line_item] - 1
+        acuity_room = self.acuity_room[line_item]
+        rooms = self.rooms[line_item]
+        for position in positions:
+            indexes = self.flag_sets[position]
+            room = min(total_room, sum(acuity_room[index] - bool(capped_class & 1 << index) for index in indexes)) \
+                if indexes else total_room
+            if room < rooms[position]:
+                return True
+        return False
+
+    def get_line_items_leaving_room(self, line_items, patient):
+        """the line items patient can be placed on and still leave room for the patients after them"""
+        capped_class = patient.acuity_class & self.capped_mask
+        if capped_class in self.quotas:
+            quota = self.quotas[capped_class]
+            return [line_item for line_item in line_items if quota[line_item]]
+        full = []  # the sets of flags with no room to spare for the patients after this one
+        for position, (mask, room, needed) in enumerate(zip(self.masks, self.room, self.needed)):
+            if not mask or capped_class & mask:
+                needed -= 1
+            if room <= needed:
+                full.append(position)
+        if not full and not self.reserved:
+            return line_items
+        indexes = [index for index in self.capped_indexes if capped_class & 1 << index]
+        return [line_item for line_item in line_items if self.total_room[line_item] >= 1
+                and all(self.acuity_room[line_item][index] >= 1 for index in indexes)
+                and not self.takes_room_from(line_item, capped_class, full)]
+
+    def place(self, line_item, patient):
+        capped_class = patient.acuity_class & self.capped_mask
+        if capped_class in self.quotas:
+            self.quotas[capped_class][line_item] -= 1
+            self.reserved -= 1
+        else:
+            self.take(line_item, capped_class)
+
+
+def check_capacity(line_items, patients):
+    """raises InfeasibleAssignmentError up front when the patients can't all fit under the line items' caps: each
+    line item's bouncebacks have to fit under its own caps, and the other patients in the room left (see
+    CapacityPlan)"""
+    line_items_by_abbreviation = {line_item.abbreviation: line_item for line_item in line_items}
+    total_room, acuity_room = get_room(line_items)
+    class_counts = collections.Counter()
+    for patient in patients:
+        if patient.bounce_to:
+            line_item = get_line_item_for_bounceback(line_items_by_abbreviation, patient)
+            total_room[line_item] -= 1
+            for index in patient.flag_indexes:
+                acuity_room[line_item][index] -= 1
+        else:
+            class_counts[patient.acuity_class] += 1
+    for line_item in line_items:
+        if total_room[line_item] < 0 or any(room < 0 for room in acuity_room[line_item]):
+            raise InfeasibleAssignmentError(f'The patients bouncing back to {line_item.abbreviation} would put them '
+                                            f'over their caps')
+    CapacityPlan(line_items, total_room, acuity_room, class_counts)
+
+
+def set_optimal_census_total(line_items, patients):
+    """hands each non-bounceback patient's place to the (last) lowest optimal total still under its max_total"""
+    for i in range(sum(1 for patient in patients if not patient.bounce_to)):
+        line_item_with_last_lowest_total = None
+        for line_item in line_items:
+            if line_item.optimal_total < line_item.max_total and (
+                    line_item_with_last_lowest_total is None or
+                    line_item.optimal_total <= line_item_with_last_lowest_total.optimal_total):
+                line_item_with_last_lowest_total = line_item
+        if line_item_with_last_lowest_total is None:
+            raise InfeasibleAssignmentError('There are more patients than room under the rounders\' caps')
+        line_item_with_last_lowest_total.optimal_total += 1
+
+
+def set_optimal_census_acuity(line_items, patients):
+    """spreads each acuity dimension's starting and patient counts over the line items in proportion to their
+    optimal totals, one pass over the patients for all dimensions"""
+    acuity_totals = [sum(column) for column in zip(*(line_item.starting for line_item in line_items))]
+    for patient in patients:
+        for index in patient.flag_indexes:
+            acuity_totals[index] += 1
+    optimal_acuity_census = [acuity_total / len(line_items) for acuity_total in acuity_totals]
+    optimal_total_census_average = sum(line_item.optimal_total for line_item in line_items) / len(line_items)
+    for line_item in line_items:
+        total_census_weighting_factor = line_item.optimal_total / optimal_total_census_average
+        line_item.optimal = [total_census_weighting_factor * census for census in optimal_acuity_census]
+        line_item.forget_distances()
+
+
+def calculate_optimal_census(line_items, patients):
+    check_capacity(line_items, patients)
+    allocate_bounceback_patients(line_items, patients)
+    set_optimal_census_total(line_items, patients)
+    set_optimal_census_acuity(line_items, patients)
+
+
+def get_line_items_with_room(line_items, patient):
+    """the line items that can take patient short of their optimal totals and acuity caps or, when the caps turn
+    patient away from all of those, short of their max totals and acuity caps instead; the strategies choose among
+    these, so the caps are honored without trying patients on line items and backing out"""
+    flagged = bool(patient.flag_indexes)  # no acuity cap turns away a patient without flags
+    line_items_with_room = [line_item for line_item in line_items if line_item.assigned_total < line_item.optimal_total
+                            and (not flagged or not line_item.acuity_capped or line_item.has_acuity_room_for(patient))]
+    if not line_items_with_room:
+        line_items_with_room = [line_item for line_item in line_items if line_item.assigned_total < line_item.max_total
+                                and (not flagged or not line_item.acuity_capped or
+                                     line_item.has_acuity_room_for(patient))]
+    if not line_items_with_room:
+        raise InfeasibleAssignmentError(f'There are no line items with space for patient '
+                                        f'{patient.number_designation}')
+    return line_items_with_room
+
+
+def get_line_item_moved_furthest_toward_optimal_by_adding_patient(line_items, patient):
+    return max(get_line_items_with_room(line_items, patient),
+               key=lambda line_item: line_item.get_distance_moved_closer_to_optimal_after_adding_patient(patient))
+
+
+def get_line_item_with_fewest_assigned_patients(line_items, patient):
+    return min(get_line_items_with_room(line_items, patient), key=lambda line_item: line_item.assigned_total)
+
+
+def get_next_line_item_in_batting_order(line_items, patient):
+    return get_line_items_with_room(line_items, patient)[0]
+
+
+# how each strategy picks the line item for a non-bounceback patient; greedy is what Distribution uses
+STRATEGIES = {
+    'greedy': get_line_item_moved_furthest_toward_optimal_by_adding_patient,
+    'fewest_assigned': get_line_item_with_fewest_assigned_patients,
+    'batting_order': get_next_line_item_in_batting_order,
+}
+
+
+def assign_bounceback_patients(line_items, patients):
+    """assigns bouncebacks to their providers, returning the (line item, patient) assignments made"""
+    line_items_by_abbreviation = {line_item.abbreviation: line_item for line_item in line_items}
+    assignments = []
+    for patient in patients:
+        if patient.bounce_to:
+            line_item = get_line_item_for_bounceback(line_items_by_abbreviation, patient)
+            line_item.assign_patient(patient)
+            assignments.append((line_item, patient))
+    return assignments
+
+
+def get_assignment_order(patient):
+    return tuple(-flag for flag in patient.acuity) + (patient.number_designation,)
+
+
+def assign_non_bounceback_patients(line_items, patients, strategy='greedy'):
+    """assigns the other patients, the highest acuity (in ACUITY_FLAGS order, so CCU then COVID) first, returning
+    the (line item, patient) assignments made.  under acuity caps, the strategy only chooses among the line items
+    that leave the patients still to come room (see CapacityPlan)"""
+    choose_line_item = STRATEGIES[strategy]
+    non_bounceback_patients = sorted([patient for patient in patients if not patient.bounce_to],
+                                     key=get_assignment_order)
+    acuity_capped = any(line_item.acuity_capped for line_item in line_items)
+    capacity_plan = CapacityPlan(line_items, *get_room(line_items), collections.Counter(
+        patient.acuity_class for patient in non_bounceback_patients)) if acuity_capped else None
+    assignments = []
+    for patient in non_bounceback_patients:
+        if capacity_plan:
+            line_item = choose_line_item(capacity_plan.get_line_items_leaving_room(line_items, patient), patient)
+            capacity_plan.place(line_item, patient)
+        else:
+            line_item = choose_line_item(line_items, patient)
+        line_item.assign_patient(patient)
+        assignments.append((line_item, patient))
+    return assignments
+
+
+def assign_all_patients(line_items, patients, strategy='greedy'):
+    calculate_optimal_census(line_items, patients)
+    return assign_bounceback_patients(line_items, patients) + \
+        assign_non_bounceback_patients(line_items, patients, strategy=strategy)
+
+
+def simulate(description, overrides=None, strategy='greedy', weights=DEFAULT_WEIGHTS):
+    """returns the proposed censuses and assigned patient numbers for each rounder, in batting order"""
+    description = apply_overrides(description, overrides)
+    line_items = get_ordered_line_items(description, weights=weights)
+    if description['patients'] and not line_items:
+        raise ValueError('There are patients to assign but no rounders')
+    if line_items:
+        assign_all_patients(line_items, [SimulatedPatient.from_dict(patient) for patient in description['patients']],
+                            strategy=strategy)
+    return {'line_items': [line_item.to_dict() for line_item in line_items]}
+
+
+def simulate_scenario(description_overrides_and_weights):
+    description, overrides, weights = description_overrides_and_weights
+    return simulate(description, overrides, weights=weights)
+
+
+def score(result):
+    """fairness of a simulated result: spread of the final loads and how far each of ACUITY_FLAGS ended from
+    optimal"""
+    line_items = result['line_items']
+    totals = [line_item['assigned_census']['total'] for line_item in line_items]
+    record = {
+        'loads': {line_item['abbreviation']: line_item['assigned_census']['total'] for line_item in line_items},
+        'load_spread': max(totals) - min(totals) if totals else 0,
+        'load_stdev': statistics.pstdev(totals) if totals else 0,
+    }
+    for flag in ACUITY_FLAGS:
+        deviations = [abs(line_item['assigned_census'][flag] - line_item['optimal_census'][flag])
+                      for line_item in line_items]
+        record[f'{flag}_deviation'] = sum(deviations)
+        record[f'max_{flag}_deviation'] = max(deviations, default=0)
+    return record
+
+
+def replay(distribution_id, description, strategies, weights=DEFAULT_WEIGHTS):
+    """simulates a stored distribution's inputs under each strategy, returning one scored record per strategy"""
+    records = []
+    for strategy in strategies:
+        start = time.perf_counter()
+        try:
+            record = score(simulate(description, strategy=strategy, weights=weights))
+        except ValueError as error:
+            record = {'error': str(error)}
+        record.update(distribution=distribution_id, strategy=strategy,
+                      runtime_ms=(time.perf_counter() - start) * 1000)
+        records.append(record)
+    return records
+
+
+def simulate_many(description, scenarios, max_workers=None, weights=DEFAULT_WEIGHTS):
+    """simulates each overrides dict in scenarios against description across a process pool, returning results in
+    scenario order; max_workers=1 runs them in this process"""
+    if max_workers == 1:
+        return [simulate(description, overrides, weights=weights) for overrides in scenarios]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(simulate_scenario, [(description, overrides, weights) for overrides in scenarios]))
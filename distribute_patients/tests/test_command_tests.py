@@ -0,0 +1,178 @@
+import json
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, TransactionTestCase
+
+from ..helper_fxns import helper_fxn_create_distribution_with_4_sample_line_items, \
+    helper_fxn_create_motley_list_of_patients_assign_to_distribution
+from ..models import Distribution, Patient, ProviderDailyStats
+
+
+class BenchmarkRenderCommandTests(TestCase):
+    def test_command_reports_both_pages_for_each_form_count_and_leaves_no_rows(self):
+        out = StringIO()
+        call_command('benchmark_render', '--form-counts', '3', '5', '--repeat', '1', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[0].startswith('set_rounders'))
+        self.assertTrue(lines[3].startswith('designate_patients'))
+        self.assertEqual(Distribution.objects.count(), 0)
+        self.assertEqual(Patient.objects.count(), 0)
+
+
+class ReplayDistributionsCommandTests(TestCase):
+    def setUp(self):
+        for patient_count in [8, 20]:
+            helper_fxn_create_distribution_with_4_sample_line_items()
+            helper_fxn_create_motley_list_of_patients_assign_to_distribution(
+                patient_count=patient_count, distribution=Distribution.objects.last())
+        self.output_path = os.path.join(tempfile.mkdtemp(), 'replay.jsonl')
+
+    def test_command_streams_one_record_per_distribution_and_strategy(self):
+        out = StringIO()
+        call_command('replay_distributions', '--strategy', 'greedy', 'fewest_assigned', '--output', self.output_path,
+                     '--workers', '2', '--chunk-size', '1', stdout=out)
+        with open(self.output_path) as output:
+            records = [json.loads(line) for line in output]
+        self.assertEqual([(record['distribution'], record['strategy']) for record in records],
+                         [(1, 'greedy'), (1, 'fewest_assigned'), (2, 'greedy'), (2, 'fewest_assigned')])
+        for record in records:
+            self.assertEqual(set(record['loads']), {'provA', 'provB', 'provC', 'provD'})
+            self.assertEqual(record['load_spread'], max(record['loads'].values()) - min(record['loads'].values()))
+            self.assertGreaterEqual(record['CCU_deviation'], 0)
+            self.assertGreater(record['runtime_ms'], 0)
+        self.assertIn('greedy: 2 replayed, 0 failed', out.getvalue())
+
+    def test_command_records_distributions_that_cannot_be_replayed(self):
+        helper_fxn_create_distribution_with_4_sample_line_items()
+        distribution = Distribution.objects.last()
+        distribution.line_items.all().delete()
+        Patient.objects.create(distribution=distribution, number_designation=1)
+        out = StringIO()
+        call_command('replay_distributions', '--output', self.output_path, '--workers', '1', stdout=out)
+        with open(self.output_path) as output:
+            records = [json.loads(line) for line in output]
+        self.assertEqual(len(records), 3)
+        self.assertIn('error', records[2])
+        self.assertIn('greedy: 2 replayed, 1 failed', out.getvalue())
+
+
+class AssignFromCsvCommandTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.rounders_path = os.path.join(self.directory, 'rounders.csv')
+        self.patients_path = os.path.join(self.directory, 'patients.csv')
+        with open(self.rounders_path, 'w') as rounders_file:
+            rounders_file.write('abbreviation,total,CCU,COVID\nalpha,10,1,2\nbravo,12,2,1\ncharlie,9,0,0\n')
+        with open(self.patients_path, 'w') as patients_file:
+            patients_file.write('number_designation,CCU,COVID,bounce_to\n')
+            for number in range(1, 13):
+                patients_file.write(f"{number},{'y' if number % 4 == 0 else ''},{'y' if number % 3 == 0 else ''},"
+                                    f"{'bravo' if number == 5 else ''}\n")
+
+    def test_command_saves_a_distribution_and_writes_assignments(self):
+        out = StringIO()
+        call_command('assign_from_csv', self.rounders_path, self.patients_path, '--workers', '1', stdout=out)
+        distribution = Distribution.objects.get()
+        self.assertEqual(distribution.count_to_distribute, 12)
+        self.assertEqual(distribution.patient_set.filter(patient_assignment_line_item__isnull=True).count(), 0)
+        self.assertEqual(distribution.patient_set.get(number_designation=5).patient_assignment_line_item.provider
+                         .abbreviation, 'bravo')
+        self.assertEqual(len(distribution.get_snapshot()['line_items']), 3)
+        with open(os.path.join(self.directory, 'patients_assignments.csv')) as output:
+            rows = output.read().splitlines()
+        self.assertEqual(rows[0], 'number_designation,CCU,COVID,bounce_to,assigned_to')
+        self.assertEqual(len(rows), 13)
+        self.assertIn('distribution', out.getvalue())
+
+    def test_command_reports_bad_files_and_keeps_going(self):
+        out, err = StringIO(), StringIO()
+        with self.assertRaises(CommandError):
+            call_command('assign_from_csv', self.rounders_path, os.path.join(self.directory, 'missing.csv'),
+                         self.rounders_path, self.patients_path, '--workers', '1', stdout=out, stderr=err)
+        self.assertIn('missing.csv', err.getvalue())
+        self.assertEqual(Distribution.objects.count(), 1)
+
+
+class RebuildProviderStatsCommandTests(TestCase):
+    def test_command_rebuilds_stats_for_assigned_distributions(self):
+        helper_fxn_create_distribution_with_4_sample_line_items()
+        distribution = Distribution.objects.last()
+        helper_fxn_create_motley_list_of_patients_assign_to_distribution(patient_count=8, distribution=distribution)
+        distribution.assign_all_patients()
+        ProviderDailyStats.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_provider_stats', stdout=out)
+        self.assertEqual(ProviderDailyStats.objects.filter(distribution=distribution).count(), 4)
+        self.assertIn('4 provider days from 1 distributions', out.getvalue())
+
+    def test_command_can_skip_the_migration_default_date(self):
+        helper_fxn_create_distribution_with_4_sample_line_items()
+        distribution = Distribution.objects.last()
+        helper_fxn_create_motley_list_of_patients_assign_to_distribution(patient_count=8, distribution=distribution)
+        distribution.assign_all_patients()
+        out = StringIO()
+        call_command('rebuild_provider_stats', '--skip-date', distribution.date.isoformat(), stdout=out)
+        self.assertFalse(ProviderDailyStats.objects.exists())
+        self.assertIn('0 provider days from 0 distributions', out.getvalue())
+
+
+class MeasureStartupCommandTests(TestCase):
+    def test_command_boots_the_production_profile_and_reports_each_phase(self):
+        out = StringIO()
+        with mock.patch.dict(os.environ, DJANGO_SECRET_KEY='test-key', SITENAME='localhost'):
+            call_command('measure_startup', '--profile', 'sqllitetest.settings_production', '--runs', '1',
+                         stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith('sqllitetest.settings_production /'))
+        self.assertEqual([line.split()[0] for line in lines[1:]],
+                         ['setup', 'application', 'precompile', 'ready', 'first_request', 'second_request', 'process'])
+
+
+class LoadTestCommandTests(TransactionTestCase):
+    def test_command_drives_the_whole_flow_and_cleans_up(self):
+        out = StringIO()
+        call_command('load_test', '--users', '1', '--rounders', '3', '--patients', '6', '--use-configured-db',
+                     stdout=out)
+        report = out.getvalue().splitlines()
+        self.assertTrue(report[0].startswith('1 users x 1 flows: 7 requests'))
+        rows = {line.split()[0]: line.split() for line in report[2:]}
+        self.assertEqual(list(rows), ['set_rounders', 'post_rounders', 'edit_count', 'post_count',
+                                      'designate_patients', 'post_designations', 'patient_assignments', 'all'])
+        self.assertEqual(rows['all'][6], '0')  # no errors
+        self.assertGreater(float(rows['post_designations'][8]), 0)  # queries counted by the in-process server
+        self.assertEqual(Distribution.objects.count(), 0)
+
+    def test_only_distributions_the_in_process_server_created_are_cleaned_up(self):
+        existing = Distribution.objects.create()
+
+        def create_a_distribution_elsewhere(*args):
+            Distribution.objects.create()
+            return []
+        for extra_arguments in [['--use-configured-db'], ['--base-url', 'http://127.0.0.1:9']]:
+            with self.subTest(extra_arguments=extra_arguments), \
+                    mock.patch('distribute_patients.management.commands.load_test.Command.run_user',
+                               side_effect=create_a_distribution_elsewhere):
+                call_command('load_test', '--users', '1', *extra_arguments, stdout=StringIO())
+        self.assertEqual(Distribution.objects.count(), 3)
+        self.assertTrue(Distribution.objects.filter(id=existing.id).exists())
+
+
+class CensusReportCommandTests(TestCase):
+    def test_command_reports_the_latest_distribution_in_the_chosen_format(self):
+        helper_fxn_create_distribution_with_4_sample_line_items()
+        out = StringIO()
+        call_command('census_report', '--format', 'csv', '--census', 'starting', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], 'line_item,provider,position_in_batting_order,starting_total,starting_CCU,'
+                                   'starting_COVID,starting_isolation,starting_telemetry,starting_high_acuity')
+        self.assertEqual(len(lines), 5)
+
+    def test_command_rejects_a_missing_distribution(self):
+        with self.assertRaises(CommandError):
+            call_command('census_report', '99', stdout=StringIO())
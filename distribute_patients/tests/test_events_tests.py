@@ -0,0 +1,105 @@
+import asyncio
+import json
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from ..events import AssignmentBroadcaster, AssignmentEventsApp, EVENTS_PATH, diff_snapshots
+
+
+def make_snapshot(distribution_id, **dual_neg_pts_by_provider):
+    return {'version': 1, 'id': distribution_id, 'count_to_distribute': 0,
+            'line_items': [dict(provider=provider, position_in_batting_order=index + 1, starting_census=[10, 1, 1],
+                                optimal_census=[12, 1.0, 1.0], assigned_census=[10 + len(patients), 1, 1],
+                                bounceback_pts=[], dual_pos_pts=[], ccu_pos_pts=[], covid_pos_pts=[],
+                                dual_neg_pts=patients)
+                           for index, (provider, patients) in enumerate(dual_neg_pts_by_provider.items())]}
+
+
+def read_event(body):
+    event, data = body.decode().strip().split('\n')
+    return event[len('event: '):], json.loads(data[len('data: '):])
+
+
+class DiffSnapshotsTests(SimpleTestCase):
+    def test_diff_holds_only_changed_line_items_and_removed_providers(self):
+        old_snapshot = make_snapshot(1, provA=[1], provB=[2], provC=[])
+        new_snapshot = make_snapshot(1, provA=[1], provB=[2, 3])
+        diff = diff_snapshots(old_snapshot, new_snapshot)
+        self.assertEqual([line_item['provider'] for line_item in diff['changed']], ['provB'])
+        self.assertEqual(diff['removed'], ['provC'])
+
+
+class AssignmentBroadcasterTests(SimpleTestCase):
+    def setUp(self):
+        self.current = (1, json.dumps(make_snapshot(1, provA=[1], provB=[])))
+        patcher = mock.patch('distribute_patients.events.load_current_snapshot', side_effect=lambda: self.current)
+        self.load_current_snapshot = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_each_change_is_read_once_and_sent_to_every_listener(self):
+        async def scenario():
+            broadcaster = AssignmentBroadcaster(poll_seconds=60)
+            queues = [await broadcaster.subscribe() for i in range(3)]
+            self.assertEqual([read_event(queue.get_nowait())[0] for queue in queues], ['snapshot'] * 3)
+            self.current = (1, json.dumps(make_snapshot(1, provA=[1], provB=[2])))
+            reads_before_change = self.load_current_snapshot.call_count
+            await broadcaster.poll_once()
+            self.assertEqual(self.load_current_snapshot.call_count, reads_before_change + 1)
+            events = [queue.get_nowait() for queue in queues]
+            self.assertTrue(all(event is events[0] for event in events))
+            event, diff = read_event(events[0])
+            self.assertEqual((event, [line_item['provider'] for line_item in diff['changed']]), ('diff', ['provB']))
+            await broadcaster.poll_once()
+            self.assertTrue(all(queue.empty() for queue in queues))
+            self.current = (2, json.dumps(make_snapshot(2, provC=[1])))
+            await broadcaster.poll_once()
+            self.assertEqual(read_event(queues[0].get_nowait()), ('snapshot', make_snapshot(2, provC=[1])))
+            broadcaster.poll_task.cancel()
+
+        asyncio.run(scenario())
+
+    def test_a_listener_that_falls_behind_gets_the_whole_snapshot(self):
+        async def scenario():
+            broadcaster = AssignmentBroadcaster(poll_seconds=60)
+            broadcaster.queue_size = 2
+            queue = await broadcaster.subscribe()
+            for patient_count in range(1, 4):
+                self.current = (1, json.dumps(make_snapshot(1, provA=list(range(patient_count)), provB=[])))
+                await broadcaster.poll_once()
+            self.assertEqual([read_event(queue.get_nowait())[0] for i in range(queue.qsize())], ['snapshot', 'diff'])
+            broadcaster.poll_task.cancel()
+
+        asyncio.run(scenario())
+
+
+class AssignmentEventsAppTests(SimpleTestCase):
+    def test_event_path_streams_and_other_paths_go_to_django(self):
+        django_app = mock.AsyncMock()
+        snapshot = make_snapshot(1, provA=[1])
+
+        async def scenario():
+            app = AssignmentEventsApp(django_app, broadcaster=AssignmentBroadcaster(poll_seconds=60))
+            await app({'type': 'http', 'path': '/distribute/patient_assignments/'}, None, None)
+            messages = []
+            disconnected = asyncio.Event()
+
+            async def receive():
+                await disconnected.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                messages.append(message)
+                if len(messages) == 2:
+                    disconnected.set()
+
+            with mock.patch('distribute_patients.events.load_current_snapshot',
+                            return_value=(1, json.dumps(snapshot))):
+                await app({'type': 'http', 'path': EVENTS_PATH}, receive, send)
+            self.assertEqual(app.broadcaster.listeners, set())
+            return messages
+
+        messages = asyncio.run(scenario())
+        self.assertEqual(django_app.call_count, 1)
+        self.assertIn((b'content-type', b'text/event-stream'), messages[0]['headers'])
+        self.assertEqual(read_event(messages[1]['body']), ('snapshot', snapshot))
@@ -1,9 +1,13 @@
 from django import forms
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
-from ..forms import PatientCountForm, PatientDesignateForm, BasePatientDesignateFormSet, RounderForm, BaseRounderFormSet
+from ..forms import PatientCountForm, PatientDesignateForm, BasePatientDesignateFormSet, RounderForm, \
+    BaseRounderFormSet, PatientDesignationListForm
 from ..helper_fxns import helper_fxn_create_distribution_with_4_sample_line_items
+from ..limits import check_rounder_formset_fits_upload_limit
 from ..models import Distribution, Patient, Provider, PatientAssignmentLineItem
 
 
@@ -72,6 +76,27 @@ class RounderFormTests(TestCase):
         self.assertEqual(PatientAssignmentLineItem.objects.count(), 0)
 
 
+class LargeFacilityLimitTests(TestCase):
+    data = {'abbreviation': 'provA', 'starting_total': 41, 'starting_CCU': 3, 'starting_COVID': 2}
+
+    def test_starting_census_is_capped_at_40_by_default(self):
+        self.assertFalse(RounderForm(data=self.data).is_valid())
+
+    @override_settings(LARGE_FACILITY_MODE=True)
+    def test_large_facility_mode_lifts_the_census_cap_and_offers_300_rounder_forms(self):
+        self.assertTrue(RounderForm(data=self.data).is_valid())
+        RounderFormSet = forms.formset_factory(form=RounderForm, formset=BaseRounderFormSet)
+        self.assertEqual(len(RounderFormSet().forms), 300)
+
+    @override_settings(ROUNDER_FORM_COUNT=300, DATA_UPLOAD_MAX_NUMBER_FIELDS=1000)
+    def test_check_flags_a_rounder_formset_too_big_to_post(self):
+        self.assertEqual([error.id for error in check_rounder_formset_fits_upload_limit(None)],
+                         ['distribute_patients.E001'])
+
+    def test_check_passes_the_default_limits(self):
+        self.assertEqual(check_rounder_formset_fits_upload_limit(None), [])
+
+
 class RounderFormSetTests(TestCase):
     def test_can_create_formset(self):
         RounderFormSet = forms.formset_factory(form=RounderForm, formset=BaseRounderFormSet)
@@ -85,6 +110,14 @@ class RounderFormSetTests(TestCase):
         for index, form in enumerate(formset.forms):
             self.assertEqual(form.id, index + 1)
 
+    def test_formset_forms_share_one_helper_with_per_form_id_and_placeholder(self):
+        RounderFormSet = forms.formset_factory(form=RounderForm, formset=BaseRounderFormSet)
+        formset = RounderFormSet()
+        self.assertEqual(len({id(form.helper) for form in formset.forms}), 1)
+        for index, form in enumerate(formset.forms):
+            self.assertEqual(form.fields['id'].widget.attrs['value'], index + 1)
+            self.assertEqual(form.fields['abbreviation'].widget.attrs['placeholder'], f'rounder {index + 1}')
+
     def test_saving_formset_creates_new_distribution(self):
         data = {'form-TOTAL_FORMS': 12, 'form-INITIAL_FORMS': 12}
         provider_names = ['provA', 'provB', 'provC', 'provD', 'provE', 'provF', 'provG', 'provH']
@@ -198,6 +231,44 @@ class RounderFormSetTests(TestCase):
             self.assertEqual(line_item.distribution, Distribution.objects.first())
 
 
+    def test_saving_formset_takes_same_number_of_queries_regardless_of_rounder_count(self):
+        RounderFormSet = forms.formset_factory(form=RounderForm, formset=BaseRounderFormSet)
+        query_counts = []
+        for rounder_count in [2, 12]:
+            data = {'form-TOTAL_FORMS': 12, 'form-INITIAL_FORMS': 12}
+            for i in range(12):
+                data.update({f'form-{i}-id': i + 1, f'form-{i}-abbreviation': f'pr{i}',
+                             f'form-{i}-starting_total': 10, f'form-{i}-starting_CCU': 2,
+                             f'form-{i}-starting_COVID': 1} if i < rounder_count else {f'form-{i}-id': i + 1})
+            formset = RounderFormSet(data=data)
+            self.assertTrue(formset.is_valid())
+            Distribution.objects.all().delete()
+            with CaptureQueriesContext(connection) as queries:
+                distribution = formset.save()
+            query_counts.append(len(queries))
+            self.assertEqual(distribution.line_items.count(), rounder_count)
+        self.assertEqual(query_counts[0], query_counts[1])
+
+    def test_saving_formset_sets_censuses_and_batting_order_from_forms(self):
+        data = {'form-TOTAL_FORMS': 3, 'form-INITIAL_FORMS': 3}
+        for i, (abbreviation, total, CCU, COVID) in enumerate([('provA', 11, 2, 1), ('', '', '', ''),
+                                                               ('provC', 14, 3, 5)]):
+            data.update({f'form-{i}-id': i + 1, f'form-{i}-abbreviation': abbreviation,
+                         f'form-{i}-starting_total': total, f'form-{i}-starting_CCU': CCU,
+                         f'form-{i}-starting_COVID': COVID})
+        RounderFormSet = forms.formset_factory(form=RounderForm, formset=BaseRounderFormSet)
+        formset = RounderFormSet(data=data)
+        self.assertTrue(formset.is_valid())
+        distribution = formset.save()
+        line_items = distribution.get_ordered_line_items()
+        self.assertEqual([line_item.position_in_batting_order for line_item in line_items], [1, 3])
+        self.assertEqual([line_item.provider.abbreviation for line_item in line_items], ['provA', 'provC'])
+        for census in ['starting_census', 'optimal_census', 'assigned_census']:
+            self.assertEqual([(getattr(line_item, census).total, getattr(line_item, census).CCU,
+                               getattr(line_item, census).COVID) for line_item in line_items],
+                             [(11, 2, 1), (14, 3, 5)])
+
+
 class PatientCountFormTests(TestCase):
     def test_can_create_form(self):
         form = PatientCountForm()
@@ -269,6 +340,20 @@ class PatientDesignateFormSetTests(TestCase):
             form.fields['bounce_to'].queryset = Provider.objects.filter(
                 patientassignmentlineitem__in=distribution.get_ordered_line_items())
 
+    def test_formset_forms_share_one_helper_and_one_bounceback_choices_query(self):
+        helper_fxn_create_distribution_with_4_sample_line_items()
+        distribution = Distribution.objects.last()
+        for i in range(6):
+            Patient.objects.create(distribution=distribution, number_designation=i + 1)
+        PatientDesignateFormSet = forms.modelformset_factory(model=Patient,
+                                                             fields=['CCU', 'COVID', 'bounce_to'],
+                                                             formset=BasePatientDesignateFormSet)
+        formset = PatientDesignateFormSet(distribution_id=distribution.id)
+        self.assertEqual(len({id(form.helper) for form in formset.forms}), 1)
+        with self.assertNumQueries(0):
+            for form in formset.forms:
+                self.assertEqual(len(list(form.fields['bounce_to'].widget.choices)), 5)  # blank plus 4 providers
+
     def test_saving_formset_with_previously_created_patients_updates_the_patients(self):
         distribution = Distribution.objects.create()
         for i in range(4):
@@ -304,3 +389,61 @@ class PatientDesignateFormSetTests(TestCase):
                 self.assertEqual(patient.CCU, True)
             else:
                 self.assertEqual(patient.CCU, False)
+
+
+class PatientDesignationListFormTests(TestCase):
+    def setUp(self):
+        helper_fxn_create_distribution_with_4_sample_line_items()
+        self.distribution = Distribution.objects.last()
+        for i in range(6):
+            Patient.objects.create(distribution=self.distribution, number_designation=i + 1, CCU=True)
+
+    def test_saving_list_updates_listed_patients_and_resets_the_rest(self):
+        form = PatientDesignationListForm(distribution=self.distribution,
+                                          data={'designation_list': '2 c v\n\n 5 V b:provB \n6 b:provA'})
+        self.assertTrue(form.is_valid())
+        form.save()
+        patients = {patient.number_designation: patient for patient in self.distribution.patient_set.all()}
+        self.assertEqual((patients[2].CCU, patients[2].COVID, patients[2].bounce_to), (True, True, None))
+        self.assertEqual((patients[5].CCU, patients[5].COVID, patients[5].bounce_to.abbreviation),
+                         (False, True, 'provB'))
+        self.assertEqual((patients[6].CCU, patients[6].COVID, patients[6].bounce_to.abbreviation),
+                         (False, False, 'provA'))
+        for number in [1, 3, 4]:
+            self.assertEqual((patients[number].CCU, patients[number].COVID, patients[number].bounce_to),
+                             (False, False, None))
+
+    def test_validating_and_saving_list_takes_same_number_of_queries_regardless_of_patient_count(self):
+        query_counts = []
+        for patient_count in [6, 150]:
+            self.distribution.patient_set.all().delete()
+            Patient.objects.bulk_create([Patient(distribution=self.distribution, number_designation=i + 1)
+                                         for i in range(patient_count)])
+            designation_list = '\n'.join(f'{i + 1} c b:provC' for i in range(0, patient_count, 2))
+            with CaptureQueriesContext(connection) as queries:
+                form = PatientDesignationListForm(distribution=self.distribution,
+                                                  data={'designation_list': designation_list})
+                self.assertTrue(form.is_valid())
+                form.save()
+            query_counts.append(len(queries))
+        self.assertEqual(query_counts[0], query_counts[1])
+        self.assertEqual(self.distribution.patient_set.filter(CCU=True).count(), 75)
+
+    def test_list_sets_isolation_telemetry_and_high_acuity(self):
+        form = PatientDesignationListForm(distribution=self.distribution, data={'designation_list': '1 i t\n2 h c'})
+        self.assertTrue(form.is_valid())
+        form.save()
+        self.assertEqual([(patient.CCU, patient.isolation, patient.telemetry, patient.high_acuity)
+                          for patient in self.distribution.patient_set.order_by('number_designation')[:3]],
+                         [(False, True, True, False), (True, False, False, True), (False, False, False, False)])
+
+    def test_list_reports_every_bad_line_at_once(self):
+        form = PatientDesignationListForm(distribution=self.distribution,
+                                          data={'designation_list': 'x c\n9 c\n1 c\n1 v\n2 q\n3 b:nobody'})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors['designation_list'], [
+            'line 1: "x" is not a patient number',
+            'line 2: there is no patient 9',
+            'line 4: patient 1 is listed twice',
+            'line 5: "q" should be c, v, i, t, h or b:<abbreviation>',
+            'line 6: nobody is not rounding on this distribution'])
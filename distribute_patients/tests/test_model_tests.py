@@ -1,14 +1,30 @@
+import contextlib
+import json
 import math
-from django.db.models import Avg, Count
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import Avg, Count, F, Sum
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
 from ..helper_fxns import helper_fxn_create_distribution_with_4_sample_line_items, \
     helper_fxn_create_motley_list_of_patients_assign_to_distribution, \
     helper_fxn_create_list_of_bounceback_patients_assign_to_distribution, \
     helper_fxn_create_distribution_with_up_to_4_sample_line_items
-from ..models import Distribution, Patient, PatientAssignmentLineItem, Provider, StartingCensus, AssignedCensus, \
-    AllocatedCounts, OptimalCensus
+from ..instrumentation import register_phase_hook, timed_phase, unregister_phase_hook
+from ..jobs import run_assignment_job
+from ..models import AssignmentJob, Distribution, Patient, PatientAssignmentLineItem, Provider, StartingCensus, AssignedCensus, \
+    AllocatedCounts, IdAllocationLock, OptimalCensus, ProviderDailyStats, SNAPSHOT_VERSION
+from ..simulation import ACUITY_FLAGS, InfeasibleAssignmentError, \
+    get_line_item_moved_furthest_toward_optimal_by_adding_patient
+
+
+def get_line_item_moved_furthest_toward_optimal(distribution, patient):
+    return get_line_item_moved_furthest_toward_optimal_by_adding_patient(distribution.get_line_item_states(),
+                                                                         patient.get_state()).source
 
 
 class PatientAssignmentLineItemTests(TestCase):
@@ -64,6 +80,22 @@ class PatientAssignmentLineItemTests(TestCase):
         self.assertEqual(assignment_line_item.assigned_census.CCU, assignment_line_item.starting_census.CCU)
         self.assertEqual(assignment_line_item.assigned_census.COVID, assignment_line_item.starting_census.COVID)
 
+    def test_creating_line_item_does_not_create_allocated_counts(self):
+        helper_fxn_create_distribution_with_4_sample_line_items()
+        self.assertEqual(AllocatedCounts.objects.count(), 0)
+        for line_item in PatientAssignmentLineItem.objects.all():
+            self.assertIsNone(line_item.allocated_counts)
+
+    def test_get_allocated_counts_creates_row_once_on_first_use(self):
+        helper_fxn_create_distribution_with_4_sample_line_items()
+        line_item = PatientAssignmentLineItem.objects.first()
+        allocated_counts = line_item.get_allocated_counts()
+        self.assertEqual(allocated_counts.total_count, 0)
+        self.assertEqual(AllocatedCounts.objects.count(), 1)
+        line_item = PatientAssignmentLineItem.objects.get(id=line_item.id)
+        self.assertEqual(line_item.get_allocated_counts(), allocated_counts)
+        self.assertEqual(AllocatedCounts.objects.count(), 1)
+
     def test_can_retrieve_distribution_patient_assignment_line_items_in_batting_order(self):
         helper_fxn_create_distribution_with_4_sample_line_items()
         self.assertEqual(Distribution.objects.last().line_items.count(), 4)
@@ -162,29 +194,29 @@ class OptimalAssignPatientsToLineItems(TestCase):
         line_item = self.distribution.get_ordered_line_items()[0]
         # should be starting at 11 (3) (3), will dummy up some optimal line items to confirm the distance
         line_item.optimal_census = OptimalCensus(total=13, CCU=4, COVID=4)
-        self.assertEqual(round(line_item.get_distance_from_assigned_census_to_optimal(), 2), 1.41)
+        self.assertEqual(round(line_item.get_state().get_distance_from_assigned_census_to_optimal(), 2), 1.41)
         line_item.optimal_census = OptimalCensus(total=14, CCU=5, COVID=4)
-        self.assertEqual(round(line_item.get_distance_from_assigned_census_to_optimal(), 2), 2.24)
+        self.assertEqual(round(line_item.get_state().get_distance_from_assigned_census_to_optimal(), 2), 2.24)
         line_item.optimal_census = OptimalCensus(total=18, CCU=7, COVID=6)
-        self.assertEqual(round(line_item.get_distance_from_assigned_census_to_optimal(), 2), 5)
+        self.assertEqual(round(line_item.get_state().get_distance_from_assigned_census_to_optimal(), 2), 5)
 
     def test_can_return_change_in_distance_from_optimal_by_adding_given_pt(self):
         line_item = self.distribution.get_ordered_line_items()[0]
         # should be starting at 11 (3) (3), will dummy up some optimal line items to confirm the distance
         line_item.optimal_census = OptimalCensus(total=18, CCU=7, COVID=6)
-        self.assertEqual(round(line_item.get_distance_from_assigned_census_to_optimal(), 2), 5)
+        self.assertEqual(round(line_item.get_state().get_distance_from_assigned_census_to_optimal(), 2), 5)
         patient = Patient.objects.create(CCU=True, COVID=True, number_designation=1, distribution=self.distribution)
-        self.assertEqual(round(line_item.get_distance_moved_closer_to_optimal_after_adding_patient(patient=patient), 2),
-                         round(5 - math.sqrt(13), 2))
+        self.assertEqual(round(line_item.get_state().get_distance_moved_closer_to_optimal_after_adding_patient(
+            patient.get_state()), 2), round(5 - math.sqrt(13), 2))
         patient = Patient.objects.create(CCU=True, COVID=False, number_designation=2, distribution=self.distribution)
-        self.assertEqual(round(line_item.get_distance_moved_closer_to_optimal_after_adding_patient(patient=patient), 2),
-                         round(5 - math.sqrt(18), 2))
+        self.assertEqual(round(line_item.get_state().get_distance_moved_closer_to_optimal_after_adding_patient(
+            patient.get_state()), 2), round(5 - math.sqrt(18), 2))
         patient = Patient.objects.create(CCU=False, COVID=True, number_designation=3, distribution=self.distribution)
-        self.assertEqual(round(line_item.get_distance_moved_closer_to_optimal_after_adding_patient(patient=patient), 2),
-                         round(5 - math.sqrt(20), 2))
+        self.assertEqual(round(line_item.get_state().get_distance_moved_closer_to_optimal_after_adding_patient(
+            patient.get_state()), 2), round(5 - math.sqrt(20), 2))
         patient = Patient.objects.create(CCU=False, COVID=False, number_designation=4, distribution=self.distribution)
-        self.assertEqual(round(line_item.get_distance_moved_closer_to_optimal_after_adding_patient(patient=patient), 2),
-                         0)
+        self.assertEqual(round(line_item.get_state().get_distance_moved_closer_to_optimal_after_adding_patient(
+            patient.get_state()), 2), 0)
 
     def test_can_return_line_item_moved_furthest_distance_toward_optimal_by_assignment_of_given_patient(self):
         # will dummy up line items so as to make it clear which one benefits most from a given patient
@@ -205,8 +237,7 @@ class OptimalAssignPatientsToLineItems(TestCase):
             starting_census=StartingCensus.objects.create(total=3, CCU=1, COVID=6),
             provider=Provider.objects.get_or_create(abbreviation='provB')[0])
         patient = Patient.objects.create(CCU=True, COVID=True, number_designation=1, distribution=distribution)
-        self.assertEqual(line_item2, distribution.get_line_item_moved_furthest_toward_optimal_by_adding_patient(
-            patient=patient))
+        self.assertEqual(line_item2, get_line_item_moved_furthest_toward_optimal(distribution, patient))
         # line item 3 will mostly need COVIDs than CCU's, so will come in 2nd
         line_item3 = PatientAssignmentLineItem.objects.create(
             position_in_batting_order=3, distribution=distribution,
@@ -214,8 +245,7 @@ class OptimalAssignPatientsToLineItems(TestCase):
             assigned_census=AssignedCensus.objects.create(total=19, CCU=4, COVID=2),
             starting_census=StartingCensus.objects.create(total=3, CCU=1, COVID=6),
             provider=Provider.objects.get_or_create(abbreviation='provB')[0])
-        self.assertEqual(line_item3, distribution.get_line_item_moved_furthest_toward_optimal_by_adding_patient(
-            patient=patient))
+        self.assertEqual(line_item3, get_line_item_moved_furthest_toward_optimal(distribution, patient))
         # line item 4 needs same number of COVIDs and CCUs, and will come in first
         line_item4 = PatientAssignmentLineItem.objects.create(
             position_in_batting_order=4, distribution=distribution,
@@ -223,8 +253,7 @@ class OptimalAssignPatientsToLineItems(TestCase):
             assigned_census=AssignedCensus.objects.create(total=19, CCU=2, COVID=2),
             starting_census=StartingCensus.objects.create(total=3, CCU=1, COVID=6),
             provider=Provider.objects.get_or_create(abbreviation='provB')[0])
-        self.assertEqual(line_item4, distribution.get_line_item_moved_furthest_toward_optimal_by_adding_patient(
-            patient=patient))
+        self.assertEqual(line_item4, get_line_item_moved_furthest_toward_optimal(distribution, patient))
 
     def test_only_return_furthest_distance_line_item_if_it_has_space_for_patient(self):
         # same as prior example, but only the least desirable line item has room for any total patients
@@ -244,8 +273,7 @@ class OptimalAssignPatientsToLineItems(TestCase):
             starting_census=StartingCensus.objects.create(total=3, CCU=1, COVID=6),
             provider=Provider.objects.get_or_create(abbreviation='provB')[0])
         patient = Patient.objects.create(CCU=True, COVID=True, number_designation=1, distribution=distribution)
-        self.assertEqual(line_item1, distribution.get_line_item_moved_furthest_toward_optimal_by_adding_patient(
-            patient=patient))
+        self.assertEqual(line_item1, get_line_item_moved_furthest_toward_optimal(distribution, patient))
         # line item 3 will mostly need COVIDs than CCU's, so will come in 2nd
         line_item3 = PatientAssignmentLineItem.objects.create(
             position_in_batting_order=3, distribution=distribution,
@@ -253,8 +281,7 @@ class OptimalAssignPatientsToLineItems(TestCase):
             assigned_census=AssignedCensus.objects.create(total=20, CCU=4, COVID=2),
             starting_census=StartingCensus.objects.create(total=3, CCU=1, COVID=6),
             provider=Provider.objects.get_or_create(abbreviation='provB')[0])
-        self.assertEqual(line_item1, distribution.get_line_item_moved_furthest_toward_optimal_by_adding_patient(
-            patient=patient))
+        self.assertEqual(line_item1, get_line_item_moved_furthest_toward_optimal(distribution, patient))
         # line item 4 needs same number of COVIDs and CCUs, and will come in first
         line_item4 = PatientAssignmentLineItem.objects.create(
             position_in_batting_order=4, distribution=distribution,
@@ -262,8 +289,7 @@ class OptimalAssignPatientsToLineItems(TestCase):
             assigned_census=AssignedCensus.objects.create(total=20, CCU=2, COVID=2),
             starting_census=StartingCensus.objects.create(total=3, CCU=1, COVID=6),
             provider=Provider.objects.get_or_create(abbreviation='provB')[0])
-        self.assertEqual(line_item1, distribution.get_line_item_moved_furthest_toward_optimal_by_adding_patient(
-            patient=patient))
+        self.assertEqual(line_item1, get_line_item_moved_furthest_toward_optimal(distribution, patient))
 
 
 
@@ -501,6 +527,77 @@ class DistributionTests(TestCase):
                          [11, 13, 10, 11])
         self.assertEqual(Distribution.objects.count(), 2)
 
+    def test_cloned_line_items_get_fresh_censuses_equal_to_the_prior_starting_census(self):
+        helper_fxn_create_distribution_with_4_sample_line_items()
+        prior_distribution = Distribution.objects.last()
+        new_distribution = Distribution.objects.create()
+        prior_distribution.duplicate_line_items_into(new_distribution)
+        for prior, new in zip(prior_distribution.get_ordered_line_items(), new_distribution.get_ordered_line_items()):
+            self.assertEqual((new.provider, new.position_in_batting_order),
+                             (prior.provider, prior.position_in_batting_order))
+            for census_name in ['starting_census', 'optimal_census', 'assigned_census']:
+                census = getattr(new, census_name)
+                self.assertNotEqual(census.id, getattr(prior, census_name).id)
+                self.assertEqual((census.total, census.CCU, census.COVID),
+                                 (prior.starting_census.total, prior.starting_census.CCU, prior.starting_census.COVID))
+            self.assertIsNone(new.allocated_counts)
+
+    def test_clone_can_seed_the_new_day_from_assigned_censuses(self):
+        helper_fxn_create_distribution_with_4_sample_line_items()
+        prior_distribution = Distribution.objects.last()
+        helper_fxn_create_motley_list_of_patients_assign_to_distribution(patient_count=20,
+                                                                         distribution=prior_distribution)
+        prior_distribution.assign_all_patients()
+        new_distribution = Distribution.objects.create()
+        prior_distribution.duplicate_line_items_into(new_distribution, seed_from='assigned')
+        self.assertEqual([(line_item.starting_census.total, line_item.starting_census.CCU,
+                           line_item.starting_census.COVID)
+                          for line_item in new_distribution.get_ordered_line_items()],
+                         [(line_item.assigned_census.total, line_item.assigned_census.CCU,
+                           line_item.assigned_census.COVID)
+                          for line_item in prior_distribution.get_ordered_line_items()])
+        self.assertEqual(sum(line_item.starting_census.total
+                             for line_item in new_distribution.get_ordered_line_items()), 45 + 20)
+
+    def test_clone_query_count_does_not_grow_with_roster_size(self):
+        query_counts = []
+        for line_item_count in [2, 4]:
+            helper_fxn_create_distribution_with_up_to_4_sample_line_items(line_item_count)
+            prior_distribution = Distribution.objects.last()
+            new_distribution = Distribution.objects.create()
+            with CaptureQueriesContext(connection) as queries:
+                prior_distribution.duplicate_line_items_into(new_distribution)
+            query_counts.append(len(queries))
+            self.assertEqual(new_distribution.line_items.count(), line_item_count)
+        self.assertEqual(query_counts[0], query_counts[1])
+
+    def test_clone_takes_the_id_allocation_lock_before_reading_max_ids(self):
+        helper_fxn_create_distribution_with_4_sample_line_items()
+        prior_distribution = Distribution.objects.last()
+        new_distribution = Distribution.objects.create()
+        with CaptureQueriesContext(connection) as queries:
+            prior_distribution.duplicate_line_items_into(new_distribution)
+        statements = [query['sql'] for query in queries]
+        lock_index = next(index for index, sql in enumerate(statements)
+                          if sql.startswith('UPDATE') and IdAllocationLock._meta.db_table in sql)
+        max_index = next(index for index, sql in enumerate(statements) if 'MAX(id)' in sql)
+        self.assertLess(lock_index, max_index)
+
+    def test_line_items_created_after_a_clone_get_unused_ids(self):
+        helper_fxn_create_distribution_with_4_sample_line_items()
+        new_distribution = Distribution.objects.create()
+        Distribution.objects.first().duplicate_line_items_into(new_distribution)
+        line_item = PatientAssignmentLineItem.objects.create_line_item(
+            distribution=new_distribution, provider=Provider.objects.create(abbreviation='provE'), starting_total=5,
+            starting_CCU=0, starting_COVID=0, position_in_batting_order=5)
+        self.assertEqual(PatientAssignmentLineItem.objects.count(), 9)
+        self.assertEqual(line_item.starting_census.total, 5)
+
+    def test_clone_rejects_unknown_seed(self):
+        helper_fxn_create_distribution_with_4_sample_line_items()
+        with self.assertRaises(ValueError):
+            Distribution.objects.last().duplicate_line_items_into(Distribution.objects.create(), seed_from='optimal')
+
 
 class DistributionPatientMethodsTests(TestCase):
     def setUp(self):
@@ -522,3 +619,487 @@ class DistributionPatientMethodsTests(TestCase):
         self.assertEqual(self.distribution.patient_set.filter(COVID=True).count(), 12)
 
 
+
+
+class DistributionSnapshotTests(TestCase):
+    def setUp(self):
+        helper_fxn_create_distribution_with_4_sample_line_items()
+        self.distribution = Distribution.objects.last()
+        helper_fxn_create_motley_list_of_patients_assign_to_distribution(patient_count=20,
+                                                                         distribution=self.distribution)
+
+    def test_new_distribution_has_no_snapshot(self):
+        self.assertIsNone(self.distribution.get_snapshot())
+
+    def test_assigning_all_patients_freezes_snapshot(self):
+        self.distribution.assign_all_patients()
+        distribution = Distribution.objects.get(id=self.distribution.id)
+        self.assertEqual(distribution.snapshot_version, SNAPSHOT_VERSION)
+        snapshot = distribution.get_snapshot()
+        self.assertEqual(snapshot['version'], SNAPSHOT_VERSION)
+        self.assertEqual(snapshot['date'], distribution.date.isoformat())
+        self.assertEqual([line_item['provider'] for line_item in snapshot['line_items']],
+                         ['provB', 'provC', 'provA', 'provD'])
+        self.assertEqual([line_item['starting_census'] for line_item in snapshot['line_items']],
+                         [[11, 3, 3, 0, 0, 0], [13, 2, 1, 0, 0, 0], [10, 2, 0, 0, 0, 0], [11, 1, 2, 0, 0, 0]])
+        self.assertEqual(snapshot['acuity_flags'], list(ACUITY_FLAGS))
+        self.assertEqual([line_item['assigned_census'] for line_item in snapshot['line_items']],
+                         [[line_item.assigned_census.total, *line_item.assigned_census.get_acuity()]
+                          for line_item in distribution.get_ordered_line_items()])
+        patient_numbers = []
+        for line_item in snapshot['line_items']:
+            for bucket in ['bounceback_pts', 'dual_pos_pts', 'ccu_pos_pts', 'covid_pos_pts', 'dual_neg_pts']:
+                patient_numbers += line_item[bucket]
+        self.assertEqual(sorted(patient_numbers), list(range(1, 21)))
+
+    def test_reading_snapshot_does_not_touch_normalized_tables(self):
+        self.distribution.assign_all_patients()
+        distribution = Distribution.objects.get(id=self.distribution.id)
+        with self.assertNumQueries(0):
+            distribution.get_snapshot()
+
+    def test_snapshot_in_another_version_is_refrozen(self):
+        self.distribution.assign_all_patients()
+        Distribution.objects.filter(id=self.distribution.id).update(snapshot='{"version":0}', snapshot_version=0)
+        distribution = Distribution.objects.get(id=self.distribution.id)
+        self.assertEqual(distribution.get_snapshot()['version'], SNAPSHOT_VERSION)
+        self.assertEqual(len(distribution.get_snapshot()['line_items']), 4)
+        self.assertEqual(Distribution.objects.get(id=self.distribution.id).snapshot_version, SNAPSHOT_VERSION)
+
+
+class AddLatePatientsTests(TestCase):
+    def setUp(self):
+        helper_fxn_create_distribution_with_4_sample_line_items()
+        self.distribution = Distribution.objects.last()
+        helper_fxn_create_motley_list_of_patients_assign_to_distribution(patient_count=10,
+                                                                         distribution=self.distribution)
+        self.distribution.assign_all_patients()
+        self.prior_assignments = dict(self.distribution.patient_set.values_list('id', 'patient_assignment_line_item'))
+
+    def test_adding_late_patients_to_unassigned_distribution_raises_value_error(self):
+        helper_fxn_create_distribution_with_4_sample_line_items()
+        with self.assertRaises(ValueError):
+            Distribution.objects.last().add_late_patients([{'CCU': True}])
+
+    def test_late_patients_are_assigned_without_moving_existing_patients(self):
+        provider_b = Provider.objects.get(abbreviation='provB')
+        self.distribution.add_late_patients([{'CCU': True, 'COVID': True}, {}, {'COVID': True, 'bounce_to': provider_b}])
+        self.assertEqual(dict(self.distribution.patient_set.filter(id__in=self.prior_assignments).values_list(
+            'id', 'patient_assignment_line_item')), self.prior_assignments)
+        late_patients = self.distribution.patient_set.exclude(id__in=self.prior_assignments).order_by('id')
+        self.assertEqual([patient.number_designation for patient in late_patients], [11, 12, 13])
+        for patient in late_patients:
+            self.assertIsNotNone(patient.patient_assignment_line_item)
+        self.assertEqual(late_patients[2].patient_assignment_line_item.provider, provider_b)
+        self.assertEqual(Distribution.objects.get(id=self.distribution.id).count_to_distribute, 3)
+
+    def test_late_patients_keep_censuses_consistent_with_assigned_patients(self):
+        self.distribution.add_late_patients([{'CCU': True}, {'COVID': True}, {}, {}])
+        line_items = self.distribution.get_ordered_line_items()
+        self.assertEqual(sum(line_item.optimal_census.total for line_item in line_items), 45 + 14)
+        for line_item in line_items:
+            assigned_patients = line_item.assigned_patients.all()
+            self.assertEqual(line_item.assigned_census.total,
+                             line_item.starting_census.total + assigned_patients.count())
+            self.assertEqual(line_item.assigned_census.CCU,
+                             line_item.starting_census.CCU + assigned_patients.filter(CCU=True).count())
+            self.assertEqual(line_item.assigned_census.COVID,
+                             line_item.starting_census.COVID + assigned_patients.filter(COVID=True).count())
+        snapshot = Distribution.objects.get(id=self.distribution.id).get_snapshot()
+        self.assertEqual(sum(line_item['assigned_census'][0] for line_item in snapshot['line_items']), 45 + 14)
+
+    def test_late_patients_increment_the_censuses_rather_than_overwrite_them(self):
+        get_line_item_states = Distribution.get_line_item_states
+
+        def get_line_item_states_then_see_another_writer(distribution):
+            line_item_states = get_line_item_states(distribution)
+            AssignedCensus.objects.filter(patientassignmentlineitem__distribution=distribution).update(
+                total=F('total') + 100)
+            return line_item_states
+
+        before = sum(self.distribution.line_items.values_list('assigned_census__total', flat=True))
+        with mock.patch.object(Distribution, 'get_line_item_states', get_line_item_states_then_see_another_writer):
+            self.distribution.add_late_patients([{'CCU': True}, {}])
+        self.assertEqual(sum(self.distribution.line_items.values_list('assigned_census__total', flat=True)),
+                         before + 4 * 100 + 2)
+
+    def test_adding_late_patients_takes_queries_per_touched_line_item_not_per_patient(self):
+        query_counts = []
+        for patient_count in [8, 40]:  # enough to reach every line item
+            with CaptureQueriesContext(connection) as queries:
+                self.distribution.add_late_patients([{'CCU': i % 2 == 0} for i in range(patient_count)])
+            query_counts.append(len(queries))
+        self.assertEqual(query_counts[0], query_counts[1])
+
+
+class ProviderDailyStatsTests(TestCase):
+    def setUp(self):
+        helper_fxn_create_distribution_with_4_sample_line_items()
+        self.distribution = Distribution.objects.last()
+        helper_fxn_create_motley_list_of_patients_assign_to_distribution(patient_count=12,
+                                                                         distribution=self.distribution)
+
+    def test_assigning_a_distribution_records_one_row_per_rounder(self):
+        self.distribution.assign_all_patients()
+        stats = ProviderDailyStats.objects.filter(date=self.distribution.date)
+        self.assertEqual(stats.count(), 4)
+        self.assertEqual(sum(stat.assigned_patients for stat in stats), 12)
+        for stat in stats:
+            line_item = self.distribution.line_items.get(provider=stat.provider)
+            self.assertEqual(stat.census_total, line_item.assigned_census.total)
+            self.assertEqual(stat.assigned_CCU_patients, line_item.assigned_patients.filter(CCU=True).count())
+
+    def test_late_patients_and_reassignment_replace_the_days_rows(self):
+        self.distribution.assign_all_patients()
+        self.distribution.add_late_patients([{'CCU': True}, {}])
+        self.assertEqual(ProviderDailyStats.objects.count(), 4)
+        self.assertEqual(ProviderDailyStats.objects.aggregate(total=Sum('assigned_patients'))['total'], 14)
+
+    def test_another_units_distribution_that_day_keeps_its_rounders_rows(self):
+        self.distribution.assign_all_patients()
+        other_unit = Distribution.objects.create()
+        other_unit.line_items.all().delete()
+        PatientAssignmentLineItem.objects.create_line_item(
+            distribution=other_unit, provider=Provider.objects.create(abbreviation='provE'), starting_total=10,
+            starting_CCU=1, starting_COVID=1, position_in_batting_order=1)
+        Patient.objects.create(distribution=other_unit, number_designation=1)
+        other_unit.assign_all_patients()
+        self.assertEqual(ProviderDailyStats.objects.filter(distribution=self.distribution).count(), 4)
+        self.assertEqual(ProviderDailyStats.objects.filter(distribution=other_unit).count(), 1)
+        self.distribution.add_late_patients([{}])
+        self.assertEqual(ProviderDailyStats.objects.count(), 5)
+
+    def test_rolling_loads_sum_days_within_the_window(self):
+        self.distribution.assign_all_patients()
+        for days_ago in [3, 10]:
+            prior_day = ProviderDailyStats.objects.filter(distribution=self.distribution).first()
+            prior_day.id = None
+            prior_day.date = self.distribution.date - timedelta(days=days_ago)
+            prior_day.assigned_patients = 5
+            prior_day.save()
+        loads = ProviderDailyStats.objects.get_rolling_loads(days=7, end_date=self.distribution.date)
+        self.assertEqual(len(loads), 4)
+        prior_abbreviation = prior_day.provider.abbreviation
+        today_stat = ProviderDailyStats.objects.get(provider=prior_day.provider, date=self.distribution.date)
+        self.assertEqual(loads[prior_abbreviation]['days_rounded'], 2)
+        self.assertEqual(loads[prior_abbreviation]['assigned_patients'], today_stat.assigned_patients + 5)
+        self.assertEqual(len(ProviderDailyStats.objects.get_rolling_loads(
+            end_date=self.distribution.date, providers=[prior_day.provider])), 1)
+
+
+class AssignmentPhaseHookTests(TestCase):
+    def setUp(self):
+        helper_fxn_create_distribution_with_4_sample_line_items()
+        self.distribution = Distribution.objects.last()
+        helper_fxn_create_motley_list_of_patients_assign_to_distribution(patient_count=10,
+                                                                         distribution=self.distribution)
+        self.calls = []
+
+    def record_phase(self, phase, distribution, seconds, query_count):
+        self.calls.append((phase, distribution, seconds, query_count))
+
+    def test_registered_hook_gets_each_phase_with_time_and_queries(self):
+        register_phase_hook(self.record_phase)
+        self.addCleanup(unregister_phase_hook, self.record_phase)
+        with CaptureQueriesContext(connection) as queries:
+            self.distribution.assign_all_patients()
+        self.assertEqual([call[0] for call in self.calls],
+                         ['load_states', 'check_capacity', 'allocate_bounceback_patients', 'set_optimal_census_total',
+                          'set_optimal_census_acuity', 'assign_bounceback_patients',
+                          'assign_non_bounceback_patients', 'save_states', 'freeze_snapshot',
+                          'record_provider_daily_stats'])
+        self.assertTrue(all(call[1] is self.distribution and call[2] >= 0 for call in self.calls))
+        self.assertEqual(sum(call[3] for call in self.calls), len(queries) - 2)  # less the atomic's savepoints
+
+    def test_hooks_can_come_from_settings(self):
+        with self.settings(ASSIGNMENT_PHASE_HOOKS=['distribute_patients.instrumentation.log_phase']):
+            with self.assertLogs('distribute_patients.instrumentation', level='INFO') as logs:
+                self.distribution.assign_all_patients()
+        self.assertEqual(len(logs.output), 10)
+        self.assertIn('assign_non_bounceback_patients', logs.output[6])
+
+    def test_no_hooks_means_nothing_is_timed(self):
+        self.assertIsInstance(timed_phase('assign_bounceback_patients', self.distribution),
+                              contextlib.nullcontext)
+
+
+class AssignmentJobTests(TestCase):
+    def setUp(self):
+        helper_fxn_create_distribution_with_4_sample_line_items()
+        self.distribution = Distribution.objects.last()
+        helper_fxn_create_motley_list_of_patients_assign_to_distribution(patient_count=10,
+                                                                         distribution=self.distribution)
+
+    def test_enqueue_returns_the_active_job_for_a_distribution(self):
+        job = AssignmentJob.objects.enqueue(self.distribution)
+        self.assertEqual(AssignmentJob.objects.enqueue(self.distribution), job)
+        self.assertEqual(AssignmentJob.objects.count(), 1)
+
+    def test_finished_and_stale_jobs_do_not_block_a_new_one(self):
+        finished_job = AssignmentJob.objects.create(distribution=self.distribution, status=AssignmentJob.SUCCEEDED)
+        stale_job = AssignmentJob.objects.create(distribution=self.distribution)
+        AssignmentJob.objects.filter(id=stale_job.id).update(created=timezone.now() - timedelta(hours=1))
+        job = AssignmentJob.objects.enqueue(self.distribution)
+        self.assertNotIn(job.id, [finished_job.id, stale_job.id])
+        self.assertEqual(AssignmentJob.objects.get(id=stale_job.id).status, AssignmentJob.FAILED)
+
+    def test_running_a_job_assigns_the_distribution(self):
+        job = AssignmentJob.objects.enqueue(self.distribution)
+        run_assignment_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, AssignmentJob.SUCCEEDED)
+        self.assertIsNotNone(job.finished)
+        self.assertFalse(self.distribution.patient_set.filter(patient_assignment_line_item__isnull=True).exists())
+
+    def test_a_failing_job_records_its_error_and_leaves_no_partial_assignment(self):
+        self.distribution.line_items.all().delete()
+        job = AssignmentJob.objects.enqueue(self.distribution)
+        run_assignment_job(job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, AssignmentJob.FAILED)
+        self.assertIn('Traceback', job.error)
+        self.assertIsNone(Distribution.objects.get(id=self.distribution.id).snapshot)
+
+    def test_a_job_taken_over_as_stale_does_not_commit_its_assignment(self):
+        job = AssignmentJob.objects.enqueue(self.distribution)
+        assign_all_patients = Distribution.assign_all_patients
+
+        def assign_then_get_taken_over(distribution):
+            assign_all_patients(distribution)
+            AssignmentJob.objects.filter(id=job.id).update(created=timezone.now() - timedelta(hours=1))
+            AssignmentJob.objects.enqueue(distribution)  # as another request would, while this job is saving
+
+        with mock.patch.object(Distribution, 'assign_all_patients', assign_then_get_taken_over):
+            run_assignment_job(job.id)
+        self.assertFalse(self.distribution.patient_set.filter(patient_assignment_line_item__isnull=False).exists())
+        self.assertIsNone(Distribution.objects.get(id=self.distribution.id).snapshot)
+
+
+class BouncebackBatchTests(TestCase):
+    def setUp(self):
+        helper_fxn_create_distribution_with_4_sample_line_items()
+        self.distribution = Distribution.objects.last()
+
+    def count_bounceback_queries(self, patient_count):
+        self.distribution.patient_set.all().delete()
+        helper_fxn_create_list_of_bounceback_patients_assign_to_distribution(patient_count=patient_count,
+                                                                             distribution=self.distribution)
+        with CaptureQueriesContext(connection) as queries:
+            self.distribution.allocate_bounceback_patients()
+            self.distribution.assign_bounceback_patients()
+        return len(queries)
+
+    def test_bounceback_phases_take_the_same_queries_for_any_number_of_patients(self):
+        self.assertEqual(self.count_bounceback_queries(3), self.count_bounceback_queries(12))
+
+    def test_bounceback_increments_reach_the_database(self):
+        helper_fxn_create_list_of_bounceback_patients_assign_to_distribution(patient_count=6,
+                                                                             distribution=self.distribution)
+        starting_totals = dict(self.distribution.line_items.values_list('provider__abbreviation',
+                                                                        'starting_census__total'))
+        self.distribution.allocate_bounceback_patients()
+        self.distribution.assign_bounceback_patients()
+        for line_item in self.distribution.line_items.all():
+            bounceback_count = Patient.objects.filter(bounce_to=line_item.provider).count()
+            self.assertEqual(line_item.optimal_census.total, starting_totals[line_item.provider.abbreviation] +
+                             bounceback_count)
+            self.assertEqual(line_item.assigned_census.total, starting_totals[line_item.provider.abbreviation] +
+                             bounceback_count)
+            self.assertEqual(line_item.assigned_patients.count(), bounceback_count)
+
+    def test_bounceback_to_provider_not_rounding_raises_validation_error(self):
+        Patient.objects.create(distribution=self.distribution, number_designation=1,
+                               bounce_to=Provider.objects.create(abbreviation='provZ'))
+        with self.assertRaisesMessage(ValidationError, 'Patient 1 bounces back to provZ'):
+            self.distribution.allocate_bounceback_patients()
+        with self.assertRaisesMessage(ValidationError, 'Patient 1 bounces back to provZ'):
+            self.distribution.assign_bounceback_patients()
+
+
+class AssignPatientsTests(TestCase):
+    def setUp(self):
+        helper_fxn_create_distribution_with_4_sample_line_items()
+        self.distribution = Distribution.objects.last()
+        helper_fxn_create_motley_list_of_patients_assign_to_distribution(patient_count=9,
+                                                                         distribution=self.distribution)
+        self.line_items = list(self.distribution.get_ordered_line_items())
+        self.patients = list(self.distribution.patient_set.order_by('number_designation'))
+
+    def test_assign_patients_sets_line_items_and_increments_censuses(self):
+        starting_censuses = {line_item.id: (line_item.assigned_census.total, line_item.assigned_census.CCU,
+                                            line_item.assigned_census.COVID) for line_item in self.line_items}
+        PatientAssignmentLineItem.objects.assign_patients(
+            (self.line_items[index % 2], patient) for index, patient in enumerate(self.patients))
+        for line_item in self.line_items:
+            assigned_patients = Patient.objects.filter(patient_assignment_line_item=line_item)
+            census = AssignedCensus.objects.get(id=line_item.assigned_census_id)
+            starting_total, starting_CCU, starting_COVID = starting_censuses[line_item.id]
+            self.assertEqual(census.total, starting_total + assigned_patients.count())
+            self.assertEqual(census.CCU, starting_CCU + assigned_patients.filter(CCU=True).count())
+            self.assertEqual(census.COVID, starting_COVID + assigned_patients.filter(COVID=True).count())
+
+    def test_assign_patients_takes_two_statements_per_touched_line_item(self):
+        assignments = [(self.line_items[index % 3], patient) for index, patient in enumerate(self.patients)]
+        with CaptureQueriesContext(connection) as queries:
+            PatientAssignmentLineItem.objects.assign_patients(assignments)
+        census_updates = [query for query in queries if 'UPDATE "distribute_patients_assignedcensus"' in query['sql']]
+        patient_updates = [query for query in queries if 'UPDATE "distribute_patients_patient"' in query['sql']]
+        self.assertEqual((len(census_updates), len(patient_updates)), (3, 3))
+
+    def test_assignments_from_stale_copies_are_not_lost(self):
+        stale_copy = PatientAssignmentLineItem.objects.get(id=self.line_items[0].id)
+        starting_total = stale_copy.assigned_census.total
+        self.line_items[0].assign_patient(self.patients[0])
+        stale_copy.assign_patient(self.patients[1])
+        self.assertEqual(AssignedCensus.objects.get(id=stale_copy.assigned_census_id).total, starting_total + 2)
+
+
+class AcuityDimensionModelTests(TestCase):
+    def setUp(self):
+        helper_fxn_create_distribution_with_4_sample_line_items()
+        self.distribution = Distribution.objects.last()
+        Patient.objects.bulk_create(Patient(distribution=self.distribution, number_designation=number,
+                                            isolation=number <= 8, high_acuity=number % 4 == 0)
+                                    for number in range(1, 13))
+
+    def test_assign_all_patients_counts_every_flag(self):
+        self.distribution.assign_all_patients()
+        line_items = list(self.distribution.get_ordered_line_items())
+        self.assertEqual(sum(line_item.assigned_census.isolation for line_item in line_items), 8)
+        self.assertEqual(sum(line_item.assigned_census.high_acuity for line_item in line_items), 3)
+        for line_item in line_items:
+            self.assertEqual(line_item.assigned_census.isolation,
+                             line_item.assigned_patients.filter(isolation=True).count())
+
+    def test_unweighted_flags_are_left_unbalanced(self):
+        def get_isolation_deviation(result):
+            return sum(abs(line_item['assigned_census']['isolation'] - line_item['optimal_census']['isolation'])
+                       for line_item in result['line_items'])
+        balanced = self.distribution.simulate()
+        with override_settings(ACUITY_DIMENSIONS=[('CCU', 1), ('COVID', 1)]):
+            unbalanced = self.distribution.simulate()
+        self.assertLess(get_isolation_deviation(balanced), get_isolation_deviation(unbalanced))
+
+    def test_late_patients_carry_their_flags_into_the_assigned_census(self):
+        self.distribution.assign_all_patients()
+        before = sum(self.distribution.line_items.values_list('assigned_census__telemetry', flat=True))
+        self.distribution.add_late_patients([{'telemetry': True}, {'telemetry': True, 'CCU': True}])
+        self.assertEqual(sum(self.distribution.line_items.values_list('assigned_census__telemetry', flat=True)),
+                         before + 2)
+
+    def test_clone_copies_every_acuity_column(self):
+        StartingCensus.objects.filter(patientassignmentlineitem__distribution=self.distribution).update(isolation=3)
+        new_distribution = Distribution.objects.create()
+        self.distribution.duplicate_line_items_into(new_distribution)
+        self.assertEqual(set(new_distribution.line_items.values_list('assigned_census__isolation', flat=True)), {3})
+
+    def test_snapshot_and_daily_stats_keep_every_flag(self):
+        self.distribution.assign_all_patients()
+        snapshot = Distribution.objects.get(id=self.distribution.id).get_snapshot()
+        isolation_index = snapshot['acuity_flags'].index('isolation') + 1
+        self.assertEqual(sum(line_item['assigned_census'][isolation_index] for line_item in snapshot['line_items']),
+                         8)
+        self.assertEqual(sorted(number for line_item in snapshot['line_items']
+                                for number in line_item['other_flag_pts']['high_acuity']), [4, 8, 12])
+        stats = ProviderDailyStats.objects.filter(distribution=self.distribution)
+        self.assertEqual(sum(stat.assigned_isolation_patients for stat in stats), 8)
+        self.assertEqual(sum(stat.census_isolation for stat in stats), 8)
+        loads = ProviderDailyStats.objects.get_rolling_loads(end_date=self.distribution.date)
+        self.assertEqual(sum(load['assigned_high_acuity_patients'] for load in loads.values()), 3)
+
+
+class CapacityModelTests(TestCase):
+    def setUp(self):
+        helper_fxn_create_distribution_with_4_sample_line_items()
+        self.distribution = Distribution.objects.last()
+        Patient.objects.bulk_create(Patient(distribution=self.distribution, number_designation=number,
+                                            CCU=number <= 6) for number in range(1, 13))
+
+    def get_line_item(self, abbreviation):
+        return self.distribution.line_items.select_related('assigned_census').get(provider__abbreviation=abbreviation)
+
+    def test_assign_all_patients_honors_the_caps(self):
+        self.distribution.line_items.filter(provider__abbreviation='provB').update(max_total=12, max_CCU=3)
+        self.distribution.line_items.filter(provider__abbreviation='provA').update(max_CCU=3)
+        self.distribution.assign_all_patients()
+        provA, provB = self.get_line_item('provA'), self.get_line_item('provB')
+        self.assertLessEqual(provB.assigned_census.total, 12)
+        self.assertEqual(provB.assigned_census.CCU, 3)
+        self.assertLessEqual(provA.assigned_census.CCU, 3)
+        self.assertFalse(self.distribution.patient_set.filter(patient_assignment_line_item__isnull=True).exists())
+
+    def test_infeasible_caps_are_a_validation_error_before_anything_is_assigned(self):
+        for line_item in self.distribution.line_items.select_related('starting_census'):
+            line_item.max_CCU = line_item.starting_census.CCU
+            line_item.save()
+        with self.assertRaisesMessage(ValidationError, 'Only 0 of the 6 CCU patients fit'):
+            self.distribution.assign_all_patients()
+        self.assertFalse(self.distribution.patient_set.filter(patient_assignment_line_item__isnull=False).exists())
+
+    def test_late_patients_go_where_there_is_room(self):
+        self.distribution.assign_all_patients()
+        for line_item in self.distribution.line_items.exclude(provider__abbreviation='provD').select_related(
+                'assigned_census'):
+            line_item.max_total = line_item.assigned_census.total
+            line_item.save()
+        before = self.get_line_item('provD').assigned_census.total
+        self.distribution.add_late_patients([{'CCU': True}])
+        self.assertEqual(self.get_line_item('provD').assigned_census.total, before + 1)
+        self.distribution.line_items.filter(provider__abbreviation='provD').update(max_total=before + 1)
+        with self.assertRaisesMessage(ValidationError, 'Only 0 of the 1 patients fit'):
+            self.distribution.add_late_patients([{}])
+
+    def test_late_bouncebacks_over_their_rounders_caps_are_rejected(self):
+        self.distribution.assign_all_patients()
+        line_item = self.get_line_item('provA')
+        line_item.max_COVID = line_item.assigned_census.COVID
+        line_item.save()
+        with self.assertRaisesMessage(ValidationError, 'bouncing back to provA'):
+            self.distribution.add_late_patients([{'COVID': True, 'bounce_to': line_item.provider}])
+        self.assertEqual(self.get_line_item('provA').assigned_census.COVID, line_item.max_COVID)
+        self.assertEqual(self.distribution.patient_set.count(), 12)
+
+    def test_clone_carries_the_caps(self):
+        self.distribution.line_items.update(max_total=20, max_COVID=4)
+        new_distribution = Distribution.objects.create()
+        self.distribution.duplicate_line_items_into(new_distribution)
+        self.assertEqual(set(new_distribution.line_items.values_list('max_total', 'max_CCU', 'max_COVID')),
+                         {(20, None, 4)})
+
+    def test_simulation_reads_the_caps_from_the_line_items(self):
+        self.distribution.line_items.filter(provider__abbreviation='provA').update(max_total=11)
+        result = self.distribution.simulate()
+        provA = next(line_item for line_item in result['line_items'] if line_item['abbreviation'] == 'provA')
+        self.assertEqual(provA['assigned_census']['total'], 11)
+
+
+class CensusReportTests(TestCase):
+    def setUp(self):
+        helper_fxn_create_distribution_with_4_sample_line_items()
+        self.distribution = Distribution.objects.last()
+        helper_fxn_create_motley_list_of_patients_assign_to_distribution(patient_count=10,
+                                                                         distribution=self.distribution)
+        self.distribution.assign_all_patients()
+
+    def test_report_has_every_census_column_from_one_query(self):
+        with self.assertNumQueries(1):
+            rows = self.distribution.get_census_report()
+        for row, line_item in zip(rows, self.distribution.get_ordered_line_items()):
+            self.assertEqual((row['line_item'], row['provider'], row['starting_total'], row['optimal_CCU'],
+                              row['assigned_COVID']),
+                             (line_item.id, line_item.provider.abbreviation, line_item.starting_census.total,
+                              line_item.optimal_census.CCU, line_item.assigned_census.COVID))
+
+    def test_report_renders_as_text_json_and_csv(self):
+        line_item = self.distribution.get_ordered_line_items()[0]
+        census = line_item.assigned_census
+        self.assertEqual(self.distribution.render_census_report(censuses=['assigned']).splitlines()[0],
+                         f'LI{line_item.id} {line_item.provider.abbreviation}: assigned {census.total} '
+                         f'({census.CCU}) [{census.COVID}] isolation 0 telemetry 0 high_acuity 0')
+        rows = json.loads(self.distribution.render_census_report('json', censuses=['starting']))
+        self.assertEqual(set(rows[0]), {'line_item', 'provider', 'position_in_batting_order', 'starting_total',
+                                        'starting_CCU', 'starting_COVID', 'starting_isolation',
+                                        'starting_telemetry', 'starting_high_acuity'})
+        csv_lines = self.distribution.render_census_report('csv').splitlines()
+        self.assertEqual(len(csv_lines), 5)
+        self.assertTrue(csv_lines[0].startswith('line_item,provider,position_in_batting_order,starting_total'))
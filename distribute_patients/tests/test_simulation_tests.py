@@ -0,0 +1,330 @@
+import math
+import os
+import tempfile
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from .. import simulation
+from ..acuity import DEFAULT_DIMENSIONS, get_acuity_weights
+from ..helper_fxns import helper_fxn_create_distribution_with_4_sample_line_items, \
+    helper_fxn_create_motley_list_of_patients_assign_to_distribution
+from ..models import Distribution, Patient
+
+
+class SimulateDistributionTests(TestCase):
+    def setUp(self):
+        helper_fxn_create_distribution_with_4_sample_line_items()
+        self.distribution = Distribution.objects.last()
+
+    def test_simulation_matches_assign_all_patients_for_many_patient_counts(self):
+        for patient_count in range(1, 31):
+            helper_fxn_create_distribution_with_4_sample_line_items()
+            distribution = Distribution.objects.last()
+            helper_fxn_create_motley_list_of_patients_assign_to_distribution(patient_count=patient_count,
+                                                                             distribution=distribution)
+            result = distribution.simulate()
+            distribution.assign_all_patients()
+            line_items = distribution.get_ordered_line_items()
+            self.assertEqual([line_item['abbreviation'] for line_item in result['line_items']],
+                             [line_item.provider.abbreviation for line_item in line_items])
+            self.assertEqual([line_item['assigned_census'] for line_item in result['line_items']],
+                             [dict(zip(simulation.ACUITY_FLAGS, line_item.assigned_census.get_acuity()),
+                                   total=line_item.assigned_census.total) for line_item in line_items])
+            self.assertEqual([line_item['optimal_census'] for line_item in result['line_items']],
+                             [dict(zip(simulation.ACUITY_FLAGS, line_item.optimal_census.get_acuity()),
+                                   total=line_item.optimal_census.total) for line_item in line_items])
+            self.assertEqual([sorted(line_item['assigned_patients']) for line_item in result['line_items']],
+                             [sorted(line_item.assigned_patients.values_list('number_designation', flat=True))
+                              for line_item in line_items])
+
+    def test_simulation_writes_nothing(self):
+        helper_fxn_create_motley_list_of_patients_assign_to_distribution(patient_count=20,
+                                                                         distribution=self.distribution)
+        with self.assertNumQueries(2):
+            self.distribution.simulate({'add_rounders': [{'abbreviation': 'provE', 'total': 5, 'CCU': 0,
+                                                          'COVID': 0}]})
+        self.assertFalse(Patient.objects.filter(patient_assignment_line_item__isnull=False).exists())
+        self.assertEqual([line_item.optimal_census.total for line_item in self.distribution.get_ordered_line_items()],
+                         [11, 13, 10, 11])
+
+
+class AssignmentStateTests(TestCase):
+    def setUp(self):
+        helper_fxn_create_distribution_with_4_sample_line_items()
+        self.distribution = Distribution.objects.last()
+
+    def test_state_objects_have_no_instance_dict(self):
+        line_item_state = self.distribution.get_line_item_states()[0]
+        patient_state = simulation.SimulatedPatient(1, CCU=True)
+        for state in [line_item_state, patient_state]:
+            self.assertFalse(hasattr(state, '__dict__'))
+        self.assertEqual(patient_state.acuity, (1, 0, 0, 0, 0))
+
+    def test_line_item_states_carry_the_models_censuses(self):
+        for line_item_state, line_item in zip(self.distribution.get_line_item_states(),
+                                              self.distribution.get_ordered_line_items()):
+            self.assertIs(line_item_state.source.id, line_item.id)
+            self.assertEqual((line_item_state.abbreviation, line_item_state.starting_total,
+                              line_item_state.optimal_total, line_item_state.assigned[1]),
+                             (line_item.provider.abbreviation, line_item.starting_census.total,
+                              line_item.optimal_census.total, line_item.assigned_census.COVID))
+
+    def test_assign_all_patients_takes_the_same_queries_for_any_number_of_patients(self):  # per line item updates aside
+        query_counts = []
+        for patient_count in [5, 25]:
+            helper_fxn_create_distribution_with_4_sample_line_items()
+            distribution = Distribution.objects.last()
+            helper_fxn_create_motley_list_of_patients_assign_to_distribution(patient_count=patient_count,
+                                                                             distribution=distribution)
+            with CaptureQueriesContext(connection) as queries:
+                distribution.assign_all_patients()
+            query_counts.append(len([query for query in queries
+                                     if not query['sql'].startswith(('UPDATE "distribute_patients_assignedcensus"',
+                                                                     'UPDATE "distribute_patients_patient"'))]))
+        self.assertEqual(query_counts[0], query_counts[1])
+
+
+class DistanceCacheTests(TestCase):
+    def setUp(self):
+        self.line_items = [simulation.SimulatedLineItem('provA', 1, 10, [1, 1, 0, 0, 0]),
+                           simulation.SimulatedLineItem('provB', 2, 10, [2, 0, 0, 0, 0])]
+        for line_item in self.line_items:
+            line_item.optimal_total, line_item.optimal = 14, [2.5, 2.0, 0, 0, 0]
+        self.patient = simulation.SimulatedPatient(1, CCU=True)
+
+    def test_improvements_are_memoized_per_patient_class(self):
+        line_item = self.line_items[0]
+        improvement = line_item.get_distance_moved_closer_to_optimal_after_adding_patient(self.patient)
+        self.assertAlmostEqual(improvement, math.sqrt(1.5 ** 2 + 1) - math.sqrt(0.5 ** 2 + 1))
+        self.assertEqual(line_item.improvements, {self.patient.acuity_class: improvement})
+        self.assertEqual(line_item.distance, line_item.get_distance_from_assigned_census_to_optimal())
+
+    def test_only_the_line_item_given_a_patient_forgets_its_distances(self):
+        for line_item in self.line_items:
+            line_item.get_distance_moved_closer_to_optimal_after_adding_patient(self.patient)
+        self.line_items[0].assign_patient(self.patient)
+        self.assertEqual((self.line_items[0].distance, self.line_items[0].improvements), (None, {}))
+        self.assertIsNotNone(self.line_items[1].distance)
+        self.assertAlmostEqual(self.line_items[0].get_distance_moved_closer_to_optimal_after_adding_patient(
+            self.patient), math.sqrt(0.5 ** 2 + 1) - math.sqrt(0.5 ** 2 + 1))
+
+    def test_resetting_the_optimum_forgets_distances(self):
+        patients = [self.patient, simulation.SimulatedPatient(2, COVID=True)]
+        for line_item in self.line_items:
+            line_item.get_distance_from_assigned_census_to_optimal()
+        simulation.set_optimal_census_acuity(self.line_items, patients)
+        self.assertEqual([line_item.distance for line_item in self.line_items], [None, None])
+
+
+class AcuityDimensionTests(TestCase):
+    description = {
+        'rounders': [{'abbreviation': f'prov{letter}', 'position_in_batting_order': index + 1, 'total': 10, 'CCU': 1,
+                      'COVID': 1} for index, letter in enumerate('ABCD')],
+        'patients': [{'number_designation': number, 'CCU': False, 'COVID': False, 'isolation': number <= 8,
+                      'telemetry': number % 2 == 0, 'bounce_to': None} for number in range(1, 17)],
+    }
+
+    def get_assigned(self, result, flag):
+        return [line_item['assigned_census'][flag] for line_item in result['line_items']]
+
+    def test_weighted_dimensions_are_balanced_like_CCU_and_COVID(self):
+        result = simulation.simulate(self.description)
+        self.assertEqual(self.get_assigned(result, 'isolation'), [2, 2, 2, 2])
+        self.assertEqual(self.get_assigned(result, 'telemetry'), [2, 2, 2, 2])
+        self.assertEqual([line_item['optimal_census']['isolation'] for line_item in result['line_items']],
+                         [2.0, 2.0, 2.0, 2.0])
+
+    def test_zero_weight_dimensions_are_counted_but_not_balanced(self):
+        result = simulation.simulate(self.description, weights=(1.0, 1.0, 0.0, 0.0, 0.0))
+        self.assertEqual(sum(self.get_assigned(result, 'isolation')), 8)
+        self.assertNotEqual(self.get_assigned(result, 'isolation'), [2, 2, 2, 2])
+
+    def test_weights_scale_the_difference_from_optimal_linearly(self):
+        line_item = simulation.SimulatedLineItem('provA', 1, 10, [0, 1, 0, 0, 0], weights=(2.0, 3.0, 0.0, 0.0, 0.0))
+        line_item.optimal = [1, 0, 0, 0, 0]
+        self.assertEqual(line_item.get_distance_from_assigned_census_to_optimal(), math.sqrt(2 ** 2 + 3 ** 2))
+
+    def test_improvements_only_revisit_the_patients_flags_but_match_a_full_recompute(self):
+        line_item = simulation.SimulatedLineItem('provA', 1, 10, [1, 0, 2, 0, 1], weights=(1.0, 2.0, 0.5, 1.0, 3.0))
+        line_item.optimal = [2.5, 1.0, 1.0, 0.5, 1.5]
+        patient = simulation.SimulatedPatient(1, CCU=True, isolation=True, high_acuity=True)
+        improvement = line_item.get_distance_moved_closer_to_optimal_after_adding_patient(patient)
+        before = line_item.get_distance_from_assigned_census_to_optimal()
+        line_item.assign_patient(patient)
+        self.assertAlmostEqual(improvement, before - line_item.get_distance_from_assigned_census_to_optimal())
+
+    def test_the_default_weights_match_the_default_acuity_dimensions(self):
+        self.assertEqual(get_acuity_weights(), simulation.DEFAULT_WEIGHTS)
+        with override_settings(ACUITY_DIMENSIONS=DEFAULT_DIMENSIONS):
+            self.assertEqual(get_acuity_weights(), simulation.DEFAULT_WEIGHTS)
+
+    def test_each_line_item_memoizes_one_improvement_per_patient_class(self):
+        line_items = simulation.get_ordered_line_items(self.description)
+        patients = [simulation.SimulatedPatient.from_dict(patient) for patient in self.description['patients']]
+        simulation.calculate_optimal_census(line_items, patients)
+        for patient in patients:
+            for line_item in line_items:
+                line_item.get_distance_moved_closer_to_optimal_after_adding_patient(patient)
+        self.assertEqual({len(line_item.improvements) for line_item in line_items},
+                         {len({patient.acuity_class for patient in patients})})
+
+    def test_weights_come_from_the_acuity_dimensions_setting(self):
+        with override_settings(ACUITY_DIMENSIONS=[('telemetry', 2), ('CCU', 1)]):
+            self.assertEqual(get_acuity_weights(), (1.0, 0.0, 0.0, 2.0, 0.0))
+        with override_settings(ACUITY_DIMENSIONS=[('ventilator', 1)]), self.assertRaises(ImproperlyConfigured):
+            get_acuity_weights()
+
+
+class CapacityTests(TestCase):
+    rounders = [{'abbreviation': f'prov{letter}', 'position_in_batting_order': index + 1, 'total': 10, 'CCU': 1,
+                 'COVID': 0} for index, letter in enumerate('ABCD')]
+    patients = [{'number_designation': number, 'CCU': number <= 8, 'COVID': False, 'bounce_to': None}
+                for number in range(1, 17)]
+
+    def describe(self, caps_by_abbreviation, patients=None):
+        return {'rounders': [dict(rounder, **caps_by_abbreviation.get(rounder['abbreviation'], {}))
+                             for rounder in self.rounders],
+                'patients': self.patients if patients is None else patients}
+
+    def test_every_strategy_honors_the_caps(self):
+        description = self.describe({'provA': {'max_total': 12, 'max_CCU': 1}, 'provB': {'max_CCU': 2}})
+        for strategy in simulation.STRATEGIES:
+            with self.subTest(strategy=strategy):
+                line_items = simulation.simulate(description, strategy=strategy)['line_items']
+                self.assertLessEqual(line_items[0]['assigned_census']['total'], 12)
+                self.assertEqual(line_items[0]['assigned_census']['CCU'], 1)
+                self.assertLessEqual(line_items[1]['assigned_census']['CCU'], 2)
+                self.assertEqual(sum(len(line_item['assigned_patients']) for line_item in line_items), 16)
+
+    def test_capped_optimal_totals_stay_under_max_total(self):
+        result = simulation.simulate(self.describe({'provA': {'max_total': 11}, 'provB': {'max_total': 11}}))
+        self.assertEqual([line_item['optimal_census']['total'] for line_item in result['line_items']],
+                         [11, 11, 17, 17])
+
+    def test_acuity_caps_can_push_a_patient_past_its_optimal_total(self):
+        description = self.describe({rounder['abbreviation']: {'max_CCU': 2} for rounder in self.rounders[1:]})
+        result = simulation.simulate(description)
+        self.assertEqual([line_item['assigned_census']['CCU'] for line_item in result['line_items']], [6, 2, 2, 2])
+        self.assertEqual(sum(line_item['assigned_census']['total'] for line_item in result['line_items']), 56)
+
+    def test_too_few_places_are_rejected_before_anything_is_assigned(self):
+        line_items = simulation.get_ordered_line_items(self.describe(
+            {rounder['abbreviation']: {'max_total': 13} for rounder in self.rounders}))
+        patients = [simulation.SimulatedPatient.from_dict(patient) for patient in self.patients]
+        with self.assertRaisesMessage(simulation.InfeasibleAssignmentError, 'Only 12 of the 16 patients fit'):
+            simulation.assign_all_patients(line_items, patients)
+        self.assertEqual([line_item.optimal_total for line_item in line_items], [10] * 4)
+
+    def test_too_few_places_for_a_flag_are_rejected_up_front(self):
+        description = self.describe({rounder['abbreviation']: {'max_CCU': 2} for rounder in self.rounders})
+        with self.assertRaisesMessage(simulation.InfeasibleAssignmentError, 'Only 4 of the 8 CCU patients fit'):
+            simulation.simulate(description)
+
+    def test_combined_flags_are_checked_together(self):
+        patients = [{'number_designation': number, 'CCU': number <= 2, 'COVID': 2 < number <= 4, 'bounce_to': None}
+                    for number in range(1, 5)]
+        caps = {rounder['abbreviation']: {'max_CCU': 1, 'max_COVID': 0} for rounder in self.rounders}
+        caps['provA'] = {'max_total': 13, 'max_CCU': 3, 'max_COVID': 2}  # room for either, but not both
+        with self.assertRaisesMessage(simulation.InfeasibleAssignmentError, 'Only 3 of the 4 CCU or COVID patients'):
+            simulation.simulate(self.describe(caps, patients=patients))
+
+    def test_patients_are_only_placed_where_the_rest_still_fit(self):
+        description = {'rounders': [{'abbreviation': 'provB', 'position_in_batting_order': 1, 'total': 10,
+                                     'max_total': 11},
+                                    {'abbreviation': 'provA', 'position_in_batting_order': 2, 'total': 10,
+                                     'max_total': 11, 'max_COVID': 0}],
+                       'patients': [{'number_designation': 1, 'CCU': True, 'COVID': False, 'bounce_to': None},
+                                    {'number_designation': 2, 'CCU': False, 'COVID': True, 'bounce_to': None}]}
+        for strategy in simulation.STRATEGIES:
+            with self.subTest(strategy=strategy):
+                line_items = simulation.simulate(description, strategy=strategy)['line_items']
+                self.assertEqual([line_item['assigned_patients'] for line_item in line_items], [[2], [1]])
+
+    def test_patients_with_several_capped_flags_are_checked_exactly(self):
+        patients = [{'number_designation': 1, 'CCU': True, 'COVID': True, 'bounce_to': None}]
+        caps = {'provA': {'max_COVID': 0}, 'provB': {'max_CCU': 0}, 'provC': {'max_CCU': 0}}
+        line_items = simulation.simulate(self.describe(caps, patients=patients))['line_items']
+        self.assertEqual(line_items[3]['assigned_patients'], [1])
+        caps['provD'] = {'max_CCU': 0}  # every set of flags still has room, but no rounder has room for both
+        with self.assertRaisesMessage(simulation.InfeasibleAssignmentError, 'several of CCU and COVID'):
+            simulation.simulate(self.describe(caps, patients=patients))
+        patients.append({'number_designation': 2, 'CCU': True, 'COVID': False, 'bounce_to': None})
+        caps = {'provA': {'max_CCU': 2, 'max_COVID': 0}, 'provB': {'max_CCU': 2, 'max_COVID': 1},
+                'provC': {'max_CCU': 0}, 'provD': {'max_CCU': 0}}
+        line_items = simulation.simulate(self.describe(caps, patients=patients))['line_items']
+        self.assertEqual([line_item['assigned_patients'] for line_item in line_items[:2]], [[2], [1]])
+
+    def test_bouncebacks_over_their_rounders_caps_are_rejected(self):
+        patients = [{'number_designation': 1, 'CCU': True, 'COVID': False, 'bounce_to': 'provA'}]
+        with self.assertRaisesMessage(simulation.InfeasibleAssignmentError, 'bouncing back to provA'):
+            simulation.simulate(self.describe({'provA': {'max_CCU': 1}}, patients=patients))
+
+    def test_caps_are_read_from_csv_with_blanks_for_none(self):
+        with tempfile.TemporaryDirectory() as directory:
+            rounders_path, patients_path = os.path.join(directory, 'r.csv'), os.path.join(directory, 'p.csv')
+            with open(rounders_path, 'w') as rounders_file:
+                rounders_file.write('abbreviation,total,CCU,COVID,max_total,max_CCU\nprovA,10,1,0,12,\n')
+            with open(patients_path, 'w') as patients_file:
+                patients_file.write('number_designation,CCU,COVID,bounce_to\n1,y,n,\n')
+            rounder = simulation.read_description_from_csv(rounders_path, patients_path)['rounders'][0]
+        self.assertEqual((rounder['max_total'], rounder['max_CCU'], rounder['max_COVID']), (12, None, None))
+
+
+class SimulationOverridesTests(TestCase):
+    description = {
+        'rounders': [{'abbreviation': 'provA', 'position_in_batting_order': 1, 'total': 10, 'CCU': 2, 'COVID': 1},
+                     {'abbreviation': 'provB', 'position_in_batting_order': 2, 'total': 12, 'CCU': 1, 'COVID': 3}],
+        'patients': [{'number_designation': 1, 'CCU': True, 'COVID': False, 'bounce_to': None},
+                     {'number_designation': 2, 'CCU': False, 'COVID': True, 'bounce_to': 'provB'}],
+    }
+
+    def test_overrides_add_rounders_reorder_and_add_patients_without_touching_description(self):
+        description = simulation.apply_overrides(self.description, {
+            'add_rounders': [{'abbreviation': 'provC', 'total': 8, 'CCU': 0, 'COVID': 0}],
+            'batting_order': ['provC', 'provB'],
+            'add_patients': [{'bounce_to': 'provA'}, {'bounce_to': 'provA', 'CCU': True}]})
+        self.assertEqual([(rounder['abbreviation'], rounder['position_in_batting_order'])
+                          for rounder in description['rounders']], [('provC', 1), ('provB', 2), ('provA', 3)])
+        self.assertEqual([(patient['number_designation'], patient['bounce_to'], patient['CCU'])
+                          for patient in description['patients'][2:]], [(3, 'provA', False), (4, 'provA', True)])
+        self.assertEqual(len(self.description['rounders']), 2)
+        self.assertEqual(len(self.description['patients']), 2)
+
+    def test_bounceback_to_missing_rounder_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            simulation.simulate(self.description, {'remove_rounders': ['provB']})
+
+    def test_simulate_many_returns_results_in_scenario_order_across_processes(self):
+        scenarios = [None, {'remove_rounders': ['provA']}, {'add_patients': [{}, {}, {}]}]
+        results = simulation.simulate_many(self.description, scenarios, max_workers=2)
+        self.assertEqual(results, [simulation.simulate(self.description, overrides) for overrides in scenarios])
+        self.assertEqual(len(results[1]['line_items']), 1)
+        self.assertEqual(sum(line_item['assigned_census']['total'] for line_item in results[2]['line_items']),
+                         22 + 5)
+
+    def test_simulate_many_and_replay_use_the_weights_they_are_given(self):
+        description = AcuityDimensionTests.description
+        weights = (1.0, 1.0, 0.0, 0.0, 0.0)
+        results = simulation.simulate_many(description, [None], max_workers=2, weights=weights)
+        self.assertEqual(results, [simulation.simulate(description, weights=weights)])
+        self.assertNotEqual(results, [simulation.simulate(description)])
+        record = simulation.replay(1, description, ['greedy'], weights=weights)[0]
+        self.assertEqual(record, dict(simulation.score(results[0]), distribution=1, strategy='greedy',
+                                      runtime_ms=record['runtime_ms']))
+
+    def test_every_strategy_fills_each_line_item_to_its_optimal_total(self):
+        for strategy in simulation.STRATEGIES:
+            result = simulation.simulate(self.description, {'add_patients': [{'CCU': True}, {}, {'COVID': True}]},
+                                         strategy=strategy)
+            for line_item in result['line_items']:
+                self.assertEqual(line_item['assigned_census']['total'], line_item['optimal_census']['total'])
+
+    def test_score_reports_load_spread_and_deviation_from_optimal(self):
+        record = simulation.score(simulation.simulate(self.description))
+        self.assertEqual(record['loads'], {'provA': 11, 'provB': 13})
+        self.assertEqual(record['load_spread'], 2)
+        self.assertGreaterEqual(record['CCU_deviation'], record['max_CCU_deviation'])
+        self.assertEqual(record['high_acuity_deviation'], 0)
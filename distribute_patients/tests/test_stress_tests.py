@@ -0,0 +1,125 @@
+import random
+import time
+import tracemalloc
+from contextlib import contextmanager
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from ..models import Distribution, Patient, PatientAssignmentLineItem, Provider
+
+ROUNDER_COUNT = 300
+PATIENT_COUNT = 5000
+# budgets are measured under tracemalloc and the test client's template signals, which together roughly double
+# the time of python-heavy work like rendering
+ASSIGN_SECONDS = 10
+ASSIGN_PEAK_MB = 64
+VIEW_SECONDS = 10
+VIEW_PEAK_MB = 64
+
+
+def get_caps(spec, rng):
+    """caps with a few patients' room to spare over the rounder's share, tight enough that the cap on CCU or COVID
+    turns the greedy choice away, and that the patients with both have to be planned around"""
+    return dict(max_total=spec['starting_total'] + rng.randint(18, 22),
+                max_CCU=spec['starting_CCU'] + rng.randint(3, 5), max_COVID=spec['starting_COVID'] + rng.randint(5, 7))
+
+
+def create_large_facility_distribution(rounder_count=ROUNDER_COUNT, patient_count=PATIENT_COUNT, seed=0, capped=False):
+    rng = random.Random(seed)
+    caps_rng = random.Random(seed)
+    distribution = Distribution.objects.create(count_to_distribute=patient_count)
+    providers = Provider.objects.get_or_create_many(f'r{index}' for index in range(rounder_count))
+    line_item_specs = [
+        dict(provider=providers[f'r{index}'], starting_total=rng.randint(5, 15), starting_CCU=rng.randint(0, 3),
+             starting_COVID=rng.randint(0, 3), position_in_batting_order=index + 1)
+        for index in range(rounder_count)]
+    if capped:
+        for spec in line_item_specs:
+            spec.update(get_caps(spec, caps_rng))
+    PatientAssignmentLineItem.objects.create_line_items(distribution=distribution, line_item_specs=line_item_specs)
+    Patient.objects.bulk_create(
+        Patient(distribution=distribution, number_designation=index + 1, CCU=rng.random() < .2,
+                COVID=rng.random() < .3,
+                bounce_to=providers[f'r{rng.randrange(rounder_count)}'] if rng.random() < .05 else None)
+        for index in range(patient_count))
+    return distribution
+
+
+# assignments run in the request, as on_commit never fires inside a TestCase to start a background job
+@override_settings(LARGE_FACILITY_MODE=True, DATA_UPLOAD_MAX_NUMBER_FIELDS=2000,
+                   BACKGROUND_ASSIGNMENT_MIN_PATIENTS=PATIENT_COUNT + 1)
+class LargeFacilityStressTests(TestCase):
+    """300 rounders and 5,000 patients, held to the latency and memory budgets above"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.distribution = create_large_facility_distribution()
+
+    @contextmanager
+    def assert_within_budget(self, seconds, peak_mb):
+        tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            yield
+            elapsed = time.perf_counter() - start
+            peak_mb_used = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        finally:
+            tracemalloc.stop()
+        self.assertLess(elapsed, seconds)
+        self.assertLess(peak_mb_used, peak_mb)
+
+    def test_assign_all_patients_within_budget(self):
+        with self.assert_within_budget(ASSIGN_SECONDS, ASSIGN_PEAK_MB):
+            self.distribution.assign_all_patients()
+        self.assertFalse(self.distribution.patient_set.filter(patient_assignment_line_item__isnull=True).exists())
+        assigned_totals = self.distribution.line_items.values_list('assigned_census__total', 'starting_census__total')
+        self.assertEqual(sum(assigned - starting for assigned, starting in assigned_totals), PATIENT_COUNT)
+
+    def test_assign_all_patients_under_several_caps_within_budget(self):
+        distribution = create_large_facility_distribution(seed=1, capped=True)
+        with self.assert_within_budget(ASSIGN_SECONDS, ASSIGN_PEAK_MB):
+            distribution.assign_all_patients()
+        self.assertFalse(distribution.patient_set.filter(patient_assignment_line_item__isnull=True).exists())
+        censuses = distribution.line_items.values_list('assigned_census__total', 'assigned_census__CCU',
+                                                       'assigned_census__COVID', 'max_total', 'max_CCU', 'max_COVID')
+        for total, CCU, COVID, max_total, max_CCU, max_COVID in censuses:
+            self.assertLessEqual(total, max_total)
+            self.assertLessEqual(CCU, max_CCU)
+            self.assertLessEqual(COVID, max_COVID)
+
+    def test_patient_assignments_view_within_budget(self):
+        self.distribution.assign_all_patients()
+        with self.assert_within_budget(VIEW_SECONDS, VIEW_PEAK_MB):
+            response = self.client.get(reverse('distribute:patient_assignments'))
+        self.assertEqual(len(response.context['patient_assignment_dict']), ROUNDER_COUNT)
+
+    def test_designate_view_offers_only_the_list_within_budget(self):
+        with self.assert_within_budget(VIEW_SECONDS, VIEW_PEAK_MB):
+            response = self.client.get(reverse('distribute:designate_patients'))
+        self.assertIsNone(response.context['formset'])
+        self.assertContains(response, 'id_designate_with_list_only')
+
+    def test_designation_list_post_within_budget(self):
+        designation_list = '\n'.join(f'{number} c' for number in range(1, PATIENT_COUNT + 1, 7))
+        with self.assert_within_budget(ASSIGN_SECONDS + VIEW_SECONDS, ASSIGN_PEAK_MB):
+            self.client.post(reverse('distribute:designate_patients'), data={'designation_list': designation_list})
+        self.assertEqual(self.distribution.patient_set.filter(CCU=True).count(), len(range(1, PATIENT_COUNT + 1, 7)))
+        self.assertFalse(self.distribution.patient_set.filter(patient_assignment_line_item__isnull=True).exists())
+
+    def test_set_rounders_offers_and_saves_a_large_roster_within_budget(self):
+        with self.assert_within_budget(VIEW_SECONDS, VIEW_PEAK_MB):
+            response = self.client.get(reverse('set_rounders'))
+        self.assertEqual(len(response.context['rounder_formset'].forms), ROUNDER_COUNT)
+        data = {'form-TOTAL_FORMS': ROUNDER_COUNT, 'form-INITIAL_FORMS': 0}
+        for index in range(ROUNDER_COUNT):
+            data.update({f'form-{index}-abbreviation': f'n{index}', f'form-{index}-starting_total': 45,
+                         f'form-{index}-starting_CCU': 2, f'form-{index}-starting_COVID': 1})
+        with self.assert_within_budget(VIEW_SECONDS, VIEW_PEAK_MB):
+            self.client.post(reverse('set_rounders'), data=data)
+        self.assertEqual(Distribution.objects.last().line_items.count(), ROUNDER_COUNT)
+
+    def test_edit_count_creates_thousands_of_patients_within_budget(self):
+        Distribution.objects.create()
+        with self.assert_within_budget(VIEW_SECONDS, VIEW_PEAK_MB):
+            self.client.post(reverse('distribute:edit_count'), data={'count_to_distribute': PATIENT_COUNT})
+        self.assertEqual(Distribution.objects.last().patient_set.count(), PATIENT_COUNT)
@@ -1,11 +1,18 @@
-from django.test import TestCase
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse, resolve
 from django.utils import timezone
 
+from ..admin import EstimatedCountPaginator
 from ..forms import PatientCountForm, PatientDesignateForm
 from ..helper_fxns import helper_fxn_create_distribution_with_4_sample_line_items, \
     helper_fxn_create_motley_list_of_patients_assign_to_distribution
-from ..models import Distribution, Patient, Provider, PatientAssignmentLineItem
+from ..jobs import run_assignment_job
+from ..models import AssignmentJob, Distribution, Patient, Provider, PatientAssignmentLineItem
 
 
 class SetRoundersTests(TestCase):
@@ -29,6 +36,16 @@ class SetRoundersTests(TestCase):
         response = self.client.get(url)
         self.assertEqual(len(response.context['rounder_formset']), 12)
 
+    def test_view_shows_rolling_loads_once_a_distribution_is_assigned(self):
+        self.assertNotContains(self.client.get(reverse('set_rounders')), 'id_rolling_loads')
+        helper_fxn_create_distribution_with_4_sample_line_items()
+        distribution = Distribution.objects.last()
+        helper_fxn_create_motley_list_of_patients_assign_to_distribution(patient_count=8, distribution=distribution)
+        distribution.assign_all_patients()
+        response = self.client.get(reverse('set_rounders'))
+        self.assertContains(response, 'id_rolling_loads')
+        self.assertEqual(len(response.context['rolling_loads']), 4)
+
     def test_posting_data_to_view_creates_line_items_assigned_to_a_new_distribution(self):
         url = reverse('set_rounders')
         data = {'form-TOTAL_FORMS': 12,'form-INITIAL_FORMS': 12}
@@ -318,6 +335,64 @@ class DesignatePatientsViewTests(TestCase):
         self.assertRedirects(response, reverse('distribute:patient_assignments'))
 
 
+    def test_posting_designation_list_updates_and_assigns_patients(self):
+        url = reverse('distribute:designate_patients')
+        response = self.client.post(url, data={'designation_list': '1 v\n4 c b:provB'})
+        self.assertRedirects(response, reverse('distribute:patient_assignments'))
+        patients = Patient.objects.order_by('number_designation')
+        self.assertEqual([(patient.CCU, patient.COVID) for patient in patients],
+                         [(False, True), (False, False), (False, False), (True, False)])
+        self.assertEqual(patients[3].patient_assignment_line_item.provider.abbreviation, 'provB')
+        for patient in patients:
+            self.assertIsNotNone(patient.patient_assignment_line_item)
+
+    def test_posting_invalid_designation_list_rerenders_page_with_errors(self):
+        url = reverse('distribute:designate_patients')
+        response = self.client.post(url, data={'designation_list': '7 c'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['designation_list_form'].errors['designation_list'],
+                         ['line 1: there is no patient 7'])
+        self.assertFalse(Patient.objects.filter(patient_assignment_line_item__isnull=False).exists())
+
+    def test_patients_who_dont_fit_under_the_caps_rerender_page_with_errors(self):
+        Distribution.objects.last().line_items.update(max_COVID=0)
+        response = self.client.post(reverse('distribute:designate_patients'), data={'designation_list': '1 v'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['designation_list_form'].non_field_errors(),
+                         ['Only 0 of the 1 COVID patients fit under the rounders\' caps'])
+        self.assertFalse(Patient.objects.filter(patient_assignment_line_item__isnull=False).exists())
+
+
+class AssignmentJobViewTests(TestCase):
+    def setUp(self):
+        helper_fxn_create_distribution_with_4_sample_line_items()
+        self.distribution = Distribution.objects.last()
+        for i in range(4):
+            Patient.objects.create(distribution=self.distribution, number_designation=i + 1)
+
+    @override_settings(BACKGROUND_ASSIGNMENT_MIN_PATIENTS=4)
+    def test_posting_a_large_distribution_redirects_to_its_job(self):
+        response = self.client.post(reverse('distribute:designate_patients'), data={'designation_list': '1 v'})
+        job = AssignmentJob.objects.get(distribution=self.distribution)
+        self.assertRedirects(response, reverse('distribute:assignment_job', args=[job.id]))
+        self.assertEqual(job.status, AssignmentJob.QUEUED)
+        self.assertFalse(Patient.objects.filter(patient_assignment_line_item__isnull=False).exists())
+
+    def test_status_page_polls_until_the_job_is_done(self):
+        job = AssignmentJob.objects.enqueue(self.distribution)
+        response = self.client.get(reverse('distribute:assignment_job', args=[job.id]))
+        self.assertTemplateUsed(response, 'distribute_patients/assignment_job.html')
+        self.assertContains(response, reverse('distribute:poll_assignment_job', args=[job.id]))
+        self.assertEqual(self.client.get(reverse('distribute:poll_assignment_job', args=[job.id])).json(),
+                         {'status': 'queued', 'done': False, 'error': ''})
+        run_assignment_job(job.id)
+        self.assertEqual(self.client.get(reverse('distribute:poll_assignment_job', args=[job.id])).json(),
+                         {'status': 'succeeded', 'done': True, 'error': ''})
+
+    def test_polling_a_missing_job_is_404(self):
+        self.assertEqual(self.client.get(reverse('distribute:poll_assignment_job', args=[99])).status_code, 404)
+
+
 class PatientAssignmentsViewTests(TestCase):
     def test_view_resolves_url(self):
         url = f'/distribute/patient_assignments/'
@@ -351,6 +426,100 @@ class PatientAssignmentsViewTests(TestCase):
         response = self.client.get(url)
         self.assertEqual(len(response.context['patient_assignment_dict']), 4)
 
+class AddLatePatientsViewTests(TestCase):
+    def setUp(self):
+        helper_fxn_create_distribution_with_4_sample_line_items()
+        self.distribution = Distribution.objects.last()
+        helper_fxn_create_motley_list_of_patients_assign_to_distribution(patient_count=6,
+                                                                         distribution=self.distribution)
+
+    def test_view_resolves_url(self):
+        view = resolve('/distribute/add_late_patients/')
+        self.assertEqual(view.view_name, 'distribute:add_late_patients')
+
+    def test_view_uses_correct_template(self):
+        response = self.client.get(reverse('distribute:add_late_patients'))
+        self.assertTemplateUsed(response, 'distribute_patients/add_late_patients.html')
+
+    def test_posting_before_distribution_is_assigned_shows_error(self):
+        response = self.client.post(reverse('distribute:add_late_patients'), data={'designation_list': '7 c'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context['late_patients_form'].is_valid())
+        self.assertEqual(Patient.objects.count(), 6)
+
+    def test_posting_new_patients_assigns_them_and_redirects_to_patient_assignments(self):
+        self.distribution.assign_all_patients()
+        response = self.client.post(reverse('distribute:add_late_patients'),
+                                    data={'designation_list': '7 c\n8\n9 v b:provA'})
+        self.assertRedirects(response, reverse('distribute:patient_assignments'))
+        late_patients = Patient.objects.filter(number_designation__gt=6).order_by('number_designation')
+        self.assertEqual([(patient.CCU, patient.COVID) for patient in late_patients],
+                         [(True, False), (False, False), (False, True)])
+        self.assertEqual(late_patients[2].patient_assignment_line_item.provider.abbreviation, 'provA')
+
+    def test_posting_existing_patient_number_shows_error(self):
+        self.distribution.assign_all_patients()
+        response = self.client.post(reverse('distribute:add_late_patients'), data={'designation_list': '3 c'})
+        self.assertEqual(response.context['late_patients_form'].errors['designation_list'],
+                         ['line 1: patient 3 has already been distributed'])
+
+    def test_late_patients_who_dont_fit_under_the_caps_show_error(self):
+        self.distribution.assign_all_patients()
+        self.distribution.line_items.update(max_CCU=0)
+        response = self.client.post(reverse('distribute:add_late_patients'), data={'designation_list': '7 c'})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Only 0 of the 1 CCU patients fit')
+        self.assertEqual(Patient.objects.count(), 6)
+
+
+class PastAssignmentsViewTests(TestCase):
+    def setUp(self):
+        helper_fxn_create_distribution_with_4_sample_line_items()
+        self.distribution = Distribution.objects.last()
+        helper_fxn_create_motley_list_of_patients_assign_to_distribution(patient_count=20,
+                                                                         distribution=self.distribution)
+
+    def test_view_resolves_url(self):
+        view = resolve('/distribute/past_assignments/1/')
+        self.assertEqual(view.view_name, 'distribute:past_assignments')
+
+    def test_view_returns_404_for_unassigned_distribution(self):
+        url = reverse('distribute:past_assignments', args=[self.distribution.id])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 404)
+
+    def test_view_renders_assigned_distribution_from_snapshot_in_one_query(self):
+        self.distribution.assign_all_patients()
+        url = reverse('distribute:past_assignments', args=[self.distribution.id])
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertTemplateUsed(response, 'distribute_patients/past_assignments.html')
+        self.assertEqual(len(response.context['snapshot']['line_items']), 4)
+
+    def test_past_distribution_is_labelled_with_its_own_date(self):
+        self.distribution.date = date(2020, 4, 1)
+        self.distribution.save()
+        self.distribution.assign_all_patients()
+        response = self.client.get(reverse('distribute:past_assignments', args=[self.distribution.id]))
+        self.assertEqual(response.context['date'], date(2020, 4, 1))
+        self.assertContains(response, 'Past Assignments - 4/1/20')
+
+    def test_export_returns_snapshot_json(self):
+        self.distribution.assign_all_patients()
+        url = reverse('distribute:export_past_assignments', args=[self.distribution.id])
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.json()['id'], self.distribution.id)
+
+    def test_outdated_snapshots_are_refrozen_rather_than_failing(self):
+        self.distribution.assign_all_patients()
+        Distribution.objects.filter(id=self.distribution.id).update(snapshot='{"version":0}', snapshot_version=0)
+        response = self.client.get(reverse('distribute:past_assignments', args=[self.distribution.id]))
+        self.assertEqual(len(response.context['snapshot']['line_items']), 4)
+        response = self.client.get(reverse('distribute:export_past_assignments', args=[self.distribution.id]))
+        self.assertEqual(len(response.json()['line_items']), 4)
+
+
 class COVIDLinksView(TestCase):
     def test_view_resolves_url(self):
         url = f'/covid_links/'
@@ -367,4 +536,69 @@ class COVIDLinksView(TestCase):
         helper_fxn_create_distribution_with_4_sample_line_items()
         url = reverse('covid_links')
         response = self.client.get(url)
-        self.assertTemplateUsed(response, 'covid_links.html')
\ No newline at end of file
+        self.assertTemplateUsed(response, 'covid_links.html')
+
+class AdminViewTests(TestCase):
+    def setUp(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.login(username='admin', password='password')
+        helper_fxn_create_distribution_with_4_sample_line_items()
+        self.distribution = Distribution.objects.last()
+        helper_fxn_create_motley_list_of_patients_assign_to_distribution(patient_count=20,
+                                                                         distribution=self.distribution)
+        self.distribution.assign_all_patients()
+
+    def count_changelist_queries(self, model_name):
+        url = reverse(f'admin:distribute_patients_{model_name}_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(queries)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        for model_name in ['distribution', 'patientassignmentlineitem', 'patient', 'provider']:
+            before = self.count_changelist_queries(model_name)
+            Patient.objects.bulk_create(Patient(distribution=self.distribution, number_designation=i + 21,
+                                                patient_assignment_line_item=self.distribution.line_items.first())
+                                        for i in range(20))
+            self.assertEqual(self.count_changelist_queries(model_name), before, model_name)
+
+    def test_line_item_changelist_shows_census_values(self):
+        line_item = self.distribution.line_items.select_related('assigned_census').first()
+        response = self.client.get(reverse('admin:distribute_patients_patientassignmentlineitem_changelist'))
+        census = line_item.assigned_census
+        self.assertContains(response, f'{census.total} ({census.CCU}) [{census.COVID}]')
+
+    def count_change_page_queries(self):
+        url = reverse('admin:distribute_patients_distribution_change', args=[self.distribution.id])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return response, len(queries)
+
+    def test_distribution_change_page_has_line_items_and_patients_and_links_to_its_patients(self):
+        response, query_count = self.count_change_page_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['inline_admin_formsets'][0].formset.queryset.count(), 4)
+        self.assertEqual(response.context['inline_admin_formsets'][1].formset.queryset.count(), 20)
+        patients_url = reverse('admin:distribute_patients_patient_changelist') + \
+            f'?distribution__id__exact={self.distribution.id}'
+        self.assertContains(response, f'<a href="{patients_url}">20 patients</a>', html=True)
+        response = self.client.get(patients_url)
+        self.assertEqual(response.context['cl'].result_count, 20)
+
+    def test_distribution_change_page_queries_do_not_grow_with_rows(self):
+        before = self.count_change_page_queries()[1]
+        Patient.objects.bulk_create(Patient(distribution=self.distribution, number_designation=i + 21,
+                                            bounce_to=Provider.objects.first(),
+                                            patient_assignment_line_item=self.distribution.line_items.first())
+                                    for i in range(40))
+        line_item = self.distribution.line_items.first()
+        PatientAssignmentLineItem.objects.create_line_item(
+            distribution=self.distribution, provider=Provider.objects.create(abbreviation='provE'), starting_total=1,
+            starting_CCU=0, starting_COVID=0, position_in_batting_order=line_item.position_in_batting_order + 10)
+        self.assertEqual(self.count_change_page_queries()[1], before)
+
+    def test_paginator_count_stops_at_the_cap(self):
+        paginator = EstimatedCountPaginator(Patient.objects.order_by('id'), 5)
+        paginator.count_cap = 12
+        self.assertEqual(paginator.count, 12)
+        self.assertEqual(len(paginator.page(2)), 5)
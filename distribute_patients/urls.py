@@ -7,5 +7,11 @@ urlpatterns = [
 path('edit_count/', views.edit_count_to_distribute, name='edit_count'),
 # path('submit_count/', views.submit_count, name='submit_count'),
 path('designate_patients/', views.designate_patients,name='designate_patients'),
-path('patient_assignments/', views.patient_assignments, name='patient_assignments')
+path('patient_assignments/', views.patient_assignments, name='patient_assignments'),
+path('assignment_job/<int:job_id>/', views.assignment_job, name='assignment_job'),
+path('assignment_job/<int:job_id>/poll/', views.poll_assignment_job, name='poll_assignment_job'),
+path('add_late_patients/', views.add_late_patients, name='add_late_patients'),
+path('past_assignments/<int:distribution_id>/', views.past_assignments, name='past_assignments'),
+path('past_assignments/<int:distribution_id>/export/', views.export_past_assignments,
+     name='export_past_assignments'),
 ]
\ No newline at end of file
@@ -1,12 +1,20 @@
+from datetime import date
+
 from django import forms
-from django.shortcuts import render, redirect, reverse
+from django.core.exceptions import ValidationError
+from django.http import Http404, HttpResponse, JsonResponse
+from django.shortcuts import render, redirect, reverse, get_object_or_404
 from django.views.generic.edit import CreateView
 from django.utils import timezone
 
+from . import jobs, limits
 from .helper_fxns import date_str_to_date
 
-from .forms import PatientCountForm, BasePatientDesignateFormSet, RounderForm, BaseRounderFormSet
-from .models import Distribution, Patient, Provider
+from .forms import PatientCountForm, BasePatientDesignateFormSet, RounderForm, BaseRounderFormSet, \
+    PatientDesignationListForm, LatePatientsForm
+from .models import AssignmentJob, Distribution, Patient, Provider, ProviderDailyStats
+
+ROLLING_LOAD_DAYS = 7
 
 
 def set_rounders(request):
@@ -18,7 +26,9 @@ def set_rounders(request):
             return redirect(reverse('distribute:edit_count'))
     else:
         rounder_formset = RounderFormSet()
-        context = {'date': timezone.localdate(), 'rounder_formset': rounder_formset}
+        context = {'date': timezone.localdate(), 'rounder_formset': rounder_formset,
+                   'rolling_load_days': ROLLING_LOAD_DAYS,
+                   'rolling_loads': ProviderDailyStats.objects.get_rolling_loads(days=ROLLING_LOAD_DAYS)}
         return render(request, 'distribute_patients/set_rounders.html', context=context)
 
 
@@ -29,8 +39,8 @@ def edit_count_to_distribute(request):
         if form.is_valid():
             distribution = form.save()
             # distribution.add_duplicated_line_items_from_prior_distribution()
-            for i in range(distribution.count_to_distribute):
-                Patient.objects.create(distribution=distribution, number_designation=i + 1)
+            Patient.objects.bulk_create(Patient(distribution=distribution, number_designation=i + 1)
+                                        for i in range(distribution.count_to_distribute))
             # duplicates the providers, starting
             # census from previous distribution
             return redirect(reverse('distribute:designate_patients'))
@@ -46,39 +56,110 @@ def designate_patients(request):
     PatientDesignateFormSet = forms.modelformset_factory(model=Patient,
                                                          fields=['CCU', 'COVID', 'bounce_to'],
                                                          formset=BasePatientDesignateFormSet)
-    if request.method == 'POST':
+    designation_list_form = PatientDesignationListForm(distribution=distribution)
+    if request.method == 'POST' and 'designation_list' in request.POST:  # compact list instead of the formset
+        designation_list_form = PatientDesignationListForm(distribution=distribution, data=request.POST)
+        if designation_list_form.is_valid():
+            designation_list_form.save()
+            response = assign_patients_and_redirect(distribution, designation_list_form)
+            if response:
+                return response
+    elif request.method == 'POST':
         formset = PatientDesignateFormSet(distribution_id=distribution.id, data=request.POST)
-        if formset.is_valid():
-            formset.save()
+        if not formset.is_valid():
+            return redirect(reverse('distribute:patient_assignments'))
+        formset.save()
+        response = assign_patients_and_redirect(distribution, designation_list_form)
+        if response:
+            return response
+    patient_count = distribution.patient_set.count()
+    formset = None  # large distributions only get the designation list
+    if patient_count <= limits.get_max_designate_formset_patients():
+        formset = PatientDesignateFormSet(distribution_id=distribution.id)
+    context = {'date': timezone.localdate(), 'ordered_line_items': distribution.get_ordered_line_items(),
+               'formset': formset, 'patient_count': patient_count, 'designation_list_form': designation_list_form}
+    return render(request, 'distribute_patients/designate_patients.html', context=context)
+
+
+def assign_patients_and_redirect(distribution, form):
+    """assigns small distributions in the request; large ones become a background job with a status page.  when
+    the patients can't be assigned (e.g. they don't fit under the rounders' caps) the reason is added to form's
+    errors and None is returned, for the page to be shown again"""
+    if distribution.patient_set.count() < jobs.get_min_patients():
+        try:
             distribution.assign_all_patients()
+        except ValidationError as error:
+            form.add_error(None, error)
+            return None
         return redirect(reverse('distribute:patient_assignments'))
-    else:
-        formset = PatientDesignateFormSet(distribution_id=distribution.id)
-        context = {'date': timezone.localdate(), 'ordered_line_items': distribution.get_ordered_line_items(),
-                   'formset': formset}
-        return render(request, 'distribute_patients/designate_patients.html', context=context)
+    job = AssignmentJob.objects.enqueue(distribution)
+    return redirect(reverse('distribute:assignment_job', args=[job.id]))
+
+
+def assignment_job(request, job_id):
+    job = get_object_or_404(AssignmentJob, id=job_id)
+    context = {'date': timezone.localdate(), 'job': job}
+    return render(request, 'distribute_patients/assignment_job.html', context=context)
+
+
+def poll_assignment_job(request, job_id):
+    status, error = get_object_or_404(AssignmentJob.objects.values_list('status', 'error'), id=job_id)
+    return JsonResponse({'status': status, 'done': status in [AssignmentJob.SUCCEEDED, AssignmentJob.FAILED],
+                         'error': error})
 
 
 def patient_assignments(request):
     distribution = Distribution.objects.last()
-    patient_assignment_dict = {}
-    for line_item in distribution.get_ordered_line_items():
-        assigned_patient_dict = {}
-        bounceback_pts = line_item.assigned_patients.filter(bounce_to__isnull=False)
-        dual_pos_pts = line_item.assigned_patients.filter(bounce_to__isnull=True, COVID=True, CCU=True)
-        ccu_pos_pts = line_item.assigned_patients.filter(bounce_to__isnull=True, COVID=False, CCU=True)
-        covid_pos_pts = line_item.assigned_patients.filter(bounce_to__isnull=True, COVID=True, CCU=False)
-        dual_neg_pts = line_item.assigned_patients.filter(bounce_to__isnull=True, COVID=False, CCU=False)
-        assigned_patient_dict.update(
-            {'bounceback_pts': bounceback_pts, 'dual_pos_pts': dual_pos_pts, 'ccu_pos_pts': ccu_pos_pts,
-             'covid_pos_pts': covid_pos_pts, 'dual_neg_pts': dual_neg_pts})
-        patient_assignment_dict.update(
-            {line_item: assigned_patient_dict})
-    context = {'date': timezone.localdate(), 'ordered_line_items': distribution.get_ordered_line_items(),
+    ordered_line_items = distribution.get_ordered_line_items().select_related('provider', 'starting_census',
+                                                                              'assigned_census')
+    patient_buckets_by_line_item_id = distribution.get_patient_buckets_by_line_item_id()
+    patient_assignment_dict = {line_item: patient_buckets_by_line_item_id[line_item.id]
+                               for line_item in ordered_line_items}
+    context = {'date': timezone.localdate(), 'distribution': distribution,
+               'ordered_line_items': ordered_line_items,
                'patient_assignment_dict': patient_assignment_dict}
     return render(request, 'distribute_patients/patient_assignments.html', context=context)
 
 
+def add_late_patients(request):
+    distribution = Distribution.objects.last()
+    form = LatePatientsForm(distribution=distribution)
+    if request.method == 'POST':
+        form = LatePatientsForm(distribution=distribution, data=request.POST)
+        if form.is_valid():
+            try:
+                form.save()
+            except ValidationError as error:  # e.g. the late patients don't fit under the rounders' caps
+                form.add_error(None, error)
+            else:
+                return redirect(reverse('distribute:patient_assignments'))
+    context = {'date': timezone.localdate(), 'ordered_line_items': distribution.get_ordered_line_items(),
+               'late_patients_form': form}
+    return render(request, 'distribute_patients/add_late_patients.html', context=context)
+
+
+def get_snapshot_or_404(distribution_id):
+    distribution = get_object_or_404(Distribution.objects.only('id', 'snapshot', 'snapshot_version'),
+                                     id=distribution_id)
+    if distribution.snapshot is None:
+        raise Http404('That distribution has not been assigned yet')
+    return distribution
+
+
+def past_assignments(request, distribution_id):
+    snapshot = get_snapshot_or_404(distribution_id).get_snapshot()
+    context = {'date': date.fromisoformat(snapshot['date']), 'snapshot': snapshot}
+    return render(request, 'distribute_patients/past_assignments.html', context=context)
+
+
+def export_past_assignments(request, distribution_id):
+    distribution = get_snapshot_or_404(distribution_id)
+    distribution.get_snapshot()  # re-freezes snapshots written in an outdated format
+    response = HttpResponse(distribution.snapshot, content_type='application/json')
+    response['Content-Disposition'] = f'attachment; filename="distribution_{distribution.id}.json"'
+    return response
+
+
 def covid_links(request):
     links = {
         "Evergreen 'Lessons Learned'": 'http://www.evergreenhealth.com/covid-19-lessons',
@@ -11,6 +11,12 @@ import os
 
 from django.core.asgi import get_asgi_application
 
+from distribute_patients.events import AssignmentEventsApp
+from .startup import precompile_templates_if_enabled
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sqllitetest.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+precompile_templates_if_enabled()
+
+application = AssignmentEventsApp(django_application)  # streams the assignment board, see events.py
@@ -35,10 +35,6 @@ DATABASES = {
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
     }
 }
-print(f'debug is {DEBUG}')
-for host in ALLOWED_HOSTS:
-    print(host)
-print(DATABASES['default']['ENGINE'])
 # Application definition
 
 INSTALLED_APPS = [
@@ -132,4 +128,16 @@ INTERNAL_IPS = ['127.0.0.1']
 
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
+ASSIGNMENT_PHASE_HOOKS = []  # e.g. ['distribute_patients.instrumentation.log_phase'], see instrumentation.py
+
+BACKGROUND_ASSIGNMENT_MIN_PATIENTS = 200  # larger distributions are assigned by a background job, see jobs.py
+ASSIGNMENT_JOB_WORKERS = 2
+
+ASSIGNMENT_EVENTS_POLL_SECONDS = 2  # how often the asgi app checks the assignment board for changes
+
+LARGE_FACILITY_MODE = False  # hundreds of rounders and thousands of patients, see distribute_patients/limits.py
+DATA_UPLOAD_MAX_NUMBER_FIELDS = 2000 if LARGE_FACILITY_MODE else 1000  # a 300 rounder formset posts 1504 fields
+
+PRECOMPILE_TEMPLATES = False  # compile every template when the wsgi/asgi application loads, see startup.py
+
 STATIC_ROOT = os.path.join(BASE_DIR, "static/")
@@ -0,0 +1,39 @@
+"""
+Production settings for sqllitetest: the base settings less the dev-only debug toolbar, with the cached template
+loader and every template compiled when the application loads.
+
+Use with DJANGO_SETTINGS_MODULE=sqllitetest.settings_production and DJANGO_SECRET_KEY (and SITENAME) set.
+"""
+
+from .settings import *  # noqa: F401,F403
+
+DEBUG = False
+SECRET_KEY = os.environ['DJANGO_SECRET_KEY']
+ALLOWED_HOSTS = [host for host in [os.environ.get('SITENAME'), '178.128.72.92', 'localhost'] if host]
+
+DEV_ONLY_APPS = ['debug_toolbar']
+DEV_ONLY_MIDDLEWARE = ['debug_toolbar.middleware.DebugToolbarMiddleware']
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in DEV_ONLY_APPS]
+MIDDLEWARE = [middleware for middleware in MIDDLEWARE if middleware not in DEV_ONLY_MIDDLEWARE]
+
+TEMPLATES = [
+    {
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'DIRS': [os.path.join(BASE_DIR, 'templates')],
+        'OPTIONS': {
+            'context_processors': [
+                'django.template.context_processors.request',
+                'django.contrib.auth.context_processors.auth',
+                'django.contrib.messages.context_processors.messages',
+            ],
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
+        },
+    },
+]
+
+PRECOMPILE_TEMPLATES = True
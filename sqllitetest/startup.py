@@ -0,0 +1,75 @@
+"""
+Boot helpers for the wsgi/asgi entry points: precompiling templates so the first request doesn't pay for it, and
+measuring how long a cold worker takes to become ready and to serve its first request.
+
+``python -m sqllitetest.startup --path /`` boots the project in this process and prints one json line of timings
+in milliseconds; the measure_startup management command runs that in fresh processes.
+"""
+import argparse
+import json
+import os
+import time
+from wsgiref.util import setup_testing_defaults
+
+
+def precompile_templates():
+    """loads every template the configured engines can find, so cached loaders start out warm.  returns the
+    number compiled"""
+    from django.template import TemplateDoesNotExist, TemplateSyntaxError, engines
+    from django.template.utils import get_app_template_dirs
+    compiled = 0
+    for engine in engines.all():  # app directories too, as loaders may be configured explicitly instead of APP_DIRS
+        for template_dir in dict.fromkeys([*engine.dirs, *get_app_template_dirs('templates')]):
+            for directory, _, file_names in os.walk(template_dir):
+                for file_name in file_names:
+                    if not file_name.endswith(('.html', '.txt')):
+                        continue
+                    template_name = os.path.relpath(os.path.join(directory, file_name), template_dir)
+                    try:
+                        engine.get_template(template_name.replace(os.sep, '/'))
+                    except (TemplateDoesNotExist, TemplateSyntaxError):
+                        continue  # e.g. templates for apps that aren't installed in this profile
+                    compiled += 1
+    return compiled
+
+
+def precompile_templates_if_enabled():
+    from django.conf import settings
+    if getattr(settings, 'PRECOMPILE_TEMPLATES', False):
+        precompile_templates()
+
+
+def measure(path='/'):
+    """boots django in this process as the wsgi entry point does, then serves path twice"""
+    timings = {}
+    start = time.perf_counter()
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sqllitetest.settings')
+    import django
+    from django.core.handlers.wsgi import WSGIHandler
+    django.setup(set_prefix=False)
+    timings['setup_ms'] = (time.perf_counter() - start) * 1000
+    phase_start = time.perf_counter()
+    application = WSGIHandler()
+    timings['application_ms'] = (time.perf_counter() - phase_start) * 1000
+    phase_start = time.perf_counter()
+    precompile_templates_if_enabled()
+    timings['precompile_ms'] = (time.perf_counter() - phase_start) * 1000
+    timings['ready_ms'] = (time.perf_counter() - start) * 1000
+    for request_name in ['first_request', 'second_request']:
+        environ = {'PATH_INFO': path, 'HTTP_HOST': 'localhost'}
+        setup_testing_defaults(environ)
+        statuses = []
+        phase_start = time.perf_counter()
+        response = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+        for _ in response:
+            pass
+        response.close()
+        timings[f'{request_name}_ms'] = (time.perf_counter() - phase_start) * 1000
+        timings[f'{request_name}_status'] = int(statuses[0].split()[0])
+    return timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', default='/')
+    print(json.dumps(measure(parser.parse_args().path)))
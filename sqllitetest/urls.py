@@ -13,11 +13,10 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 
-from .settings import DEBUG
-
 from distribute_patients.views import set_rounders, covid_links
 
 
@@ -27,9 +26,9 @@ urlpatterns = [
     path('covid_links/', covid_links, name='covid_links'),
     path('', set_rounders, name='set_rounders'),
 ]
-if DEBUG:
+if settings.DEBUG and 'debug_toolbar' in settings.INSTALLED_APPS:
     import debug_toolbar
 
     urlpatterns += [
         path('__debug__/', include(debug_toolbar.urls)),
-    ]
\ No newline at end of file
+    ]
@@ -11,6 +11,9 @@ import os
 
 from django.core.wsgi import get_wsgi_application
 
+from .startup import precompile_templates_if_enabled
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sqllitetest.settings')
 
 application = get_wsgi_application()
+precompile_templates_if_enabled()